@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class RosterizerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rosterizer'
+
+    def ready(self):
+        # connect the signal handlers that keep team pairs, the session timeline and cached roster scores up to date
+        from . import roster_cache, team_history, utilities
@@ -0,0 +1,63 @@
+import pytest
+from django.test import RequestFactory
+
+from rosterizer.models import Player, PlayerSession, Session
+from .roster_engine import SessionSnapshot, SnapshotPlayer, resolve_partners
+
+SEATS = ('Skip', 'Vice', 'Second', 'Lead')
+
+@pytest.fixture
+def rf():
+    return RequestFactory()
+
+@pytest.fixture
+def session(db):
+    return Session.objects.create(year=2024, session_number=1)
+
+@pytest.fixture
+def make_players(db):
+    '''Returns a function creating `count` players named First0 Last0, First1 Last1, ...'''
+    def make(count):
+        return [Player.objects.create(first_name=f'First{i}', last_name=f'Last{i}') for i in range(count)]
+    return make
+
+@pytest.fixture
+def add_player_sessions(make_players):
+    '''
+    Returns a function adding players to a session, creating First0 Last0, ... unless `players` are given.
+
+    Player i prefers positions[i] first, cycling through `positions`, and positions[i + second_shift] second when
+    `second_shift` is set. Every `partner_every`th player asks to play with the next one.
+    '''
+    def add(session, count=8, positions=SEATS, second_shift=None, partner_every=None, players=None):
+        players = make_players(count) if players is None else players
+        return [
+            PlayerSession.objects.create(
+                player=player, session=session, years_curled=1, preferred_position1=positions[i % len(positions)],
+                preferred_position2=positions[(i + second_shift) % len(positions)] if second_shift is not None else '',
+                play_with=f'First{i + 1} Last{i + 1}' if partner_every and i % partner_every == 0 else '')
+            for i, player in enumerate(players)
+        ]
+    return add
+
+@pytest.fixture
+def session_players(session, add_player_sessions):
+    '''A session of 8 players, two for every position'''
+    return session, add_player_sessions(session)
+
+def build_snapshot(rows):
+    players = []
+    for i, row in enumerate(rows):
+        name, position1, position2, play_with = row if len(row) == 4 else (f'Player {i + 1}', *row)
+        players.append(SnapshotPlayer(index=i, id=i + 1, player_id=i + 1, full_name=name, years_curled=1,
+                                      preferred_position1=position1, preferred_position2=position2, play_with=play_with))
+    resolve_partners(players)
+    return SessionSnapshot(1, players)
+
+@pytest.fixture
+def make_snapshot():
+    '''
+    Returns a function building a snapshot without touching the database, from (position1, position2, play_with)
+    tuples for players named Player 1, Player 2, ..., or from (full_name, position1, position2, play_with) tuples
+    '''
+    return build_snapshot
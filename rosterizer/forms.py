@@ -1,5 +1,7 @@
 from django import forms
+from django.conf import settings
 from .models import Session
+from .team_generation import ASSIGNMENTS
 
 class SessionForm(forms.ModelForm):
 	class Meta:
@@ -10,4 +12,33 @@ class PlayerImportForm(forms.Form):
     player_file = forms.FileField(label='Select an HTML file from CCM, or a CSV export if you have corrections')
 
 class RosterImportForm(forms.Form):
-    roster_file = forms.FileField(label='Select a roster file')
\ No newline at end of file
+    roster_file = forms.FileField(label='Select a roster file')
+
+# the most rosters that can be generated or kept for review at once; larger requests are clamped to these
+MAX_NUM_ROSTERS = 10000
+MAX_KEEP = 100
+
+def max_time_budget():
+    return getattr(settings, 'ROSTERIZER_MAX_TIME_BUDGET', 60)
+
+class GenerateTeamsForm(forms.Form):
+    num_rosters = forms.IntegerField(min_value=1, required=False)
+    # FloatField rejects nan and infinity
+    time_budget = forms.FloatField(min_value=0, required=False)
+    keep = forms.IntegerField(min_value=1, required=False)
+    assignment = forms.ChoiceField(choices=ASSIGNMENTS, required=False)
+
+    def clean_num_rosters(self):
+        num_rosters = self.cleaned_data['num_rosters']
+        return 1 if num_rosters is None else min(num_rosters, MAX_NUM_ROSTERS)
+
+    def clean_time_budget(self):
+        time_budget = self.cleaned_data['time_budget']
+        return 0 if time_budget is None else min(time_budget, max_time_budget())
+
+    def clean_keep(self):
+        keep = self.cleaned_data['keep']
+        return 10 if keep is None else min(keep, MAX_KEEP)
+
+    def clean_assignment(self):
+        return self.cleaned_data['assignment'] or 'random'
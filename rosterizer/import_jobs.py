@@ -0,0 +1,165 @@
+# rosterizer/import_jobs.py
+#
+# Background imports. An upload view records an ImportJob and hands it to a small pool of worker threads in the
+# web process, so the request returns at once and the page polls the job for progress. Everything runs locally;
+# there is no broker. With ROSTERIZER_IMPORT_WORKERS = 0 jobs run inline instead, which the tests rely on.
+# A job whose worker goes away, e.g. when the server restarts, would stay queued or running forever, so jobs that
+# stop reporting for ROSTERIZER_IMPORT_JOB_TIMEOUT seconds are marked failed when their status is next read.
+# A process reports for the jobs waiting in its queue as well as for the one it runs, so a job queued behind a
+# long import stays alive, and a process never fails the jobs still waiting in its own queue.
+
+import io
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+
+from rosterizer.management.commands.import_players import ImportPlayersCommand
+from rosterizer.management.commands.import_roster import ImportRosterCsvCommand
+from .models import ImportJob
+
+# seconds between progress writes, so a large file does not cost one UPDATE per row
+PROGRESS_INTERVAL = 0.5
+
+# directory of the default storage where uploads wait for their job
+UPLOAD_DIR = 'imports'
+
+_executor = None
+
+# ids of the jobs submitted to this process's workers that have not finished yet
+_pending_jobs = set()
+_pending_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'ROSTERIZER_IMPORT_WORKERS', 1), thread_name_prefix='rosterizer-import')
+    return _executor
+
+# Queue a job for an uploaded file. It starts once the transaction that created it commits, so the worker always finds the row.
+# Inline jobs parse the upload's chunks as they come. Queued jobs outlive the request, so the upload is written chunk by chunk
+# to the default storage and the job keeps its path; the file is deleted once the job finishes.
+def start_import_job(job, upload):
+    if getattr(settings, 'ROSTERIZER_IMPORT_WORKERS', 1) <= 0:
+        run_import_job(job.pk, source=upload.chunks())
+        return
+    job.upload_path = default_storage.save(f'{UPLOAD_DIR}/{job.pk}-{default_storage.get_valid_name(upload.name)}', upload)
+    job.save(update_fields=['upload_path'])
+    transaction.on_commit(lambda: _submit(job.pk))
+
+def _submit(job_id):
+    with _pending_lock:
+        _pending_jobs.add(job_id)
+    get_executor().submit(_run_in_worker, job_id)
+
+def pending_job_ids():
+    with _pending_lock:
+        return set(_pending_jobs)
+
+def delete_upload(upload_path):
+    if upload_path:
+        default_storage.delete(upload_path)
+
+def _run_in_worker(job_id):
+    try:
+        run_import_job(job_id)
+    finally:
+        with _pending_lock:
+            _pending_jobs.discard(job_id)
+        # worker threads get their own database connection, which Django does not close for them
+        connection.close()
+
+class ProgressReporter:
+    """
+    Records the rows read so far on the job, at most once every PROGRESS_INTERVAL seconds, and the switch
+    to writing once every row is read. Every write also refreshes the job's heartbeat.
+    """
+    def __init__(self, job):
+        self.job = job
+        self.rows = 0
+        self.written_at = 0.0
+
+    def __call__(self, rows, writing=False):
+        self.rows = rows
+        if writing:
+            self.job.phase = ImportJob.Phase.WRITING
+        now = time.monotonic()
+        if writing or now - self.written_at >= PROGRESS_INTERVAL:
+            self.flush()
+            self.written_at = now
+
+    def flush(self):
+        now = timezone.now()
+        ImportJob.objects.filter(pk=self.job.pk).update(processed_rows=self.rows, phase=self.job.phase, heartbeat_at=now)
+        self.job.processed_rows = self.rows
+        refresh_queued_jobs(now)
+
+# Refresh the heartbeat of the jobs waiting in this process's queue, which are alive for as long as it is
+def refresh_queued_jobs(now=None):
+    pending = pending_job_ids()
+    if pending:
+        ImportJob.objects.filter(pk__in=pending, status=ImportJob.Status.QUEUED).update(heartbeat_at=now or timezone.now())
+
+def import_job_timeout():
+    return timedelta(seconds=getattr(settings, 'ROSTERIZER_IMPORT_JOB_TIMEOUT', 10 * 60))
+
+# Mark failed the queued and running jobs that have not reported for longer than the timeout, leaving alone the ones
+# waiting in this process's queue. Returns how many there were.
+def fail_stale_import_jobs():
+    now = timezone.now()
+    stale = ImportJob.objects.filter(status__in=[ImportJob.Status.QUEUED, ImportJob.Status.RUNNING], heartbeat_at__lt=now - import_job_timeout())
+    stale = stale.exclude(status=ImportJob.Status.QUEUED, pk__in=pending_job_ids())
+    upload_paths = list(stale.exclude(upload_path='').values_list('upload_path', flat=True))
+    failed = stale.update(status=ImportJob.Status.FAILED, message='The import stopped without finishing, for example because the server restarted. Please upload the file again.',
+                          upload_path='', finished_at=now)
+    for upload_path in upload_paths:
+        delete_upload(upload_path)
+    return failed
+
+# Run one import job to completion and record the outcome on it. `source` is the export to read, by default the job's upload.
+def run_import_job(job_id, source=None):
+    # claim the job, unless it already ran or was given up on while it waited in the queue
+    now = timezone.now()
+    claimed = ImportJob.objects.filter(pk=job_id, status=ImportJob.Status.QUEUED).update(status=ImportJob.Status.RUNNING, started_at=now, heartbeat_at=now)
+    job = ImportJob.objects.get(pk=job_id)
+    if not claimed:
+        return job
+
+    output = io.StringIO()
+    progress = ProgressReporter(job)
+    upload_file = None
+    try:
+        if source is None:
+            if not job.upload_path:
+                raise ValueError(f'Upload of {job.file_name} is missing')
+            # the commands read the stored file through open_import_source like any other binary file
+            source = upload_file = default_storage.open(job.upload_path, 'rb')
+        if job.kind == ImportJob.Kind.PLAYERS:
+            ImportPlayersCommand(stdout=output).handle(player_file=source, session_id=job.session_id, progress=progress)
+        else:
+            ImportRosterCsvCommand(stdout=output).handle(roster_file=source, session_id=job.session_id, create_teams=job.create_teams, progress=progress)
+        job.status = ImportJob.Status.SUCCEEDED
+        job.message = output.getvalue().strip()
+    except Exception as e:
+        logging.exception(f'Import job {job.pk} failed')
+        job.status = ImportJob.Status.FAILED
+        job.message = f'{output.getvalue()}{e}'.strip()
+
+    # the upload is only needed until it has been read
+    if upload_file is not None:
+        upload_file.close()
+    delete_upload(job.upload_path)
+    job.upload_path = ''
+    job.processed_rows = progress.rows
+    job.total_rows = progress.rows
+    job.finished_at = job.heartbeat_at = timezone.now()
+    job.save(update_fields=['status', 'message', 'upload_path', 'processed_rows', 'total_rows', 'finished_at', 'heartbeat_at'])
+    # the next job in the queue starts counting from here
+    refresh_queued_jobs(job.finished_at)
+    return job
@@ -1,8 +1,49 @@
 import os
-from bs4 import BeautifulSoup
+from lxml import etree
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from rosterizer import utilities
-from rosterizer.models import Player, Session, PlayerSession
+from rosterizer.models import Session
+
+# Stream the member rows of a Curling Club Manager HTML export, one dict of player and player session fields per row.
+# `source` is a path, a binary file such as an upload, or an iterator of byte chunks. Rows are parsed one at a time and
+# each parsed element is freed once read, so the parser never holds the whole document tree; the rows themselves are
+# the caller's to keep or drop. Only the first table of the export holds members.
+def read_player_rows(source):
+	html_file, close = utilities.open_import_source(source)
+	try:
+		for event, element in etree.iterparse(html_file, events=('end',), tag=('tr', 'table'), html=True, encoding='utf-8'):
+			if element.tag == 'table':
+				break
+			columns = [''.join(text.strip() for text in column.itertext()) for column in element.iterchildren('td')]
+			# free the row and everything parsed before it
+			element.clear()
+			while element.getprevious() is not None:
+				del element.getparent()[0]
+			if len(columns) < 18:
+				continue
+			yield player_row(columns)
+	finally:
+		if close:
+			html_file.close()
+
+# Map the columns of one export row to field values
+def player_row(columns):
+	first_name, last_name = utilities.parse_name(columns[1])
+	gender = columns[6] # assuming the first character is M or F
+	return {
+		'first_name': first_name.strip(),
+		'last_name': last_name.strip(),
+		'home_phone': columns[2],
+		'work_phone': columns[3],
+		'cell_phone': columns[4],
+		'email': columns[5],
+		'gender': gender[0].upper() if gender else None,
+		'years_curled': int(columns[7] or 0),
+		'preferred_position1': columns[13],
+		'preferred_position2': columns[14],
+		'play_with': columns[15],
+	}
 
 class ImportPlayersCommand(BaseCommand):
 	help = 'Import players from an HTML file and populate PlayerSession'
@@ -11,8 +52,10 @@ class ImportPlayersCommand(BaseCommand):
 		parser.add_argument('player_file', type=str, help='The path to the HTML or CSV file to be imported')
 		parser.add_argument('session_id', type=int, help='The ID of the session to associate players with')
 
+	# player_file may also be an open file or an iterator of byte chunks, which are read as HTML
 	def handle(self, *args, **kwargs):
-		if kwargs['player_file'].endswith('.html'):
+		player_file = kwargs['player_file']
+		if not isinstance(player_file, str) or player_file.endswith('.html'):
 			self.handle_html_file(**kwargs)
 		else:
 			raise NotImplementedError('Unsupported file format. Please use an HTML file')
@@ -27,54 +70,31 @@ class ImportPlayersCommand(BaseCommand):
 			self.stdout.write(self.style.ERROR(f'Session with ID {session_id} does not exist'))
 			return
 
-		if not os.path.exists(html_file):
+		if isinstance(html_file, str) and not os.path.exists(html_file):
 			self.stdout.write(self.style.ERROR(f'File {html_file} does not exist'))
 			return
 
-		with open(html_file, 'r', encoding='utf-8') as file:
-			soup = BeautifulSoup(file, 'lxml')
-			table = soup.find('table')
-			rows = table.find('tbody').find_all('tr')
-
-			for row in rows:
-				columns = row.find_all('td')
-				if len(columns) < 18:
-					continue
-
-				member_name = columns[1].get_text(strip=True)
-				home_phone = columns[2].get_text(strip=True)
-				work_phone = columns[3].get_text(strip=True)
-				cell_phone = columns[4].get_text(strip=True)
-				email = columns[5].get_text(strip=True)
-				gender = columns[6].text.strip()[0] # assuming the first character is M or F
-				years_curled = int(columns[7].get_text(strip=True) or 0)
-				preferred_position1 = columns[13].get_text(strip=True)
-				preferred_position2 = columns[14].get_text(strip=True)
-				play_with = columns[15].get_text(strip=True)
-
-				first_name, last_name = utilities.parse_name(member_name)
-
-				player, created = Player.objects.update_or_create(
-					first_name=first_name.strip(),
-					last_name=last_name.strip(),
-					defaults={
-						'home_phone': home_phone,
-						'work_phone': work_phone,
-						'cell_phone': cell_phone,
-						'email': email,
-						'gender': gender[0].upper() if gender else None
-					}
-				)
-
-				PlayerSession.objects.create(
-					player=player,
-					session=session,
-					years_curled=years_curled,
-					preferred_position1=preferred_position1,
-					preferred_position2=preferred_position2,
-					play_with=play_with
-				)
+		# progress, if given, is called with the number of rows read so far, then with writing=True once they are all
+		# read. Only the parse is streamed: every row is kept until the sync, which needs the whole file to know which
+		# player sessions were removed.
+		progress = kwargs.get('progress')
+		rows = []
+		for row in read_player_rows(html_file):
+			rows.append(row)
+			if progress:
+				progress(len(rows))
+		if progress:
+			progress(len(rows), writing=True)
 
-				self.stdout.write(self.style.SUCCESS(f'Processed player {first_name} {last_name}'))
+		# kept on the command for callers that want the counts, since handle() may only return text
+		self.summary = self.import_rows(session, rows)
+		utilities.resolve_play_with(session.id)
+		self.stdout.write(self.style.SUCCESS(f'Import completed successfully: {len(rows)} players read, {self.summary}'))
+		for hint in utilities.play_with_hints(session.id):
+			self.stdout.write(self.style.WARNING(hint))
 
-		self.stdout.write(self.style.SUCCESS('Import completed successfully'))
\ No newline at end of file
+	# Write the rows in one transaction, touching only the player sessions that differ from the file
+	def import_rows(self, session, rows):
+		with transaction.atomic():
+			_, summary = utilities.sync_session_players(session.id, rows)
+		return summary
@@ -1,10 +1,93 @@
-import os
+import contextlib
 import csv
+import io
+import os
+import logging
 from django.core.management.base import BaseCommand
-from bs4 import BeautifulSoup
-from rosterizer.models import Player, Session, PlayerSession, Team
+from django.db import transaction
+from rosterizer.models import Session, Team
 from rosterizer import utilities
+from rosterizer.roster_cache import score_cache
+from rosterizer.team_history import record_team_pairs
+
+POSITIONS = ['Skip', 'Vice', 'Second', 'Lead']
+
+# Read the member rows of a Curling Club Manager roster CSV export, one dict of field values per row.
+# `csvfile` is an open text file; see `open_roster_file` for paths, uploads and chunk iterators.
+def read_roster_rows(csvfile):
+    next(csvfile)  # Skip the extra header row
+    reader = csv.DictReader(csvfile)
+    for row in reader:
+        if 'Member Name' not in row:
+            continue
+        yield roster_row(row)
+
+# Open a roster export for `read_roster_rows`: a path, a text or binary file, or an iterator of byte chunks.
+# Binary sources are decoded as they are read, so an upload is parsed without being written to disk first.
+@contextlib.contextmanager
+def open_roster_file(source):
+    if isinstance(source, io.TextIOBase):
+        yield source
+        return
+    binary, close = utilities.open_import_source(source)
+    csvfile = io.TextIOWrapper(binary, encoding='utf-8', newline='')
+    try:
+        yield csvfile
+    finally:
+        if close:
+            csvfile.close()
+        else:
+            # the caller owns the file, so it is left open
+            csvfile.detach()
+
+# Map one CSV row to field values. The Skip/Vice/Second/Lead columns hold the team number of a player
+# in that position, so they give both the seat and, when the Team column is empty, the team.
+def roster_row(row):
+    first_name, last_name = utilities.parse_name(row['Member Name'])
+    position = next((position for position in POSITIONS if row.get(position)), None)
+    team = row.get('Team') or (row[position] if position else '')
+    return {
+        'first_name': first_name.strip(),
+        'last_name': last_name.strip(),
+        'home_phone': row['Home Phone'],
+        'work_phone': row['Work Phone'],
+        'cell_phone': row['Cell Phone'],
+        'email': row['Email'],
+        'gender': row['Gender'][0].upper() if row['Gender'] else None,
+        'years_curled': int(row['Years Curled'] or 0),
+        'preferred_position1': row['Preferred Position 1'],
+        'preferred_position2': row['Preferred Position 2'],
+        'play_with': row['Play With'],
+        'team_number': int(team) if team else None,
+        'position': position,
+    }
 
+# Seat the players of each team, keyed by team number. Players go to the seat of their position column first;
+# players without one, or whose seat is already taken, fill the open seats in row order.
+# Returns {team_number: {position: player id}}.
+def assemble_teams(rows, players):
+    seats_by_team = {}
+    unplaced = []
+    for row in rows:
+        if row['team_number'] is None:
+            continue
+        seats = seats_by_team.setdefault(row['team_number'], dict.fromkeys(POSITIONS))
+        player_id = players[(row['first_name'], row['last_name'])].pk
+        if player_id in seats.values():
+            continue
+        if row['position'] and seats[row['position']] is None:
+            seats[row['position']] = player_id
+        else:
+            unplaced.append((row['team_number'], player_id))
+
+    for team_number, player_id in unplaced:
+        seats = seats_by_team[team_number]
+        open_position = next((position for position in POSITIONS if seats[position] is None), None)
+        if open_position is None:
+            logging.warning(f'Team {team_number} is full, player {player_id} was not seated')
+            continue
+        seats[open_position] = player_id
+    return seats_by_team
 
 class ImportRosterCsvCommand(BaseCommand):
     help = 'Import players and optionally teams from a specified CSV file'
@@ -24,64 +107,69 @@ class ImportRosterCsvCommand(BaseCommand):
             self.stdout.write(self.style.ERROR(f'Session with ID {session_id} does not exist'))
             return
 
-        if not os.path.exists(roster_file):
+        if isinstance(roster_file, str) and not os.path.exists(roster_file):
             self.stdout.write(self.style.ERROR(f'File {roster_file} does not exist'))
             return
 
-        # Load the HTML file
-        with open(roster_file, encoding='utf-8') as csvfile:
-            next(csvfile)  # Skip the extra header row
-            reader = csv.DictReader(csvfile)
-
-            # Iterate over the rows and create Player instances
-            for row in reader:
-                if 'Member Name' not in row:
-                    continue
-
-                first_name, last_name = utilities.parse_name(row['Member Name'])
-                    
-                # Get or create Player
-                player, created = Player.objects.update_or_create(
-                    last_name=last_name.strip(),
-                    first_name=first_name.strip(),
-                    defaults={
-                        'home_phone': row['Home Phone'],
-                        'work_phone': row['Work Phone'],
-                        'cell_phone': row['Cell Phone'],
-                        'email': row['Email'],
-                        'gender': row['Gender'][0].upper() if row['Gender'] else None
-                    }
-                )
-
-                # Create PlayerSession
-                PlayerSession.objects.create(
-                    player=player,
-                    session_id=session_id,
-                    preferred_position1=row['Preferred Position 1'],
-                    preferred_position2=row['Preferred Position 2'],
-                    play_with=row['Play With'],
-                    years_curled=int(row['Years Curled'] or 0)
-                )
-
-                if kwargs['create_teams']:
-                    # Create or update Team
-                    team_number = int(row['Team']) if row['Team'] else None
-                    if team_number:
-                        team, _ = Team.objects.get_or_create(
-                            session_id=session_id, 
-                            team_number=team_number
-                        )
-
-                        # Assign players to team roles
-                        if team.skip is None:
-                            team.skip = player
-                        elif team.vice is None:
-                            team.vice = player
-                        elif team.second is None:
-                            team.second = player
-                        elif team.lead is None:
-                            team.lead = player
-
-                        team.save()
-
-        self.stdout.write(self.style.SUCCESS(f'Successfully imported roster from {roster_file} for session {session_id}'))
+        # progress, if given, is called with the number of rows read so far, then with writing=True once they are all
+        # read. Only the parse is streamed: every row is kept until the sync, which needs the whole file to know which
+        # player sessions were removed.
+        progress = kwargs.get('progress')
+        rows = []
+        with open_roster_file(roster_file) as csvfile:
+            for row in read_roster_rows(csvfile):
+                rows.append(row)
+                if progress:
+                    progress(len(rows))
+        if progress:
+            progress(len(rows), writing=True)
+
+        # Write players, player sessions and teams together, touching only what differs from the file.
+        # The summary is kept on the command for callers that want the counts, since handle() may only return text.
+        with transaction.atomic():
+            players, self.summary = utilities.sync_session_players(session_id, rows)
+            team_count = self.write_teams(session_id, rows, players) if kwargs['create_teams'] else 0
+
+        utilities.resolve_play_with(session_id)
+        source_name = roster_file if isinstance(roster_file, str) else getattr(roster_file, 'name', 'upload')
+        self.stdout.write(self.style.SUCCESS(f'Successfully imported roster from {source_name} for session {session_id}: '
+                                             f'{len(rows)} players, {self.summary}, {team_count} teams changed'))
+        for hint in utilities.play_with_hints(session_id):
+            self.stdout.write(self.style.WARNING(hint))
+
+    # Create or update the session's teams from the rows, writing only the teams whose seats change. Returns the number of teams written.
+    # Every team the file names is rebuilt from its rows alone, so a corrected file can move players between teams. Teams the file
+    # does not name keep their seats, except those of players who left the session or moved to a team of the file.
+    def write_teams(self, session_id, rows, players):
+        seats_by_team = assemble_teams(rows, players)
+        kept_ids = {player.pk for player in players.values()} - {player_id for seats in seats_by_team.values() for player_id in seats.values()}
+        existing = {team.team_number: team for team in Team.objects.filter(session_id=session_id)}
+        for team_number, team in existing.items():
+            if team_number not in seats_by_team:
+                seats = zip(POSITIONS, (team.skip_id, team.vice_id, team.second_id, team.lead_id))
+                seats_by_team[team_number] = {position: player_id if player_id in kept_ids else None for position, player_id in seats}
+
+        new_teams = []
+        changed_teams = []
+        for team_number in sorted(seats_by_team):
+            team = existing.get(team_number)
+            if team is None:
+                team = Team(session_id=session_id, team_number=team_number)
+                new_teams.append(team)
+            seats = tuple(seats_by_team[team_number][position] for position in POSITIONS)
+            if team.pk is not None and seats == (team.skip_id, team.vice_id, team.second_id, team.lead_id):
+                continue
+            team.skip_id, team.vice_id, team.second_id, team.lead_id = seats
+            if team.pk is not None:
+                changed_teams.append(team)
+
+        if not new_teams and not changed_teams:
+            return 0
+        if changed_teams:
+            Team.objects.bulk_update(changed_teams, ['skip', 'vice', 'second', 'lead'])
+        Team.objects.bulk_create(new_teams)
+        # bulk writes send no signals: record the team pairs and drop cached roster scores here
+        written = [team.team_number for team in new_teams + changed_teams]
+        record_team_pairs(Team.objects.filter(session_id=session_id, team_number__in=written))
+        score_cache.clear()
+        return len(written)
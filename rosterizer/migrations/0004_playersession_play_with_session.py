@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rosterizer', '0003_alter_player_first_name_alter_player_last_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playersession',
+            name='play_with_session',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='play_with_requests', to='rosterizer.playersession'),
+        ),
+        migrations.AddField(
+            model_name='playersession',
+            name='play_with_status',
+            field=models.CharField(blank=True, choices=[('', 'Not resolved'), ('resolved', 'Resolved'), ('unknown_player', 'No player with this name'), ('not_in_session', 'Player not registered in session'), ('self', 'Player named themselves')], default='', max_length=20),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:34
+
+from itertools import combinations
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_team_pairs(apps, schema_editor):
+    Team = apps.get_model('rosterizer', 'Team')
+    TeamPair = apps.get_model('rosterizer', 'TeamPair')
+    pairs = []
+    for team_id, session_id, *player_pks in Team.objects.values_list('pk', 'session_id', 'skip_id', 'vice_id', 'second_id', 'lead_id').iterator():
+        for player_a, player_b in combinations(sorted({pk for pk in player_pks if pk is not None}), 2):
+            pairs.append(TeamPair(team_id=team_id, session_id=session_id, player_a_id=player_a, player_b_id=player_b))
+    TeamPair.objects.bulk_create(pairs, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rosterizer', '0004_playersession_play_with_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeamPair',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('player_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='rosterizer.player')),
+                ('player_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='rosterizer.player')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='rosterizer.session')),
+                ('team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pairs', to='rosterizer.team')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['session', 'player_a', 'player_b'], name='rosterizer__session_f7eacf_idx')],
+                'constraints': [models.UniqueConstraint(fields=('team', 'player_a', 'player_b'), name='unique_team_pair')],
+            },
+        ),
+        migrations.RunPython(backfill_team_pairs, migrations.RunPython.noop),
+    ]
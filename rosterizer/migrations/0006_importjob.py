@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:43
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rosterizer', '0005_teampair'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('players', 'Players (HTML)'), ('roster', 'Roster (CSV)')], max_length=10)),
+                ('create_teams', models.BooleanField(default=False)),
+                ('file_name', models.CharField(max_length=255)),
+                ('upload_path', models.CharField(blank=True, max_length=255)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('phase', models.CharField(choices=[('reading', 'Reading rows'), ('writing', 'Writing players')], default='reading', max_length=10)),
+                ('processed_rows', models.IntegerField(default=0)),
+                ('total_rows', models.IntegerField(blank=True, null=True)),
+                ('message', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to='rosterizer.session')),
+            ],
+        ),
+    ]
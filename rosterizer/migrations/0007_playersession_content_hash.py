@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rosterizer', '0006_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playersession',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rosterizer', '0007_playersession_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RosterRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rosters', models.BinaryField()),
+                ('roster_count', models.IntegerField()),
+                ('scores', models.BinaryField(blank=True, null=True)),
+                ('explored', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='roster_runs', to='rosterizer.session')),
+            ],
+        ),
+    ]
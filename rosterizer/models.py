@@ -1,5 +1,6 @@
 import json
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 class Player(models.Model):
@@ -24,12 +25,24 @@ class Session(models.Model):
         return f'{self.year} - {self.session_number}'
     
 class PlayerSession(models.Model):
+    class PlayWithStatus(models.TextChoices):
+        UNRESOLVED = '', 'Not resolved'
+        RESOLVED = 'resolved', 'Resolved'
+        UNKNOWN_PLAYER = 'unknown_player', 'No player with this name'
+        NOT_IN_SESSION = 'not_in_session', 'Player not registered in session'
+        SELF = 'self', 'Player named themselves'
+
     player = models.ForeignKey(Player, on_delete=models.CASCADE)
     session = models.ForeignKey(Session, on_delete=models.CASCADE)
     years_curled = models.IntegerField()
     preferred_position1 = models.CharField(max_length=10)
     preferred_position2 = models.CharField(max_length=10)
     play_with = models.CharField(max_length=100)
+    # play_with resolved to the partner's PlayerSession in the same session, see utilities.resolve_play_with
+    play_with_session = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='play_with_requests')
+    play_with_status = models.CharField(max_length=20, choices=PlayWithStatus.choices, default=PlayWithStatus.UNRESOLVED, blank=True)
+    # hash of the import row this player session was last written from, see utilities.sync_session_players
+    content_hash = models.CharField(max_length=32, blank=True, default='')
     def __str__(self):
         return f'{self.player} - {self.session}'
     def to_dict(self):
@@ -49,8 +62,80 @@ class PlayerSession(models.Model):
             'preferred_position1': self.preferred_position1,
             'preferred_position2': self.preferred_position2,
             'play_with': self.play_with,
+            'play_with_session_id': self.play_with_session_id,
+            'play_with_status': self.play_with_status,
+        }
+
+class ImportJob(models.Model):
+    # An uploaded export being imported in the background, see import_jobs
+    class Kind(models.TextChoices):
+        PLAYERS = 'players', 'Players (HTML)'
+        ROSTER = 'roster', 'Roster (CSV)'
+
+    class Status(models.TextChoices):
+        QUEUED = 'queued', 'Queued'
+        RUNNING = 'running', 'Running'
+        SUCCEEDED = 'succeeded', 'Succeeded'
+        FAILED = 'failed', 'Failed'
+
+    class Phase(models.TextChoices):
+        READING = 'reading', 'Reading rows'
+        WRITING = 'writing', 'Writing players'
+
+    session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='import_jobs')
+    kind = models.CharField(max_length=10, choices=Kind.choices)
+    create_teams = models.BooleanField(default=False)
+    file_name = models.CharField(max_length=255)
+    # where the uploaded export waits in the default storage until the job has read it, see import_jobs
+    upload_path = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.QUEUED)
+    phase = models.CharField(max_length=10, choices=Phase.choices, default=Phase.READING)
+    # rows read from the upload so far
+    processed_rows = models.IntegerField(default=0)
+    total_rows = models.IntegerField(null=True, blank=True)
+    message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # last sign of life from the worker; a queued or running job that stops updating it was orphaned
+    heartbeat_at = models.DateTimeField(default=timezone.now)
+    def __str__(self):
+        return f'{self.get_kind_display()} import of {self.file_name} - {self.get_status_display()}'
+    @property
+    def finished(self):
+        return self.status in (self.Status.SUCCEEDED, self.Status.FAILED)
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'session_id': self.session_id,
+            'kind': self.kind,
+            'file_name': self.file_name,
+            'status': self.status,
+            'status_display': self.get_status_display(),
+            'finished': self.finished,
+            'phase': self.phase,
+            'phase_display': self.get_phase_display(),
+            'processed_rows': self.processed_rows,
+            'total_rows': self.total_rows,
+            'message': self.message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
         }
 
+class RosterRun(models.Model):
+    # The candidate rosters of one generate_teams run, kept server side in a compact encoding, see roster_store
+    session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='roster_runs')
+    rosters = models.BinaryField()
+    roster_count = models.IntegerField()
+    # the score dicts of the rosters, saved by the generator or filled in the first time the run is reviewed
+    scores = models.BinaryField(null=True, blank=True)
+    explored = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    def __str__(self):
+        return f'{self.roster_count} rosters for {self.session}'
+
 class PlayerSessionEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, PlayerSession):
@@ -95,3 +180,17 @@ class Team(models.Model):
         if self.lead:
             players.append(self.lead)
         return players
+
+class TeamPair(models.Model):
+    # Two players who shared a team, with player_a < player_b. Kept in step with Team by team_history.
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name='pairs')
+    session = models.ForeignKey(Session, on_delete=models.CASCADE)
+    player_a = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='+')
+    player_b = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='+')
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['team', 'player_a', 'player_b'], name='unique_team_pair'),
+        ]
+        indexes = [
+            models.Index(fields=['session', 'player_a', 'player_b']),
+        ]
@@ -0,0 +1,201 @@
+# rosterizer/name_index.py
+#
+# In-memory indexes of player names, so a play with request is matched against a whole session or club with a
+# few dictionary and bisect lookups instead of a scan. An index is built from (key, full name) pairs; the club
+# index reads every player with a single query. Requests that still do not match get fuzzy suggestions from a
+# trigram index of the session.
+
+from bisect import bisect_left
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Player, PlayerSession
+
+def normalize_name(name):
+    """
+    Normalizes a name for comparison by collapsing whitespace and ignoring case.
+
+    Examples:
+        >>> normalize_name('  David   white ')
+        'david white'
+    """
+    return ' '.join(name.split()).casefold()
+
+class NameIndex:
+    """
+    Names indexed for exact, case-insensitive and token-prefix lookups.
+
+    Keys are whatever the caller wants back, e.g. a PlayerSession or a player pk. A token-prefix lookup
+    matches names where every token of the query starts a different token of the name, in order, so
+    'J Smith' finds 'John Smith' and 'Mary Ann' finds 'Mary Anne Jones'.
+    """
+    def __init__(self, entries=()):
+        self.exact = {}
+        self.folded = {}
+        self.token_names = {}
+        # token -> the tokenized names containing it, and every token sorted for prefix searches
+        self.postings = {}
+        self.tokens = []
+        self._sorted = True
+        for key, name in entries:
+            self.add(key, name)
+
+    @classmethod
+    def for_players(cls, players=None):
+        # every player of the club, keyed by pk, read with one query
+        players = Player.objects.all() if players is None else players
+        return cls((pk, f'{first_name} {last_name}') for pk, first_name, last_name in players.values_list('pk', 'first_name', 'last_name'))
+
+    def add(self, key, name):
+        self.exact.setdefault(name, []).append(key)
+        folded = normalize_name(name)
+        self.folded.setdefault(folded, []).append(key)
+        tokens = tuple(folded.split())
+        self.token_names.setdefault(tokens, []).append(key)
+        for token in tokens:
+            if token not in self.postings:
+                self.postings[token] = set()
+                self.tokens.append(token)
+            self.postings[token].add(tokens)
+        self._sorted = False
+
+    def __len__(self):
+        return sum(len(keys) for keys in self.exact.values())
+
+    def _tokens_with_prefix(self, prefix):
+        # every token starting with `prefix`, found by bisecting the sorted token list
+        if not self._sorted:
+            self.tokens.sort()
+            self._sorted = True
+        start = bisect_left(self.tokens, prefix)
+        end = start
+        while end < len(self.tokens) and self.tokens[end].startswith(prefix):
+            end += 1
+        return self.tokens[start:end]
+
+    def lookup(self, name):
+        # All keys matching `name`, trying an exact match, then a case-insensitive one, then token prefixes
+        if name in self.exact:
+            return list(self.exact[name])
+        folded = normalize_name(name)
+        if folded in self.folded:
+            return list(self.folded[folded])
+
+        query = folded.split()
+        if not query:
+            return []
+        # only names holding a token the first query token starts can match
+        candidates = set()
+        for token in self._tokens_with_prefix(query[0]):
+            candidates.update(self.postings[token])
+        matches = []
+        for tokens in sorted(candidates):
+            if tokens_match_prefixes(tokens, query):
+                matches.extend(self.token_names[tokens])
+        return matches
+
+    def find(self, name):
+        # The single key matching `name`, or None when there is no match or more than one
+        matches = self.lookup(name)
+        return matches[0] if len(matches) == 1 else None
+
+# Whether every query token starts a different name token, in order
+def tokens_match_prefixes(tokens, query):
+    if len(query) > len(tokens):
+        return False
+    position = 0
+    for prefix in query:
+        while position < len(tokens) and not tokens[position].startswith(prefix):
+            position += 1
+        if position == len(tokens):
+            return False
+        position += 1
+    return True
+
+# fuzzy matches below this Dice similarity of trigrams are not worth proposing
+SIMILARITY_THRESHOLD = 0.5
+
+# The character trigrams of a name, padded so the start and end of every token count too
+def name_trigrams(name):
+    padded = f'  {normalize_name(name)} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TrigramIndex:
+    """
+    Names indexed by character trigram, for fuzzy lookups such as 'Charie Brown' -> 'Charlie Brown'.
+
+    Similarity is the Dice coefficient of the two trigram sets. A lookup only visits names that share at
+    least one trigram with the query, through the inverted index, rather than comparing against every name.
+    """
+    def __init__(self, entries=()):
+        self.entries = []
+        self.postings = {}
+        for key, name in entries:
+            self.add(key, name)
+
+    def add(self, key, name):
+        trigrams = name_trigrams(name)
+        entry = len(self.entries)
+        self.entries.append((key, name, len(trigrams)))
+        for trigram in trigrams:
+            self.postings.setdefault(trigram, []).append(entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def similar(self, name, limit=3, threshold=SIMILARITY_THRESHOLD):
+        # The best matches for `name` as (key, name, similarity), most similar first
+        trigrams = name_trigrams(name)
+        shared = {}
+        for trigram in trigrams:
+            for entry in self.postings.get(trigram, ()):
+                shared[entry] = shared.get(entry, 0) + 1
+
+        matches = []
+        for entry, count in shared.items():
+            key, entry_name, size = self.entries[entry]
+            similarity = 2 * count / (len(trigrams) + size)
+            if similarity >= threshold:
+                matches.append((key, entry_name, similarity))
+        matches.sort(key=lambda match: (-match[2], match[1]))
+        return matches[:limit]
+
+# Play with suggestions by session id, see play_with_suggestions. Cleared whenever players or player sessions change.
+_suggestion_cache = {}
+
+def play_with_suggestions(session_id, limit=3):
+    """
+    Proposes partners for the play with requests of a session that did not resolve.
+
+    Returns a dict mapping the requesting player session id to (requester name, play with text, matches),
+    where matches are (player session id, full name, similarity) of other players in the session, best first.
+    Requests with no match close enough are left out. Results are cached per session.
+    """
+    cached = _suggestion_cache.get((session_id, limit))
+    if cached is not None:
+        return cached
+
+    Status = PlayerSession.PlayWithStatus
+    player_sessions = list(PlayerSession.objects.filter(session_id=session_id).select_related('player'))
+    index = TrigramIndex((player_session.pk, player_session.player.full_name) for player_session in player_sessions)
+    suggestions = {}
+    for player_session in player_sessions:
+        if player_session.play_with_status not in (Status.UNKNOWN_PLAYER, Status.NOT_IN_SESSION):
+            continue
+        matches = [match for match in index.similar(player_session.play_with, limit + 1) if match[0] != player_session.pk][:limit]
+        if matches:
+            suggestions[player_session.pk] = (player_session.player.full_name, player_session.play_with, matches)
+
+    _suggestion_cache[(session_id, limit)] = suggestions
+    return suggestions
+
+def invalidate_play_with_suggestions():
+    _suggestion_cache.clear()
+
+@receiver(post_save, sender=Player)
+@receiver(post_save, sender=PlayerSession)
+@receiver(post_delete, sender=Player)
+@receiver(post_delete, sender=PlayerSession)
+def _clear_suggestion_cache(sender, **kwargs):
+    invalidate_play_with_suggestions()
@@ -0,0 +1,174 @@
+# rosterizer/roster_batch.py
+#
+# Vectorized roster scoring with NumPy. A batch of rosters is an int32 array of shape rosters x teams x 4 holding
+# the index of the player seated in each position (in POSITIONS order), with EMPTY for an open seat. Every metric
+# of `evaluate_rosters` is computed over the whole batch at once and the result is the same list of score dicts.
+#
+# NumPy is an optional dependency; only this module needs it.
+
+import numpy as np
+
+from .roster_evaluation import POSITIONS, EvaluationContext, position_preference_value
+
+EMPTY = -1
+
+# continuity score for 0, 1, 2, 3 and 4 players together, as continuity_score
+CONTINUITY_BY_OVERLAP = np.array([1.0, 1.0, 0.66, 0.33, 0.0])
+COMPLETENESS_BY_UNASSIGNED = np.array([1.0, 0.7, 0.4, 0.0])
+
+class BatchEncoder:
+    """
+    Translates between roster dicts and batch arrays for one session.
+
+    Player indexes follow the session's player sessions in pk order. Index `len(player_ids)` is reserved
+    as padding, so lookup tables get one extra row that empty seats read from.
+    """
+    def __init__(self, context):
+        self.context = context
+        self.player_ids = sorted(context.player_sessions)
+        self.index_by_id = {player_session_id: index for index, player_session_id in enumerate(self.player_ids)}
+
+    def __len__(self):
+        return len(self.player_ids)
+
+    def encode(self, rosters):
+        # Rosters with fewer teams than the largest are padded with teams of empty seats; `team_counts` records the real size
+        team_counts = np.array([len(roster) for roster in rosters], dtype=np.int32)
+        seats = np.full((len(rosters), team_counts.max(initial=0), len(POSITIONS)), EMPTY, dtype=np.int32)
+        for r, roster in enumerate(rosters):
+            for t, team in enumerate(roster):
+                for p, position in enumerate(POSITIONS):
+                    player_session_id = team[position]
+                    if player_session_id:
+                        try:
+                            seats[r, t, p] = self.index_by_id[player_session_id]
+                        except KeyError:
+                            raise ValueError(f'Player session {player_session_id} is not part of session {self.context.session_id}') from None
+        return seats, team_counts
+
+    def decode(self, seats, team_counts=None):
+        rosters = []
+        for r, roster_seats in enumerate(seats.tolist()):
+            team_count = len(roster_seats) if team_counts is None else team_counts[r]
+            rosters.append([
+                {position: self.player_ids[index] if index != EMPTY else None for position, index in zip(POSITIONS, team)}
+                for team in roster_seats[:team_count]
+            ])
+        return rosters
+
+    def preference_matrix(self):
+        # players x positions, the position preference value of every player in every seat
+        player_sessions = self.context.player_sessions
+        matrix = np.zeros((len(self) + 1, len(POSITIONS)))
+        for index, player_session_id in enumerate(self.player_ids):
+            player_session = player_sessions[player_session_id]
+            matrix[index] = [position_preference_value(player_session.preferred_position1, player_session.preferred_position2, position) for position in POSITIONS]
+        return matrix
+
+    def partner_vector(self):
+        # index of each player's resolved play with partner, or EMPTY
+        player_sessions = self.context.player_sessions
+        partners = np.full(len(self) + 1, EMPTY, dtype=np.int32)
+        for index, player_session_id in enumerate(self.player_ids):
+            partners[index] = self.index_by_id.get(player_sessions[player_session_id].play_with_session_id, EMPTY)
+        return partners
+
+    def previous_teams(self, pair_index):
+        # players x slots, an index for each previous team of the player in the session of `pair_index`, EMPTY-padded.
+        # A player is normally on one team per session, so there is a single slot; a session with duplicate teams
+        # gets as many slots as the most teams any one player was on, never one column per team.
+        player_sessions = self.context.player_sessions
+        team_indexes = {}
+        teams_by_player = {}
+        for (player_a, player_b), team_ids in pair_index.pairs.items():
+            indexes = {team_indexes.setdefault(team_id, len(team_indexes)) for team_id in team_ids}
+            teams_by_player.setdefault(player_a, set()).update(indexes)
+            teams_by_player.setdefault(player_b, set()).update(indexes)
+
+        slots = np.full((len(self) + 1, max(map(len, teams_by_player.values()), default=1)), EMPTY, dtype=np.int32)
+        for index, player_session_id in enumerate(self.player_ids):
+            teams = sorted(teams_by_player.get(player_sessions[player_session_id].player_id, ()))
+            slots[index, :len(teams)] = teams
+        return slots
+
+# Score a batch of rosters. Returns a list of score dicts matching `evaluate_rosters`.
+def evaluate_roster_batch(rosters, session_id, context=None):
+    context = context or EvaluationContext(session_id)
+    encoder = BatchEncoder(context)
+    seats, team_counts = encoder.encode(rosters)
+    return evaluate_encoded_batch(encoder, seats, team_counts)
+
+def evaluate_encoded_batch(encoder, seats, team_counts):
+    player_count = len(encoder)
+    occupied = seats != EMPTY
+    padded = np.where(occupied, seats, player_count)
+    real_teams = np.arange(seats.shape[1]) < team_counts[:, None]
+
+    # completeness: players of the session that no seat holds
+    assigned = np.zeros((seats.shape[0], player_count + 1), dtype=bool)
+    assigned[np.arange(seats.shape[0])[:, None], padded.reshape(seats.shape[0], -1)] = True
+    assigned = assigned[:, :player_count]
+    completeness = COMPLETENESS_BY_UNASSIGNED[np.minimum(player_count - assigned.sum(axis=1), 3)]
+
+    # incomplete teams: fewer than four players, critical ones fewer than three
+    team_sizes = occupied.sum(axis=2)
+    incomplete = ((team_sizes < 4) & real_teams).sum(axis=1)
+    critical = ((team_sizes < 3) & real_teams).sum(axis=1)
+    incomplete_teams = np.where(critical > 0, 0.0, np.where(incomplete > 3, 0.5, 1.0 - incomplete * 0.1))
+
+    # position preference through the preference lookup matrix
+    preference = encoder.preference_matrix()[padded, np.arange(len(POSITIONS))].sum(axis=(1, 2))
+    position_preference = preference / player_count if player_count else np.zeros(len(seats))
+
+    # continuity through one pair matrix per lookback session
+    counted = team_continuity_mask(seats, encoder.partner_vector(), player_count)
+    continuity = []
+    for lookback in range(1, len(encoder.context.weights) + 1):
+        pair_index = encoder.context.pairs_for_lookback(lookback)
+        if pair_index is None:
+            continuity.append(np.ones(seats.shape[:2]))
+            continue
+        overlap = team_overlaps(padded, counted, encoder.previous_teams(pair_index))
+        continuity.append(CONTINUITY_BY_OVERLAP[np.minimum(overlap, 4)])
+
+    # the overall score, as combine_scores
+    scores = completeness * incomplete_teams * position_preference
+    for weight, team_scores in zip(encoder.context.weights, continuity):
+        team_means = np.where(real_teams, team_scores, 0.0).sum(axis=1) / np.maximum(team_counts, 1)
+        scores = scores * ((1.0 - weight) + team_means * weight)
+
+    # unassigned player session ids, flattened in roster order and cut back into one list per roster
+    _, unassigned_players = np.nonzero(~assigned)
+    unassigned_ids = np.asarray(encoder.player_ids, dtype=np.int64)[unassigned_players].tolist()
+    ends = np.cumsum(player_count - assigned.sum(axis=1)).tolist()
+    columns = {
+        'completeness': completeness.tolist(),
+        'unassigned': [unassigned_ids[start:end] for start, end in zip([0] + ends, ends)],
+        'incomplete_teams': incomplete_teams.tolist(),
+        'position_preference': position_preference.tolist(),
+    }
+    for lookback, team_scores in enumerate(continuity, start=1):
+        columns[f'team_continuity_{lookback}'] = [roster_teams[:team_count] for roster_teams, team_count in zip(team_scores.tolist(), team_counts.tolist())]
+    columns['score'] = scores.tolist()
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+# The largest overlap of every team, as PairIndex.max_overlap: the most counted players of the team that were on one
+# previous team together, where a single player scores the same as none. Each seat's previous teams are compared with
+# those of the other three seats, so memory stays rosters x teams x 16 x slots² whatever the number of previous teams.
+def team_overlaps(padded, counted, previous_teams):
+    team_ids = previous_teams[padded]
+    team_ids[~counted] = EMPTY
+    same_team = team_ids[..., :, :, None, None] == team_ids[..., None, None, :, :]
+    np.logical_and(same_team, team_ids[..., :, :, None, None] != EMPTY, out=same_team)
+    return same_team.any(axis=-1).sum(axis=-1, dtype=np.int8).max(axis=(-2, -1))
+
+# Which seats count toward continuity: a player whose play with partner already counts earlier on the team is left out,
+# as in evaluate_team_continuity(exempt_plays_with=True)
+def team_continuity_mask(seats, partners, player_count):
+    occupied = seats != EMPTY
+    seat_partners = partners[np.where(occupied, seats, player_count)]
+    counted = np.zeros(seats.shape, dtype=bool)
+    for p in range(seats.shape[2]):
+        partner_counted = ((seats[..., :p] == seat_partners[..., p:p + 1]) & counted[..., :p]).any(axis=2)
+        counted[..., p] = occupied[..., p] & ~(partner_counted & (seat_partners[..., p] != EMPTY))
+    return counted
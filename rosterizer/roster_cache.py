@@ -0,0 +1,90 @@
+# rosterizer/roster_cache.py
+#
+# Memoized roster scores. Scores are cached under the session and the roster's seats in team order, so a roster
+# is scored once no matter how often the review page is loaded. Team order is part of the key because the
+# per-team continuity scores are listed in it.
+#
+# The cache lives in the process and is cleared whenever players, player sessions or teams change, since any of
+# them can change a score.
+
+import copy
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Player, PlayerSession, Session, Team
+from .roster_evaluation import POSITIONS, EvaluationContext, evaluate_rosters
+
+class LRUCache:
+    """
+    A mapping that holds at most `maxsize` entries, evicting the least recently used one when full.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+score_cache = LRUCache(getattr(settings, 'ROSTERIZER_SCORE_CACHE_SIZE', 1024))
+
+# The seats of a roster, team by team in the roster's order
+def roster_key(roster):
+    return tuple(tuple(team[position] for position in POSITIONS) for team in roster)
+
+# evaluate_rosters, answering from the cache where it can. Only the rosters it has not seen are evaluated, in one batch.
+def cached_evaluate_rosters(rosters, session_id, cache=None):
+    cache = score_cache if cache is None else cache
+    keys = [(session_id, roster_key(roster)) for roster in rosters]
+    scores = [cache.get(key) for key in keys]
+
+    missing = {}
+    for i, (key, score) in enumerate(zip(keys, scores)):
+        if score is None:
+            missing.setdefault(key, i)
+    if missing:
+        evaluated = evaluate_rosters([rosters[i] for i in missing.values()], session_id, context=EvaluationContext(session_id))
+        for key, score in zip(missing, evaluated):
+            cache.put(key, score)
+        fresh = dict(zip(missing, evaluated))
+        scores = [score if score is not None else fresh[key] for key, score in zip(keys, scores)]
+
+    # callers may add to the dicts they get back, so they never share the cached ones
+    return [copy.deepcopy(score) for score in scores]
+
+@receiver(post_save, sender=Player)
+@receiver(post_save, sender=PlayerSession)
+@receiver(post_save, sender=Session)
+@receiver(post_save, sender=Team)
+@receiver(post_delete, sender=Player)
+@receiver(post_delete, sender=PlayerSession)
+@receiver(post_delete, sender=Session)
+@receiver(post_delete, sender=Team)
+def _clear_score_cache(sender, **kwargs):
+    score_cache.clear()
@@ -0,0 +1,333 @@
+# rosterizer/roster_engine.py
+#
+# ORM-free roster generation. A session's players are loaded once into a SessionSnapshot and every
+# roster is built from that snapshot, so generation issues no queries and can run without a database.
+
+import hashlib
+import logging
+import multiprocessing
+import random
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+POSITIONS = ['Skip', 'Vice', 'Second', 'Lead']
+
+class SnapshotPlayer:
+    """
+    A compact, read-only view of a PlayerSession used by the generator.
+
+    `index` is the player's position in `SessionSnapshot.players` and `partner` is the index of the
+    player named in `play_with`, or None if that player is not part of the snapshot.
+    """
+    __slots__ = ('index', 'id', 'player_id', 'full_name', 'years_curled',
+                 'preferred_position1', 'preferred_position2', 'play_with', 'partner')
+
+    def __init__(self, index, id, player_id, full_name, years_curled, preferred_position1, preferred_position2, play_with, partner=None):
+        self.index = index
+        self.id = id
+        self.player_id = player_id
+        self.full_name = full_name
+        self.years_curled = years_curled
+        self.preferred_position1 = preferred_position1
+        self.preferred_position2 = preferred_position2
+        self.play_with = play_with
+        self.partner = partner
+
+    def __str__(self):
+        return self.full_name
+
+    def __repr__(self):
+        return f'SnapshotPlayer({self.index}, {self.id}, {self.full_name!r})'
+
+class SessionSnapshot:
+    """
+    The players of a session, indexed by integer position.
+
+    Build one with `SessionSnapshot.from_player_sessions` (or `team_generation.load_session_snapshot`
+    to load it from the database) and hand it to `assign_teams` as many times as needed.
+    """
+    __slots__ = ('session_id', 'players', 'index_by_id')
+
+    def __init__(self, session_id, players):
+        self.session_id = session_id
+        self.players = players
+        self.index_by_id = {player.id: player.index for player in players}
+
+    def __len__(self):
+        return len(self.players)
+
+    def player_for_id(self, player_session_id):
+        return self.players[self.index_by_id[player_session_id]]
+
+    @classmethod
+    def from_player_sessions(cls, player_sessions, session_id=None):
+        """
+        Builds a snapshot from PlayerSession instances (or anything shaped like them).
+
+        The related `player` of each instance must already be loaded, e.g. through `select_related`.
+        Partners come from the resolved `play_with_session` link; rows that were never resolved fall
+        back to matching `play_with` against the names in the snapshot.
+        """
+        player_sessions = list(player_sessions)
+        players = [
+            SnapshotPlayer(
+                index=index,
+                id=player_session.id,
+                player_id=player_session.player_id,
+                full_name=player_session.player.full_name,
+                years_curled=player_session.years_curled,
+                preferred_position1=player_session.preferred_position1,
+                preferred_position2=player_session.preferred_position2,
+                play_with=player_session.play_with,
+            )
+            for index, player_session in enumerate(player_sessions)
+        ]
+        partner_ids = {
+            index: player_session.play_with_session_id
+            for index, player_session in enumerate(player_sessions)
+            if getattr(player_session, 'play_with_status', '')
+        }
+        resolve_partners(players, partner_ids)
+        return cls(session_id, players)
+
+# Resolve each player's partner to the index of that player in the snapshot.
+# partner_ids maps a player's index to the PlayerSession id of an already resolved partner (or None);
+# players missing from it are matched by their play with name.
+def resolve_partners(players, partner_ids=None):
+    partner_ids = partner_ids or {}
+    index_by_id = {player.id: player.index for player in players}
+    index_by_name = {}
+    for player in players:
+        index_by_name.setdefault(player.full_name, player.index)
+
+    for player in players:
+        if player.index in partner_ids:
+            partner = index_by_id.get(partner_ids[player.index])
+        else:
+            partner = index_by_name.get(player.play_with) if player.play_with else None
+        player.partner = partner if partner != player.index else None
+
+class CandidatePool:
+    """
+    The players still waiting for a seat, bucketed by preferred position.
+
+    Each bucket is an array plus a map from player index to slot, so picking a random player and
+    removing a player are both O(1): a removed player's slot is filled by the bucket's last player.
+    """
+    __slots__ = ('_buckets', '_slots')
+
+    def __init__(self, players=()):
+        self._buckets = {None: []}
+        self._slots = {None: {}}
+        for player in players:
+            self.add(player)
+
+    # every player is in the catch-all bucket plus one bucket per preferred position
+    @staticmethod
+    def _keys(player):
+        keys = [None]
+        if player.preferred_position1:
+            keys.append((1, player.preferred_position1))
+        if player.preferred_position2:
+            keys.append((2, player.preferred_position2))
+        return keys
+
+    def add(self, player):
+        for key in self._keys(player):
+            bucket = self._buckets.setdefault(key, [])
+            self._slots.setdefault(key, {})[player.index] = len(bucket)
+            bucket.append(player)
+
+    def remove(self, player):
+        for key in self._keys(player):
+            bucket = self._buckets[key]
+            slots = self._slots[key]
+            slot = slots.pop(player.index)
+            last = bucket.pop()
+            if last is not player:
+                bucket[slot] = last
+                slots[last.index] = slot
+
+    def pick(self, position, rng=random):
+        bucket = self._buckets.get((1, position)) or self._buckets.get((2, position))
+        return rng.choice(bucket) if bucket else None
+
+    def pick_any(self, rng=random):
+        bucket = self._buckets[None]
+        return rng.choice(bucket) if bucket else None
+
+    def __contains__(self, player):
+        return player.index in self._slots[None]
+
+    def __len__(self):
+        return len(self._buckets[None])
+
+    def __iter__(self):
+        return iter(list(self._buckets[None]))
+
+    def __repr__(self):
+        return f'CandidatePool({self._buckets[None]!r})'
+
+# Generate team assignments for a snapshot - returns a list of teams, each with a skip, vice, second, and lead
+def generate_snapshot_assignments(snapshot, use_play_with=True, rng=random):
+    teams, _ = assign_teams(snapshot, use_play_with=use_play_with, rng=rng)
+    return teams
+
+# Generate many rosters from one snapshot. Every roster gets its own seed derived from `seed`, so the
+# result is the same no matter how many worker processes share the work.
+def generate_snapshot_rosters(snapshot, num_rosters, use_play_with=True, seed=None, workers=1):
+    return list(iter_snapshot_rosters(snapshot, num_rosters, use_play_with=use_play_with, seed=seed, workers=workers))
+
+# Yield rosters as they are generated, so callers can consume any number of them in constant memory.
+# With num_rosters=None the stream never ends; stop consuming it when done.
+def iter_snapshot_rosters(snapshot, num_rosters, use_play_with=True, seed=None, workers=1):
+    seeds = iter_roster_seeds(seed, num_rosters)
+    if workers <= 1 or (num_rosters is not None and num_rosters <= 1):
+        for roster_seed in seeds:
+            yield generate_seeded_assignments(snapshot, use_play_with, roster_seed)
+        return
+
+    # each worker receives the snapshot once, then only seeds travel between processes;
+    # seeds are handed out a batch at a time so finished rosters never pile up
+    if num_rosters is None:
+        chunksize = 16
+    else:
+        chunksize = max(1, min(64, num_rosters // (workers * 4)))
+    batch_size = workers * chunksize * 4
+    with ProcessPoolExecutor(max_workers=workers, mp_context=WORKER_CONTEXT, initializer=_init_worker, initargs=(snapshot, use_play_with)) as executor:
+        while True:
+            batch = list(islice(seeds, batch_size))
+            if not batch:
+                break
+            yield from executor.map(_generate_in_worker, batch, chunksize=chunksize)
+
+# Consecutive duplicates after which unique_rosters decides the snapshot has no new rosters left to give
+DUPLICATE_PATIENCE = 200
+
+# A fingerprint of a roster that ignores the order of its teams: the hash of its sorted seat tuples
+def roster_fingerprint(roster):
+    seats = sorted(tuple(team[position] or 0 for position in POSITIONS) for team in roster)
+    return hashlib.blake2b(repr(seats).encode(), digest_size=16).hexdigest()
+
+# Drop rosters that only differ from an earlier one in team order. Stops after num_rosters distinct rosters,
+# or once `patience` rosters in a row were duplicates, which happens when a small session runs out of new rosters.
+def unique_rosters(rosters, num_rosters=None, patience=DUPLICATE_PATIENCE):
+    seen = set()
+    duplicates = 0
+    for roster in rosters:
+        if num_rosters is not None and len(seen) >= num_rosters:
+            break
+        fingerprint = roster_fingerprint(roster)
+        if fingerprint in seen:
+            duplicates += 1
+            if duplicates >= patience:
+                logging.info('Stopping after %s distinct rosters, the last %s were all duplicates', len(seen), duplicates)
+                break
+            continue
+        duplicates = 0
+        seen.add(fingerprint)
+        yield roster
+
+def roster_seeds(seed, num_rosters):
+    return list(iter_roster_seeds(seed, num_rosters))
+
+# Per-roster seeds derived from the run seed, num_rosters of them or an endless stream if num_rosters is None
+def iter_roster_seeds(seed, num_rosters=None):
+    seed_rng = random.Random(seed if seed is not None else random.getrandbits(64))
+    count = 0
+    while num_rosters is None or count < num_rosters:
+        yield seed_rng.getrandbits(64)
+        count += 1
+
+def generate_seeded_assignments(snapshot, use_play_with, roster_seed):
+    return generate_snapshot_assignments(snapshot, use_play_with=use_play_with, rng=random.Random(roster_seed))
+
+# Workers are spawned rather than forked: a fork would copy the web process with its import threads and open
+# database connections. A spawned worker starts a fresh interpreter that only imports this Django-free module.
+WORKER_CONTEXT = multiprocessing.get_context('spawn')
+
+_worker_state = None
+
+def _init_worker(snapshot, use_play_with):
+    global _worker_state
+    _worker_state = (snapshot, use_play_with)
+
+def _generate_in_worker(roster_seed):
+    snapshot, use_play_with = _worker_state
+    return generate_seeded_assignments(snapshot, use_play_with, roster_seed)
+
+# Build one roster from the snapshot. Returns the teams and the snapshot players left unassigned.
+def assign_teams(snapshot, use_play_with=True, rng=random):
+    remaining = CandidatePool(snapshot.players)
+    num_teams = len(remaining) // 4
+
+    # Initialize teams
+    teams = [{position: None for position in POSITIONS} for _ in range(num_teams)]
+
+    # Assign each position in turn, skips first
+    for position in POSITIONS:
+        for team in teams:
+            if team[position] is None:
+                player = select_player_for_position(position, remaining, rng)
+                if player:
+                    set_team_player(team, position, player, remaining)
+                    if use_play_with: add_play_with_players_to_team(team, snapshot, remaining)
+            if team[position] is None:
+                logging.warning(f'Unable to assign a {position.lower()} to team {team}')
+
+    # at this point we should have no more players to assign
+    if len(remaining) > 0:
+        logging.info(f"Players remaining: {remaining}, beginning to fill holes in rosters")
+        # Let's fill roster holes. Start with teams with player count of 1:
+        for team_player_count in range(1, 4):
+            for team in teams:
+                if len(remaining) > 0 and sum(team[position] is not None for position in POSITIONS) == team_player_count:
+                    # we still have unaffiliated players, and we have a team with a low enough player count to add.
+                    player = remaining.pick_any(rng)
+                    for position in ['Lead', 'Second', 'Vice', 'Skip']:
+                        if team[position] is None:
+                            set_team_player(team, position, player, remaining)
+                            break
+
+    if len(remaining) > 0:
+        logging.warning(f'Unable to assign all players to teams: {remaining}')
+
+    return teams, sorted(remaining, key=lambda player: player.index)
+
+# Helper function to select a player for a position, preferring players who listed it first
+def select_player_for_position(position, candidates, rng=random):
+    return candidates.pick(position, rng)
+
+# Helper function to assign play with players to an existing team
+def add_play_with_players_to_team(team, snapshot, remaining):
+    for position in POSITIONS:
+        team_position_player_session_id = team[position]
+        if team_position_player_session_id is None:
+            continue
+        team_position_player = snapshot.player_for_id(team_position_player_session_id)
+        if team_position_player.partner is None:
+            continue
+        preferred_player = snapshot.players[team_position_player.partner]
+        if preferred_player not in remaining:
+            continue
+
+        if preferred_player.preferred_position1 and team.get(preferred_player.preferred_position1, '') is None:
+            set_team_player(team, preferred_player.preferred_position1, preferred_player, remaining)
+            logging.debug('Added %s partner %s to team at preferred position 1 %s', team_position_player, preferred_player, preferred_player.preferred_position1)
+        elif preferred_player.preferred_position2 and team.get(preferred_player.preferred_position2, '') is None:
+            set_team_player(team, preferred_player.preferred_position2, preferred_player, remaining)
+            logging.debug('Added %s partner %s to team at preferred position 2 %s', team_position_player, preferred_player, preferred_player.preferred_position2)
+        elif not preferred_player.preferred_position1 and not preferred_player.preferred_position2 and any(team[position] is None for position in ['Vice', 'Second', 'Lead']):
+            for open_position in ['Lead', 'Second', 'Vice']:
+                if team[open_position] is None:
+                    set_team_player(team, open_position, preferred_player, remaining)
+                    logging.debug('Added %s partner %s without preferred position to team at first available position %s', team_position_player, preferred_player, open_position)
+                    break
+        else:
+            logging.warning(f"Unable to add {preferred_player} to team {team} at either preferred position")
+
+# utility function to set a player to a team position and remove the player from the candidate pool
+def set_team_player(team, position, player, remaining):
+    team[position] = player.id
+    remaining.remove(player)
+    logging.debug('Assigned %s %s to team %s', position, player, team)
@@ -1,127 +1,220 @@
+from functools import cached_property
 from statistics import fmean
+from django.conf import settings
 from rosterizer.models import PlayerSession, Team
-from .utilities import get_previous_session
+from .team_history import load_pair_indexes
+from .utilities import get_session_timeline
 
-def evaluate_rosters(rosters, session_id):
-    # Calculate a score for each roster
+POSITIONS = ['Skip', 'Vice', 'Second', 'Lead']
+
+# weight of the team continuity score for each session of lookback - older sessions count for less
+CONTINUITY_WEIGHTS = (1.0, 0.67, 0.33)
+
+# Weights for a long lookback that fade by `decay` each session back, e.g. decaying_continuity_weights(12, 0.8)
+def decaying_continuity_weights(depth, decay):
+    return tuple(decay ** lookback for lookback in range(depth))
+
+# The continuity weights in use: the ROSTERIZER_CONTINUITY_WEIGHTS setting, or CONTINUITY_WEIGHTS if it is not set
+def continuity_weights():
+    return tuple(getattr(settings, 'ROSTERIZER_CONTINUITY_WEIGHTS', None) or CONTINUITY_WEIGHTS)
+
+def evaluate_rosters(rosters, session_id, context=None):
+    # Calculate a score for each roster. Everything the metrics need is loaded once into the context.
+    context = context or EvaluationContext(session_id)
     roster_scores = [{'score': 0} for _ in range(len(rosters))]
+    completeness = evaluate_completeness_batch(rosters, session_id, context=context)
     for i, roster in enumerate(rosters):
-        roster_scores[i]['completeness'] = evaluate_completeness(roster, session_id)
+        roster_scores[i]['completeness'], roster_scores[i]['unassigned'] = completeness[i]
         roster_scores[i]['incomplete_teams'] = evaluate_incomplete_teams(roster, session_id)
-        roster_scores[i]['position_preference'] = evaluate_position_preference(roster, session_id)
-        roster_scores[i]['team_continuity_1'] = evaluate_team_continuity(roster, session_id, exempt_plays_with=True, session_lookback=1)
-        roster_scores[i]['team_continuity_2'] = evaluate_team_continuity(roster, session_id, exempt_plays_with=True, session_lookback=2)
-        roster_scores[i]['team_continuity_3'] = evaluate_team_continuity(roster, session_id, exempt_plays_with=True, session_lookback=3)
-        roster_scores[i]['score'] = (roster_scores[i]['completeness'] * 
-                                     roster_scores[i]['incomplete_teams'] * 
-                                     roster_scores[i]['position_preference'] * 
-                                     fmean(roster_scores[i]['team_continuity_1']) *
-                                     (0.33 + fmean(roster_scores[i]['team_continuity_2'])*.67) * # weaken the effect of team continuity 2
-                                     (0.67 + fmean(roster_scores[i]['team_continuity_3'])*.33))  # weaken the effect of team continuity 3 even more
-    
-    # Return the evaluated rosters
-    return roster_scores 
+        roster_scores[i]['position_preference'] = evaluate_position_preference(roster, session_id, context=context)
+        for lookback in range(1, len(context.weights) + 1):
+            roster_scores[i][f'team_continuity_{lookback}'] = evaluate_team_continuity(roster, session_id, exempt_plays_with=True, session_lookback=lookback, context=context)
+        roster_scores[i]['score'] = combine_scores(roster_scores[i]['completeness'],
+                                                   roster_scores[i]['incomplete_teams'],
+                                                   roster_scores[i]['position_preference'],
+                                                   [fmean(roster_scores[i][f'team_continuity_{lookback}']) for lookback in range(1, len(context.weights) + 1)],
+                                                   weights=context.weights)
 
-def evaluate_completeness(roster, session_id):
-    # Evaluate the completeness of a roster
-    player_sessions = PlayerSession.objects.filter(session_id=session_id)
-    for team in roster:
-        for player_session_id in team.values():
-            if player_session_id:
-                player_sessions = player_sessions.exclude(pk=player_session_id)
+    # Return the evaluated rosters
+    return roster_scores
+
+class EvaluationContext:
+    """
+    The data about a session that roster metrics read, loaded once and shared by every metric and roster.
+
+    Each part is loaded the first time it is used: the session's player sessions, the sessions `lookback`
+    deep before it, and the teams of those sessions. `weights` are the continuity weights, one per session
+    of lookback, and `lookback` defaults to their number.
+    """
+    def __init__(self, session_id, lookback=None, weights=None):
+        self.session_id = session_id
+        self.weights = tuple(weights) if weights else continuity_weights()
+        self.lookback = lookback or len(self.weights)
+
+    @cached_property
+    def player_sessions(self):
+        # player session pk -> PlayerSession
+        return {player_session.pk: player_session for player_session in PlayerSession.objects.filter(session_id=self.session_id)}
+
+    @cached_property
+    def player_session_ids(self):
+        return frozenset(self.player_sessions)
+
+    @cached_property
+    def previous_session_ids(self):
+        # previous_session_ids[n - 1] is the id of the session n sessions back, or None once the history runs out
+        timeline = get_session_timeline(self.session_id)
+        if self.session_id not in timeline:
+            raise ValueError(f'Session with id {self.session_id} does not exist')
+        return timeline.previous_session_ids(self.session_id, self.lookback)
+
+    @cached_property
+    def previous_teams(self):
+        # previous_teams[n - 1] holds the player pk sets of the teams n sessions back, or None if there is no such session
+        session_ids = [session_id for session_id in self.previous_session_ids if session_id is not None]
+        teams_by_session = {session_id: [] for session_id in session_ids}
+        if session_ids:
+            team_players = Team.objects.filter(session_id__in=session_ids).values_list('session_id', 'skip_id', 'vice_id', 'second_id', 'lead_id')
+            for session_id, *player_pks in team_players:
+                teams_by_session[session_id].append(frozenset(player_pk for player_pk in player_pks if player_pk is not None))
+        return [teams_by_session[session_id] if session_id is not None else None for session_id in self.previous_session_ids]
+
+    @cached_property
+    def pair_indexes(self):
+        # pair_indexes[n - 1] is the team_history.PairIndex of the session n sessions back, or None if there is no such session
+        indexes = load_pair_indexes([session_id for session_id in self.previous_session_ids if session_id is not None])
+        return [indexes[session_id] if session_id is not None else None for session_id in self.previous_session_ids]
+
+    def _check_lookback(self, session_lookback):
+        if session_lookback > self.lookback:
+            raise ValueError(f'Context was built for a lookback of {self.lookback}, not {session_lookback}')
+
+    def teams_for_lookback(self, session_lookback):
+        self._check_lookback(session_lookback)
+        return self.previous_teams[session_lookback - 1]
+
+    def pairs_for_lookback(self, session_lookback):
+        self._check_lookback(session_lookback)
+        return self.pair_indexes[session_lookback - 1]
+
+def combine_scores(completeness, incomplete_teams, position_preference, continuity_means, weights=CONTINUITY_WEIGHTS):
+    # The overall roster score. Each team continuity mean is weakened by its lookback weight.
+    score = completeness * incomplete_teams * position_preference
+    for weight, continuity in zip(weights, continuity_means):
+        score *= (1.0 - weight) + continuity * weight
+    return score
 
-    if( len(player_sessions) == 0):
+def completeness_score(unassigned_count):
+    if unassigned_count == 0:
         return 1.0
-    elif( len(player_sessions) == 1):
+    elif unassigned_count == 1:
         return 0.7
-    elif( len(player_sessions) == 2):
+    elif unassigned_count == 2:
         return 0.4
     else:
         return 0.0
 
+def incomplete_teams_score(incomplete_teams, critical_teams):
+    # critical teams have fewer than three players, incomplete teams fewer than four
+    score = 1.0
+    if critical_teams > 0:
+        score = 0.0
+    elif incomplete_teams > 3:
+        score = 0.5
+    elif incomplete_teams > 0:
+        score = 1.0 - (incomplete_teams * 0.1)
+    return score
+
+def position_preference_value(preferred_position1, preferred_position2, position):
+    # How well a seat suits a player: first choice 1, second choice 0.5, and any seat suits a player with no valid preference
+    if preferred_position1 == position:
+        return 1
+    elif preferred_position2 == position:
+        return 0.5
+    elif preferred_position1 not in POSITIONS and preferred_position2 not in POSITIONS:
+        return 1
+    return 0
+
+def continuity_score(max_players_together):
+    if max_players_together <= 1:
+        return 1.0
+    elif max_players_together == 2:
+        return 0.66
+    elif max_players_together == 3:
+        return 0.33
+    else:
+        return 0.0
+
+def evaluate_completeness(roster, session_id, context=None):
+    # Evaluate the completeness of a roster
+    context = context or EvaluationContext(session_id)
+    return completeness_score(len(unassigned_player_sessions(roster, context.player_session_ids)))
+
+# Completeness of many rosters against one set of session players. Returns (score, unassigned player session ids) per roster.
+def evaluate_completeness_batch(rosters, session_id, context=None):
+    context = context or EvaluationContext(session_id)
+    player_session_ids = context.player_session_ids
+    results = []
+    for roster in rosters:
+        unassigned = unassigned_player_sessions(roster, player_session_ids)
+        results.append((completeness_score(len(unassigned)), unassigned))
+    return results
+
+# The player sessions of the session that a roster leaves without a team, sorted by id
+def unassigned_player_sessions(roster, player_session_ids):
+    assigned = {player_session_id for team in roster for player_session_id in team.values() if player_session_id}
+    return sorted(player_session_ids - assigned)
+
 def evaluate_incomplete_teams(roster, session_id):
     # Evaluate the number of incomplete teams in a roster
     incomplete_teams = 0
     critical_teams = 0
     for team in roster:
-        position_count = sum(team[position] is not None for position in ['Skip', 'Vice', 'Second', 'Lead'])
+        position_count = sum(team[position] is not None for position in POSITIONS)
         if position_count < 3:
             critical_teams += 1
         if position_count < 4:
             incomplete_teams += 1
 
-    score = 1.0
-    if critical_teams > 0:
-        score = 0.0
-    elif incomplete_teams > 3:
-        score = 0.5
-    elif incomplete_teams > 0:
-        score = 1.0 - (incomplete_teams * 0.1)
+    return incomplete_teams_score(incomplete_teams, critical_teams)
 
-    return score
-
-def evaluate_position_preference(roster, session_id):
+def evaluate_position_preference(roster, session_id, context=None):
     # Evaluate the position preference of players in a roster
-    player_sessions = PlayerSession.objects.filter(session_id=session_id)
+    context = context or EvaluationContext(session_id)
+    player_sessions = context.player_sessions
     preference_score = 0
     for team in roster:
         for position, player_session_id in team.items():
             if player_session_id:
-                player_session = player_sessions.get(pk=player_session_id)
-                if player_session.preferred_position1 == position:
-                    preference_score += 1
-                elif player_session.preferred_position2 == position:
-                    preference_score += 0.5
-                elif player_session.preferred_position1 not in ('Skip', 'Vice', 'Second', 'Lead') and player_session.preferred_position2 not in ('Skip', 'Vice', 'Second', 'Lead'):
-                    preference_score += 1
+                player_session = player_sessions[player_session_id]
+                preference_score += position_preference_value(player_session.preferred_position1, player_session.preferred_position2, position)
 
     player_count = len(player_sessions)
     total_preference = preference_score / player_count
     return total_preference
 
-def evaluate_team_continuity(roster, session_id, exempt_plays_with=False, session_lookback=1):
-    previous_session = get_previous_session(session_id=session_id, session_lookback=session_lookback)
-    if previous_session is None:
+def evaluate_team_continuity(roster, session_id, exempt_plays_with=False, session_lookback=1, context=None):
+    context = context or EvaluationContext(session_id, lookback=session_lookback)
+    previous_pairs = context.pairs_for_lookback(session_lookback)
+    if previous_pairs is None:
         return [1.0] * len(roster)  # If no previous session, all teams get a score of 1.0
 
-    current_player_sessions = PlayerSession.objects.filter(session_id=session_id)
-
-    previous_teams_pk = []
-    for team in Team.objects.filter(session_id=previous_session.pk):
-        player_pks = [player.pk for player in team.get_players()]
-        previous_teams_pk.append(frozenset(player_pks))
-
+    player_sessions = context.player_sessions
     team_scores = []
 
     for team in roster:
-        current_team_players = set()
+        current_team_player_sessions_pk = set()
         current_team_players_pk = set()
         for player_session_id in team.values():
             if player_session_id is not None:
+                player_session = player_sessions[player_session_id]
                 if exempt_plays_with:
                     # only add the player to the compare list if their play with partner isn't already there -they count only as 1
-                    player_session = PlayerSession.objects.get(pk=player_session_id)
-                    if any(player_session.play_with in p.full_name for p in current_team_players):
+                    if player_session.play_with_session_id in current_team_player_sessions_pk:
                         continue
-                player = PlayerSession.objects.get(pk=player_session_id).player
-                current_team_players.add(player)
-                current_team_players_pk.add(player.pk)
-
-        max_players_together = 0
-        for previous_team_players_pk in previous_teams_pk:
-            players_together = len(current_team_players_pk & previous_team_players_pk)
-            if players_together > max_players_together:
-                max_players_together = players_together
-
-        if max_players_together <= 1:
-            score = 1.0
-        elif max_players_together == 2:
-            score = 0.66
-        elif max_players_together == 3:
-            score = 0.33
-        else:
-            score = 0.0
-
-        team_scores.append(score)
+                current_team_player_sessions_pk.add(player_session.pk)
+                current_team_players_pk.add(player_session.player_id)
+
+        team_scores.append(continuity_score(previous_pairs.max_overlap(current_team_players_pk)))
 
     return team_scores
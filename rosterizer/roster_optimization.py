@@ -0,0 +1,205 @@
+# rosterizer/roster_optimization.py
+#
+# Swap-based local search over generated rosters. The best generated rosters are improved by swapping the
+# occupants of two seats (players across teams, positions within a team, or a player into an empty seat),
+# keeping a swap only when the roster score goes up. Scores are kept up to date incrementally, so a swap
+# costs a few lookups for the two teams involved rather than a full `evaluate_rosters` run.
+
+import random
+import time
+from statistics import fmean
+
+from .roster_evaluation import (CONTINUITY_WEIGHTS, POSITIONS, EvaluationContext, combine_scores, completeness_score, continuity_score,
+                                incomplete_teams_score, position_preference_value)
+from .team_generation import load_session_snapshot
+
+EMPTY = -1
+
+class ScoringModel:
+    """
+    Everything needed to score rosters of one session without touching the database.
+
+    Scores follow the same rules as `evaluate_rosters`.
+    """
+    def __init__(self, snapshot, previous_teams, weights=CONTINUITY_WEIGHTS):
+        self.snapshot = snapshot
+        self.weights = tuple(weights)
+        self.player_count = len(snapshot)
+        # preference value of every player in every position, indexed like POSITIONS
+        self.seat_values = [
+            tuple(position_preference_value(player.preferred_position1, player.preferred_position2, position) for position in POSITIONS)
+            for player in snapshot.players
+        ]
+        # for each lookback, player pk -> the previous teams they played on, or None if there is no previous session
+        self.history = []
+        for teams in previous_teams:
+            if teams is None:
+                self.history.append(None)
+                continue
+            teams_by_player = {}
+            for team_index, player_pks in enumerate(teams):
+                for player_pk in player_pks:
+                    teams_by_player.setdefault(player_pk, []).append(team_index)
+            self.history.append(teams_by_player)
+
+    @classmethod
+    def load(cls, session_id, context=None):
+        context = context or EvaluationContext(session_id)
+        return cls(load_session_snapshot(session_id), context.previous_teams, context.weights)
+
+    def seat_value(self, index, position_index):
+        return self.seat_values[index][position_index] if index != EMPTY else 0
+
+    def team_continuity(self, seats):
+        # Continuity of one team for every lookback. A player whose play with partner already sits
+        # earlier on the team is not counted, as in evaluate_team_continuity(exempt_plays_with=True).
+        players = self.snapshot.players
+        counted = set()
+        player_pks = set()
+        for index in seats:
+            if index == EMPTY:
+                continue
+            if players[index].partner in counted:
+                continue
+            counted.add(index)
+            player_pks.add(players[index].player_id)
+
+        scores = []
+        for teams_by_player in self.history:
+            if teams_by_player is None:
+                scores.append(1.0)
+                continue
+            together = {}
+            for player_pk in player_pks:
+                for team_index in teams_by_player.get(player_pk, ()):
+                    together[team_index] = together.get(team_index, 0) + 1
+            scores.append(continuity_score(max(together.values(), default=0)))
+        return tuple(scores)
+
+class RosterState:
+    """A roster laid out as seats of snapshot indexes, with its score components kept current."""
+    def __init__(self, model, roster):
+        self.model = model
+        index_by_id = model.snapshot.index_by_id
+        self.seats = [[index_by_id[team[position]] if team[position] is not None else EMPTY for position in POSITIONS] for team in roster]
+
+        self.preference_total = sum(model.seat_value(index, p) for team in self.seats for p, index in enumerate(team))
+        self.continuity = [model.team_continuity(team) for team in self.seats]
+        self.continuity_totals = [sum(team[lookback] for team in self.continuity) for lookback in range(len(model.weights))]
+        self.counts = [sum(index != EMPTY for index in team) for team in self.seats]
+        self.incomplete = sum(count < 4 for count in self.counts)
+        self.critical = sum(count < 3 for count in self.counts)
+        # swaps never change who is on the roster, so completeness is fixed
+        self.completeness = completeness_score(model.player_count - sum(self.counts))
+        self.score = self.current_score()
+
+    def current_score(self):
+        team_count = len(self.seats)
+        position_preference = self.preference_total / self.model.player_count if self.model.player_count else 0
+        continuity_means = [total / team_count if team_count else 1.0 for total in self.continuity_totals]
+        return combine_scores(self.completeness, incomplete_teams_score(self.incomplete, self.critical), position_preference, continuity_means, weights=self.model.weights)
+
+    def details(self):
+        # The score and its components, laid out like one entry of evaluate_rosters
+        players = self.model.snapshot.players
+        seated = {index for team in self.seats for index in team if index != EMPTY}
+        continuity = {f'team_continuity_{lookback + 1}': [team[lookback] for team in self.continuity] for lookback in range(len(self.model.weights))}
+        position_preference = self.preference_total / self.model.player_count if self.model.player_count else 0
+        incomplete_teams = incomplete_teams_score(self.incomplete, self.critical)
+        score = combine_scores(self.completeness, incomplete_teams, position_preference, [fmean(values) for values in continuity.values()], weights=self.model.weights)
+        return {'score': score, 'completeness': self.completeness, 'unassigned': sorted(player.id for player in players if player.index not in seated),
+                'incomplete_teams': incomplete_teams, 'position_preference': position_preference, **continuity}
+
+    def _exchange(self, team_a, position_a, team_b, position_b):
+        # swap two seats and update every score component; returns what is needed to undo it
+        seats = self.seats
+        index_a = seats[team_a][position_a]
+        index_b = seats[team_b][position_b]
+        undo = (self.preference_total, list(self.continuity_totals), self.incomplete, self.critical,
+                {team: (self.continuity[team], self.counts[team]) for team in (team_a, team_b)})
+
+        model = self.model
+        self.preference_total += (model.seat_value(index_b, position_a) + model.seat_value(index_a, position_b)
+                                  - model.seat_value(index_a, position_a) - model.seat_value(index_b, position_b))
+        seats[team_a][position_a] = index_b
+        seats[team_b][position_b] = index_a
+
+        for team in {team_a, team_b}:
+            old_count = self.counts[team]
+            new_count = sum(index != EMPTY for index in seats[team])
+            self.incomplete += (new_count < 4) - (old_count < 4)
+            self.critical += (new_count < 3) - (old_count < 3)
+            self.counts[team] = new_count
+
+            new_continuity = model.team_continuity(seats[team])
+            for lookback, value in enumerate(new_continuity):
+                self.continuity_totals[lookback] += value - self.continuity[team][lookback]
+            self.continuity[team] = new_continuity
+        return undo
+
+    def _revert(self, team_a, position_a, team_b, position_b, undo):
+        seats = self.seats
+        seats[team_a][position_a], seats[team_b][position_b] = seats[team_b][position_b], seats[team_a][position_a]
+        self.preference_total, self.continuity_totals, self.incomplete, self.critical, teams = undo
+        for team, (continuity, count) in teams.items():
+            self.continuity[team] = continuity
+            self.counts[team] = count
+
+    def try_swap(self, team_a, position_a, team_b, position_b):
+        # Swap two seats if that improves the score. Returns True when the swap was kept.
+        if (team_a, position_a) == (team_b, position_b):
+            return False
+        if self.seats[team_a][position_a] == EMPTY and self.seats[team_b][position_b] == EMPTY:
+            return False
+
+        undo = self._exchange(team_a, position_a, team_b, position_b)
+        score = self.current_score()
+        if score > self.score:
+            self.score = score
+            return True
+        self._revert(team_a, position_a, team_b, position_b, undo)
+        return False
+
+    def to_roster(self):
+        players = self.model.snapshot.players
+        return [{position: players[index].id if index != EMPTY else None for position, index in zip(POSITIONS, team)} for team in self.seats]
+
+# Hill-climb one roster with random seat swaps until the iteration budget or the deadline runs out
+def optimize_roster(model, roster, max_iterations=5000, deadline=None, rng=random):
+    return improve_state(RosterState(model, roster), max_iterations=max_iterations, deadline=deadline, rng=rng)
+
+# Hill-climb a roster state in place, see optimize_roster
+def improve_state(state, max_iterations=5000, deadline=None, rng=random):
+    seat_count = len(state.seats) * 4
+    if seat_count < 2:
+        return state
+
+    for iteration in range(max_iterations):
+        if deadline is not None and iteration % 100 == 0 and time.monotonic() >= deadline:
+            break
+        seat_a = rng.randrange(seat_count)
+        seat_b = rng.randrange(seat_count - 1)
+        if seat_b >= seat_a:
+            seat_b += 1
+        state.try_swap(seat_a // 4, seat_a % 4, seat_b // 4, seat_b % 4)
+    return state
+
+# Improve the best `top_n` rosters with local search and return them, best first
+def optimize_rosters(rosters, session_id, top_n=5, max_iterations=5000, time_budget=None, seed=None):
+    if not rosters:
+        return []
+    model = ScoringModel.load(session_id)
+    states = optimize_states([RosterState(model, roster) for roster in rosters], top_n=top_n, max_iterations=max_iterations, time_budget=time_budget, seed=seed)
+    return [state.to_roster() for state in states]
+
+# optimize_rosters for rosters already laid out as states, which are improved in place. A swap only rescores the
+# two teams it touches, so the states come back with their scores current and nothing needs evaluating again.
+def optimize_states(states, top_n=5, max_iterations=5000, time_budget=None, seed=None):
+    rng = random.Random(seed)
+    deadline = time.monotonic() + time_budget if time_budget is not None else None
+
+    ranked = sorted(states, key=lambda state: state.score, reverse=True)[:top_n]
+    for state in ranked:
+        improve_state(state, max_iterations=max_iterations, deadline=deadline, rng=rng)
+    ranked.sort(key=lambda state: state.score, reverse=True)
+    return ranked
@@ -0,0 +1,65 @@
+# rosterizer/roster_pipeline.py
+#
+# Streaming generate-and-score pipeline. Rosters are scored as they are generated and only the best few are
+# kept in a bounded heap, so the number of candidates explored does not affect memory use. The best rosters come
+# back as RosterStates, which carry their full scores, so they never need evaluating again.
+
+import heapq
+import time
+
+from .roster_optimization import RosterState, ScoringModel
+from .team_generation import iter_generated_rosters
+
+# Keep the `keep` best of (score, roster) pairs. Returns (roster, score) pairs, best first; ties go to the earlier roster.
+def select_top_rosters(scored_rosters, keep):
+    heap = []
+    for count, (score, roster) in enumerate(scored_rosters):
+        entry = (score, -count, roster)
+        if len(heap) < keep:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+    return [(roster, score) for score, _, roster in sorted(heap, reverse=True)]
+
+# Score each roster of an iterable as it is produced, yielding (score, RosterState) pairs
+def score_rosters(model, rosters):
+    for roster in rosters:
+        state = RosterState(model, roster)
+        yield state.score, state
+
+# Generate up to num_rosters distinct candidates for a session. Returns the `keep` best as RosterStates, best first,
+# together with the number of candidates explored, which is smaller when the session runs out of distinct rosters.
+def generate_top_rosters(session_id, num_rosters, keep=10, use_play_with=True, workers=None, seed=None, assignment='random'):
+    model = ScoringModel.load(session_id)
+    rosters = iter_generated_rosters(model.snapshot, num_rosters, use_play_with=use_play_with, workers=workers, seed=seed, assignment=assignment, unique=True)
+    counter = ExploredCounter(score_rosters(model, rosters))
+    return [state for state, _ in select_top_rosters(counter, keep)], counter.explored
+
+# Generate and score distinct rosters until `time_budget` seconds have passed. Returns the `keep` best as
+# RosterStates together with the number of candidates explored.
+def generate_rosters_within(session_id, time_budget, keep=10, use_play_with=True, workers=None, seed=None, assignment='random'):
+    deadline = time.monotonic() + time_budget
+    model = ScoringModel.load(session_id)
+    rosters = iter_generated_rosters(model.snapshot, None, use_play_with=use_play_with, workers=workers, seed=seed, assignment=assignment, unique=True)
+
+    def until_deadline(scored_rosters):
+        for scored_roster in scored_rosters:
+            yield scored_roster
+            if time.monotonic() >= deadline:
+                break
+
+    counter = ExploredCounter(score_rosters(model, rosters))
+    top = select_top_rosters(until_deadline(counter), keep)
+    rosters.close()
+    return [state for state, _ in top], counter.explored
+
+class ExploredCounter:
+    """Passes scored rosters through, counting how many were taken."""
+    def __init__(self, scored_rosters):
+        self.scored_rosters = scored_rosters
+        self.explored = 0
+
+    def __iter__(self):
+        for scored_roster in self.scored_rosters:
+            self.explored += 1
+            yield scored_roster
@@ -0,0 +1,116 @@
+# rosterizer/roster_store.py
+#
+# Server-side store for generated candidate rosters. A run of rosters is saved as one RosterRun row holding the
+# rosters as a compressed array of player session ids, and the browser session keeps only the run id. The scores
+# are stored with the run - the generator saves the ones it picked the rosters by, and other runs are scored the
+# first time they are reviewed - so the review table can page and sort without evaluating anything again; like
+# the rosters, they are a snapshot of when the run was made. Runs
+# expire ROSTERIZER_ROSTER_RUN_TTL seconds after they were last used, and at most ROSTERIZER_ROSTER_RUNS_KEPT
+# are kept, dropping the least recently used first.
+
+import json
+import zlib
+from array import array
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import PlayerSession, RosterRun
+from .roster_cache import cached_evaluate_rosters
+from .roster_evaluation import POSITIONS
+from .team_generation import roster_player_session_ids
+
+# key of the run id in request.session
+SESSION_KEY = 'roster_run_id'
+
+# Pack rosters into bytes: the roster count, then for each roster its team count followed by four player
+# session ids per team in POSITIONS order, 0 for an empty seat
+def encode_rosters(rosters):
+    values = array('q', [len(rosters)])
+    for roster in rosters:
+        values.append(len(roster))
+        for team in roster:
+            values.extend(team[position] or 0 for position in POSITIONS)
+    return zlib.compress(values.tobytes())
+
+def decode_rosters(data):
+    values = array('q')
+    values.frombytes(zlib.decompress(data))
+    rosters = []
+    offset = 1
+    for _ in range(values[0]):
+        team_count = values[offset]
+        offset += 1
+        roster = []
+        for _ in range(team_count):
+            roster.append({position: player_session_id or None for position, player_session_id in zip(POSITIONS, values[offset:offset + len(POSITIONS)])})
+            offset += len(POSITIONS)
+        rosters.append(roster)
+    return rosters
+
+def roster_run_ttl():
+    return timedelta(seconds=getattr(settings, 'ROSTERIZER_ROSTER_RUN_TTL', 24 * 60 * 60))
+
+# Store the rosters of a run, with their scores if they are known, and return the new RosterRun. Expired and least
+# recently used runs are dropped first.
+def save_roster_run(session_id, rosters, explored=None, scores=None):
+    evict_roster_runs()
+    return RosterRun.objects.create(session_id=session_id, rosters=encode_rosters(rosters), roster_count=len(rosters),
+                                    explored=explored if explored is not None else len(rosters),
+                                    scores=encode_scores(scores) if scores is not None else None)
+
+def encode_scores(scores):
+    return zlib.compress(json.dumps(scores, separators=(',', ':')).encode('utf-8'))
+
+def decode_scores(data):
+    return json.loads(zlib.decompress(data))
+
+# The RosterRun of the session that is still live, marking it as used, or None when it is unknown or has expired
+def get_roster_run(run_id, session_id):
+    if run_id is None:
+        return None
+    now = timezone.now()
+    run = RosterRun.objects.filter(pk=run_id, session_id=session_id, last_used_at__gte=now - roster_run_ttl()).first()
+    if run is not None:
+        RosterRun.objects.filter(pk=run.pk).update(last_used_at=now)
+    return run
+
+# (rosters, rosters explored) of a stored run of the session, or None when the run is unknown or has expired
+def load_roster_run(run_id, session_id):
+    run = get_roster_run(run_id, session_id)
+    if run is None:
+        return None
+    return decode_rosters(run.rosters), run.explored
+
+# Whether every player session the rosters seat is still part of the session
+def rosters_are_current(rosters, session_id):
+    return roster_player_session_ids(rosters) <= set(PlayerSession.objects.filter(session_id=session_id).values_list('pk', flat=True))
+
+# (rosters, scores, rosters explored) of a stored run, scoring the rosters and storing the scores on first use.
+# None when the run is unknown or has expired, or when it went stale before it was scored, in which case it is dropped.
+def load_scored_roster_run(run_id, session_id):
+    run = get_roster_run(run_id, session_id)
+    if run is None:
+        return None
+    rosters = decode_rosters(run.rosters)
+    if run.scores is None:
+        if not rosters_are_current(rosters, session_id):
+            run.delete()
+            return None
+        scores = cached_evaluate_rosters(rosters, session_id)
+        RosterRun.objects.filter(pk=run.pk).update(scores=encode_scores(scores))
+    else:
+        scores = decode_scores(run.scores)
+    return rosters, scores, run.explored
+
+def delete_roster_run(run_id):
+    RosterRun.objects.filter(pk=run_id).delete()
+
+def evict_roster_runs():
+    RosterRun.objects.filter(last_used_at__lt=timezone.now() - roster_run_ttl()).delete()
+    kept = getattr(settings, 'ROSTERIZER_ROSTER_RUNS_KEPT', 100)
+    # room for the run about to be saved
+    stale = list(RosterRun.objects.order_by('-last_used_at', '-pk').values_list('pk', flat=True)[max(kept - 1, 0):])
+    if stale:
+        RosterRun.objects.filter(pk__in=stale).delete()
@@ -0,0 +1,92 @@
+# rosterizer/roster_table.py
+#
+# Rows for the roster review table, served with the DataTables server-side protocol. The candidates of a run are
+# filtered, sorted and paged on their stored scores, and only the rosters of the requested page are hydrated, so
+# the cost of a page does not depend on how many candidates were generated.
+
+import re
+
+from .models import PlayerSession
+from .roster_evaluation import POSITIONS
+from .team_generation import load_player_sessions, roster_player_session_ids
+
+# columns the table can be sorted on, besides team_continuity_1, team_continuity_2, ...
+SORT_COLUMNS = ('index', 'roster', 'score', 'completeness', 'incomplete_teams', 'position_preference')
+CONTINUITY_COLUMN = re.compile(r'team_continuity_\d+')
+
+def is_sort_column(column):
+    return column in SORT_COLUMNS or CONTINUITY_COLUMN.fullmatch(column) is not None
+
+# The value of a score column for sorting and display. Team continuity is stored per team and shown as the mean.
+def column_value(score, column):
+    value = score.get(column)
+    if isinstance(value, list):
+        return sum(value) / len(value) if value else 1.0
+    return value
+
+# The requested sort as (column, descending) pairs, from the order[i][column] / columns[j][data] parameters
+def datatables_order(params):
+    order = []
+    i = 0
+    while f'order[{i}][column]' in params:
+        column = params.get(f'columns[{params[f"order[{i}][column]"]}][data]', '')
+        if is_sort_column(column):
+            order.append((column, params.get(f'order[{i}][dir]') == 'desc'))
+        i += 1
+    return order
+
+# shown for a seat whose player session was deleted after the run was generated
+REMOVED_PLAYER = '(removed player)'
+
+def player_label(player_sessions, player_session_id):
+    player_session = player_sessions.get(player_session_id)
+    return player_session.player.full_name if player_session is not None else REMOVED_PLAYER
+
+# player session id -> case-folded full name for every player of the session, in one query
+def session_player_names(session_id):
+    return {
+        pk: f'{first_name} {last_name}'.casefold()
+        for pk, first_name, last_name in PlayerSession.objects.filter(session_id=session_id).values_list('pk', 'player__first_name', 'player__last_name')
+    }
+
+def roster_table_page(session_id, rosters, scores, start=0, length=10, search='', order=()):
+    """
+    One page of the roster review table.
+
+    `search` keeps the rosters with a seated player whose name contains it. `order` is a list of
+    (column, descending) pairs, most significant first. A `length` of -1 returns every remaining row.
+    Players deleted since the run was generated are shown as REMOVED_PLAYER.
+    Returns the number of rosters that pass the search and the rows of the page.
+    """
+    indexes = list(range(len(rosters)))
+    if search:
+        names = session_player_names(session_id)
+        needle = search.casefold()
+        indexes = [index for index in indexes if any(needle in names.get(player_session_id, '') for player_session_id in roster_player_session_ids([rosters[index]]))]
+
+    # stable sorts from the least significant column up give the combined order
+    for column, descending in reversed(order):
+        if column in ('index', 'roster'):
+            indexes.sort(reverse=descending)
+        else:
+            indexes.sort(key=lambda index: sort_value(column_value(scores[index], column)), reverse=descending)
+
+    page = indexes[start:] if length < 0 else indexes[start:start + length]
+    page_rosters = [rosters[index] for index in page]
+    unassigned_ids = {player_session_id for index in page for player_session_id in scores[index].get('unassigned', ())}
+    player_sessions = load_player_sessions(roster_player_session_ids(page_rosters) | unassigned_ids)
+
+    rows = []
+    for index, roster in zip(page, page_rosters):
+        row = {'index': index, 'roster': index + 1}
+        for column in scores[index]:
+            if column != 'unassigned':
+                row[column] = column_value(scores[index], column)
+        row['teams'] = [' / '.join(player_label(player_sessions, team[position]) if team[position] else '' for position in POSITIONS) for team in roster]
+        row['unassigned'] = [player_label(player_sessions, player_session_id) for player_session_id in scores[index].get('unassigned', ())]
+        rows.append(row)
+    return len(indexes), rows
+
+# missing values sort before every score
+def sort_value(value):
+    return (value is not None, value if value is not None else 0)
@@ -0,0 +1,175 @@
+# rosterizer/seat_assignment.py
+#
+# Optimal seating. Instead of picking players for positions greedily at random, the position preference of the
+# single players is maximized exactly with a min-cost flow of players into (team, position) seats.
+#
+# Play with pairs are seated first, one pair at a time in random order, each in the orientation and on the team
+# that suit it best at that point; the flow then fills the seats they leave. Keeping a pair on one team is not a
+# flow constraint, so with pairs present the roster is only optimal for the singles: an early pair can take the
+# seats a later pair wanted more.
+#
+# A seat's cost depends only on its position, never on its team, so players with the same preference values are
+# interchangeable and seats of the same position are too. The flow therefore runs over preference classes and
+# positions, a graph of a few dozen nodes whatever the session size, and the result is spread over the teams at
+# random so repeated runs give different, equally well-seated rosters.
+
+import random
+
+from .roster_evaluation import POSITIONS, position_preference_value
+
+class MinCostFlow:
+    """
+    Successive shortest path min-cost flow over a small graph, using Bellman-Ford (SPFA) for the path search.
+    """
+    def __init__(self, node_count):
+        self.graph = [[] for _ in range(node_count)]
+
+    def add_edge(self, source, target, capacity, cost):
+        # edges are [target, capacity, cost, index of the reverse edge]; returns a handle for flow_on
+        self.graph[source].append([target, capacity, cost, len(self.graph[target])])
+        self.graph[target].append([source, 0, -cost, len(self.graph[source]) - 1])
+        return source, len(self.graph[source]) - 1
+
+    def flow_on(self, handle):
+        source, edge_index = handle
+        target, _, _, reverse_index = self.graph[source][edge_index]
+        return self.graph[target][reverse_index][1]
+
+    def min_cost_flow(self, source, sink, max_flow=None):
+        total_flow = 0
+        total_cost = 0
+        node_count = len(self.graph)
+        while max_flow is None or total_flow < max_flow:
+            distance = [None] * node_count
+            previous = [None] * node_count
+            in_queue = [False] * node_count
+            distance[source] = 0
+            queue = [source]
+            in_queue[source] = True
+            while queue:
+                node = queue.pop()
+                in_queue[node] = False
+                for edge_index, (target, capacity, cost, _) in enumerate(self.graph[node]):
+                    if capacity > 0 and (distance[target] is None or distance[node] + cost < distance[target]):
+                        distance[target] = distance[node] + cost
+                        previous[target] = (node, edge_index)
+                        if not in_queue[target]:
+                            queue.append(target)
+                            in_queue[target] = True
+            if distance[sink] is None:
+                break
+
+            # push as much as the path allows
+            push = None
+            node = sink
+            while node != source:
+                node, edge_index = previous[node]
+                capacity = self.graph[node][edge_index][1]
+                push = capacity if push is None else min(push, capacity)
+            if max_flow is not None:
+                push = min(push, max_flow - total_flow)
+
+            node = sink
+            while node != source:
+                node, edge_index = previous[node]
+                edge = self.graph[node][edge_index]
+                edge[1] -= push
+                self.graph[edge[0]][edge[3]][1] += push
+
+            total_flow += push
+            total_cost += push * distance[sink]
+        return total_flow, total_cost
+
+# Seat value of a player in each position, doubled so costs stay integers
+def _seat_values(player):
+    return tuple(int(position_preference_value(player.preferred_position1, player.preferred_position2, position) * 2) for position in POSITIONS)
+
+# Group play with partners into units of two. Each player joins at most one pair.
+def _play_with_pairs(players, rng):
+    order = list(players)
+    rng.shuffle(order)
+    paired = set()
+    pairs = []
+    for player in order:
+        if player.partner is None or player.index in paired or player.partner in paired:
+            continue
+        pairs.append((player, players[player.partner]))
+        paired.update((player.index, player.partner))
+    return pairs, paired
+
+# Seat the pairs first, greedily in the given order: each goes on one team in the orientation that suits it best
+# among the seats still free, keeping whole teams free where possible. This is not optimal over all pairs.
+def _seat_pairs(teams, pairs, rng):
+    unseated = []
+    for first, second in pairs:
+        first_values, second_values = _seat_values(first), _seat_values(second)
+        orientations = [(first_values[a] + second_values[b], rng.random(), a, b) for a in range(4) for b in range(4) if a != b]
+        orientations.sort(reverse=True)
+
+        # prefer a team that already holds a pair, so empty teams stay available for later pairs
+        candidates = sorted(range(len(teams)), key=lambda t: (sum(seat is None for seat in teams[t]), rng.random()))
+        seated = False
+        for _, _, a, b in orientations:
+            for t in candidates:
+                if teams[t][a] is None and teams[t][b] is None:
+                    teams[t][a] = first
+                    teams[t][b] = second
+                    seated = True
+                    break
+            if seated:
+                break
+        if not seated:
+            unseated.extend((first, second))
+    return unseated
+
+# Seat single players into the remaining seats with maximum total preference
+def _seat_singles(teams, singles, rng):
+    open_seats = [[t for t in range(len(teams)) if teams[t][p] is None] for p in range(4)]
+
+    classes = {}
+    for player in singles:
+        classes.setdefault(_seat_values(player), []).append(player)
+    class_values = list(classes)
+
+    # nodes: source, one per preference class, one per position, sink
+    source = 0
+    sink = len(class_values) + 5
+    flow = MinCostFlow(sink + 1)
+    handles = {}
+    for c, values in enumerate(class_values):
+        flow.add_edge(source, 1 + c, len(classes[values]), 0)
+        for p in range(4):
+            handles[c, p] = flow.add_edge(1 + c, 1 + len(class_values) + p, len(classes[values]), 2 - values[p])
+    for p in range(4):
+        flow.add_edge(1 + len(class_values) + p, sink, len(open_seats[p]), 0)
+    flow.min_cost_flow(source, sink)
+
+    unseated = []
+    for p in range(4):
+        rng.shuffle(open_seats[p])
+    for c, values in enumerate(class_values):
+        members = classes[values]
+        rng.shuffle(members)
+        for p in range(4):
+            for _ in range(flow.flow_on(handles[c, p])):
+                teams[open_seats[p].pop()][p] = members.pop()
+        unseated.extend(members)
+    return unseated
+
+# Build one roster, seating play with pairs greedily and the single players with optimal position preference.
+# Returns the teams and the snapshot players left unassigned.
+def assign_optimal_teams(snapshot, use_play_with=True, rng=random):
+    players = snapshot.players
+    teams = [[None] * 4 for _ in range(len(players) // 4)]
+
+    pairs, paired = _play_with_pairs(players, rng) if use_play_with else ([], set())
+    singles = [player for player in players if player.index not in paired]
+    singles.extend(_seat_pairs(teams, pairs, rng))
+    remaining = _seat_singles(teams, singles, rng)
+
+    rosters = [{position: seat.id if seat is not None else None for position, seat in zip(POSITIONS, team)} for team in teams]
+    return rosters, sorted(remaining, key=lambda player: player.index)
+
+def generate_optimal_assignments(snapshot, use_play_with=True, rng=random):
+    teams, _ = assign_optimal_teams(snapshot, use_play_with=use_play_with, rng=rng)
+    return teams
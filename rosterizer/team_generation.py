@@ -1,34 +1,68 @@
 # your_app/team_generation.py
 
-import logging
 import random
-from django.core import serializers
-from .models import PlayerSession, Player, Team
+from django.conf import settings
+from .models import PlayerSession, Team
+from .roster_engine import SessionSnapshot, assign_teams, generate_snapshot_assignments, iter_roster_seeds, iter_snapshot_rosters, unique_rosters
+from .seat_assignment import generate_optimal_assignments
 
 
-# Generate multiple candidate rosters and return them
-def generate_multiple_rosters(session_id, num_rosters=10, use_play_with=True):
-    rosters = []
-    player_sessions_query = PlayerSession.objects.filter(session_id=session_id)
+# Load the players of a session into an in-memory snapshot with a single query
+def load_session_snapshot(session_id):
+    player_sessions = PlayerSession.objects.filter(session_id=session_id).select_related('player').order_by('pk')
+    return SessionSnapshot.from_player_sessions(player_sessions, session_id=session_id)
 
-    for _ in range(num_rosters):
-        rosters.append(generate_team_assignments(list(player_sessions_query), use_play_with=use_play_with))
+# the ways of seating players, see generate_multiple_rosters
+ASSIGNMENTS = (
+    ('random', 'Random by preference'),
+    ('optimal', 'Best position preference (exact for players without a play with partner)'),
+)
 
-    return rosters
+# Generate multiple candidate rosters and return them
+# workers defaults to the ROSTERIZER_GENERATION_WORKERS setting; pass a seed to make the result reproducible.
+# assignment is 'random' for the randomized greedy generator or 'optimal' for min-cost seating (see seat_assignment)
+# With unique=True rosters that only differ in team order are generated once, so the result holds num_rosters
+# distinct rosters - or fewer, if the session does not have that many.
+def generate_multiple_rosters(session_id, num_rosters=10, use_play_with=True, workers=None, seed=None, assignment='random', unique=False):
+    snapshot = load_session_snapshot(session_id)
+    return list(iter_generated_rosters(snapshot, num_rosters, use_play_with=use_play_with, workers=workers, seed=seed, assignment=assignment, unique=unique))
+
+# Yield candidate rosters for a snapshot one at a time, see generate_multiple_rosters for the options.
+# num_rosters=None yields rosters until the caller stops.
+def iter_generated_rosters(snapshot, num_rosters, use_play_with=True, workers=None, seed=None, assignment='random', unique=False):
+    if workers is None:
+        workers = getattr(settings, 'ROSTERIZER_GENERATION_WORKERS', 1)
+    if assignment not in dict(ASSIGNMENTS):
+        raise ValueError(f'Unknown assignment mode {assignment}')
+
+    # a unique stream draws from an endless one until it has num_rosters distinct rosters
+    stream_length = None if unique else num_rosters
+    if assignment == 'optimal':
+        rosters = (generate_optimal_assignments(snapshot, use_play_with=use_play_with, rng=random.Random(roster_seed))
+                   for roster_seed in iter_roster_seeds(seed, stream_length))
+    else:
+        rosters = iter_snapshot_rosters(snapshot, stream_length, use_play_with=use_play_with, seed=seed, workers=workers)
+
+    if unique:
+        try:
+            yield from unique_rosters(rosters, num_rosters)
+        finally:
+            rosters.close()
+    else:
+        yield from rosters
 
 # Generate and save teams for a given session ID
 def generate_teams_for_session(session_id, use_play_with=True):
-    # Retrieve all PlayerSession instances for the given session ID
-    player_sessions_query = PlayerSession.objects.filter(session_id=session_id)
-    
-    # Calculate the number of teams
-    teams = generate_team_assignments(list(player_sessions_query), use_play_with=use_play_with)
+    snapshot = load_session_snapshot(session_id)
+    teams = generate_snapshot_assignments(snapshot, use_play_with=use_play_with)
 
     # Commit teams to the database
     apply_team_roster(session_id, teams)
     return f"Teams generated for session {session_id} with play with: {use_play_with}"
 
 def apply_team_roster(session_id, teams):
+    # every seated player session, with its player, in one query
+    player_sessions = load_player_sessions(roster_player_session_ids([teams]))
     team_number = 1
     for team in teams:
         # Create a new Team object
@@ -36,152 +70,53 @@ def apply_team_roster(session_id, teams):
         new_team.session_id = session_id
         new_team.team_number = team_number
         team_number += 1
-        skip = PlayerSession.objects.get(pk=team['Skip']) if team['Skip'] else None
-        vice = PlayerSession.objects.get(pk=team['Vice']) if team['Vice'] else None
-        second = PlayerSession.objects.get(pk=team['Second']) if team['Second'] else None
-        lead = PlayerSession.objects.get(pk=team['Lead']) if team['Lead'] else None
+        seats = hydrate_team(team, player_sessions)
 
-        new_team.set_players_from_player_sessions(skip, vice, second, lead)
+        new_team.set_players_from_player_sessions(seats['Skip'], seats['Vice'], seats['Second'], seats['Lead'])
 
         # Save the team to the database
         new_team.save()
 
 # Generate team assignments - this function will return a list of teams, each with a skip, vice, second, and lead
-# Internal function
+# Assigned player sessions are removed from the list that is passed in; anything left over could not be placed.
 def generate_team_assignments(player_sessions, use_play_with=True):
-    num_teams = len(player_sessions) // 4
-    
-    # Initialize teams
-    teams = [{position: None for position in ['Skip', 'Vice', 'Second', 'Lead']} for _ in range(num_teams)]
-    
-    # Assign skip to teams
-    for team in teams:
-        if team['Skip'] is None:
-            # Select a skip
-            skip = select_player_for_position('Skip', player_sessions)
-            if skip:
-                set_team_player(team, 'Skip', skip, player_sessions)
-                if use_play_with: add_play_with_players_to_team(team, player_sessions)
-                
-        if team['Skip'] is None:
-            logging.warning(f'Unable to assign a skip to team {team}')
-    
-    # Assign vice to teams
-    for team in teams:
-        if team['Vice'] is None:
-            # Select a vice
-            vice = select_player_for_position('Vice', player_sessions)
-            if vice:
-                set_team_player(team, 'Vice', vice, player_sessions)
-                if use_play_with: add_play_with_players_to_team(team, player_sessions)
-        if team['Vice'] is None:
-            logging.warning(f'Unable to assign a vice to team {team}')
-        
-    # Assign second to teams
-    for team in teams:
-        if team['Second'] is None:
-            # Select a second
-            second = select_player_for_position('Second', player_sessions)
-            if second:
-                set_team_player(team, 'Second', second, player_sessions)
-                if use_play_with: add_play_with_players_to_team(team, player_sessions)
-        if team['Second'] is None:
-            logging.warning(f'Unable to assign a second to team {team}')
-
-    # Assign lead to teams
-    for team in teams:
-        if team['Lead'] is None:
-            # Select a lead
-            lead = select_player_for_position('Lead', player_sessions)
-            if lead:
-                set_team_player(team, 'Lead', lead, player_sessions)
-                if use_play_with: add_play_with_players_to_team(team, player_sessions)
-        if team['Lead'] is None:
-            logging.warning(f'Unable to assign a lead to team {team}')
-
-    # at this point we should have no more player sessions to assign
-    if len(player_sessions) > 0:
-        logging.info(f"Players remaining: {player_sessions}, beginning to fill holes in rosters")
-        # Let's fill roster holes. Start with teams with player count of 1:
-        for team_player_count in range (1, 4):
-            for team in teams:
-                if len(player_sessions) > 0 and sum(team[position] is not None for position in ['Skip', 'Vice', 'Second', 'Lead']) == team_player_count:
-                    # we still have unaffiliated players, and we have a team with a low enough player count to add.
-                    player_session = random.choice(player_sessions)
-                    for position in ['Lead', 'Second', 'Vice', 'Skip']:
-                        if team[position] is None:
-                            set_team_player(team, position, player_session, player_sessions)
-                            break
-
-    if len(player_sessions) > 0:
-        logging.warning(f'Unable to assign all players to teams: {player_sessions}')
-    
+    snapshot = SessionSnapshot.from_player_sessions(player_sessions)
+    teams, remaining = assign_teams(snapshot, use_play_with=use_play_with)
+    player_sessions[:] = [player_sessions[player.index] for player in remaining]
     return teams
 
-# Helper function to select a player for a position
-def select_player_for_position(position, player_sessions):
-    candidates = [ps for ps in player_sessions if ps.preferred_position1 == position]
-    if not candidates:
-        candidates = [ps for ps in player_sessions if ps.preferred_position2 == position]
-    if candidates:
-        selected = random.choice(candidates)
-        return selected
-    return None
-
-# Helper function to select a player with no preference - possibly not needed but we'll hold onto it for now
-# def select_no_preference_player(player_sessions):
-#     candidates = [ps for ps in player_sessions if not ps.preferred_position1 and not ps.preferred_position2]
-#     if candidates:
-#         selected = random.choice(candidates)
-#         logging.info(f"Selected no preference player {selected.player} as last resort")
-#         return selected
-#     return None
-
-# Helper function to assign play with players to an existing team
-def add_play_with_players_to_team(team, player_sessions):
-    for _, team_position_player_session_id in team.items():
-        team_position_player_session = PlayerSession.objects.get(pk=team_position_player_session_id) if team_position_player_session_id else None
-        if team_position_player_session is not None:
-            preferred_player = next((ps for ps in player_sessions if ps.player.full_name == team_position_player_session.play_with), None)
-            if preferred_player:
-                if preferred_player.preferred_position1 and team[preferred_player.preferred_position1] is None:
-                    set_team_player(team, preferred_player.preferred_position1, preferred_player, player_sessions)
-                    logging.info(f"Added {team_position_player_session.player} partner {preferred_player.player} to team {team} at preferred position 1 {preferred_player.preferred_position1}")
-                elif preferred_player.preferred_position2 and team[preferred_player.preferred_position2] is None:
-                    set_team_player(team, preferred_player.preferred_position2, preferred_player, player_sessions)
-                    logging.info(f"Added {team_position_player_session.player} partner {preferred_player.player} to team {team} at preferred position 2 {preferred_player.preferred_position2}")
-                elif not preferred_player.preferred_position1 and not preferred_player.preferred_position2 and any(team[position] is None for position in ['Vice', 'Second', 'Lead']):
-                    for position in ['Lead', 'Second', 'Vice']:
-                        if team[position] is None:
-                            set_team_player(team, position, preferred_player, player_sessions)
-                            logging.info(f"Added {team_position_player_session.player} partner {preferred_player.player} without preferred position to team {team} at first available position {position}")
-                            break
-                else:
-                    logging.warning(f"Unable to add {preferred_player.player} to team {team} at either preferred position")
-
-# utility function to set a player to a team position and remove the player from the list of player sessions                
-def set_team_player(team, position, player_session, player_sessions):
-    team[position] = player_session.id
-    player_sessions.remove(player_session)
-    logging.info(f"Assigned {position} {player_session.player} to team {team}")
-
-# utility function to hydrate the rosters with PlayerSession objects
-def hydrate_rosters(rosters):
+# utility function to hydrate the rosters with PlayerSession objects. Every seat is loaded, with its player, in one
+# query; `player_sessions` may already hold them, as returned by load_player_sessions.
+def hydrate_rosters(rosters, player_sessions=None):
+    if player_sessions is None:
+        player_sessions = load_player_sessions(roster_player_session_ids(rosters))
     hydrated_rosters = []
     for roster in rosters:
         hydrated_roster = []
         for team in roster:
-            hydrated_team = hydrate_team(team)
+            hydrated_team = hydrate_team(team, player_sessions)
             hydrated_roster.append(hydrated_team)
         hydrated_rosters.append(hydrated_roster)
     return hydrated_rosters
 
-def hydrate_team(team):
-    hydrated_team = {
-                'Skip': PlayerSession.objects.get(pk=team['Skip']) if team['Skip'] else None,
-                'Vice': PlayerSession.objects.get(pk=team['Vice']) if team['Vice'] else None,
-                'Second': PlayerSession.objects.get(pk=team['Second']) if team['Second'] else None,
-                'Lead': PlayerSession.objects.get(pk=team['Lead']) if team['Lead'] else None,
-            }   
+def hydrate_team(team, player_sessions=None):
+    if player_sessions is None:
+        player_sessions = load_player_sessions(team.values())
+    hydrated_team = {}
+    for position in ['Skip', 'Vice', 'Second', 'Lead']:
+        player_session_id = team[position]
+        if not player_session_id:
+            hydrated_team[position] = None
+        elif player_session_id in player_sessions:
+            hydrated_team[position] = player_sessions[player_session_id]
+        else:
+            raise PlayerSession.DoesNotExist(f'PlayerSession {player_session_id} does not exist')
     return hydrated_team
 
+# every player session id seated in the rosters
+def roster_player_session_ids(rosters):
+    return {player_session_id for roster in rosters for team in roster for player_session_id in team.values() if player_session_id}
+
+# player session id -> PlayerSession with its player, in one query
+def load_player_sessions(player_session_ids):
+    return PlayerSession.objects.select_related('player').in_bulk([player_session_id for player_session_id in player_session_ids if player_session_id])
@@ -0,0 +1,75 @@
+# rosterizer/team_history.py
+#
+# Pair co-occurrence index over team history. Every pair of players who shared a team is stored as a TeamPair
+# row, written whenever a team is saved. Continuity scoring then only looks at the pairs inside a candidate
+# team: m of its players were together on a previous team exactly when m * (m - 1) / 2 of its pairs share it.
+
+from itertools import combinations
+from math import isqrt
+
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Team, TeamPair
+
+def team_player_pks(team):
+    return {player_pk for player_pk in (team.skip_id, team.vice_id, team.second_id, team.lead_id) if player_pk is not None}
+
+# Every pair of a set of players, smaller pk first
+def player_pairs(player_pks):
+    return combinations(sorted(player_pks), 2)
+
+# Write the pairs of saved teams, replacing whatever pairs those teams had before.
+# Deleted teams take their pairs with them through the cascade.
+def record_team_pairs(teams):
+    teams = list(teams)
+    TeamPair.objects.filter(team__in=teams).delete()
+    TeamPair.objects.bulk_create([
+        TeamPair(team_id=team.pk, session_id=team.session_id, player_a_id=player_a, player_b_id=player_b)
+        for team in teams
+        for player_a, player_b in player_pairs(team_player_pks(team))
+    ])
+
+# Rebuild the pairs of whole sessions from their teams, for teams written without saving them one by one
+def rebuild_session_pairs(session_ids):
+    record_team_pairs(Team.objects.filter(session_id__in=session_ids))
+
+@receiver(post_save, sender=Team)
+def _record_saved_team(sender, instance, raw=False, **kwargs):
+    if not raw:
+        record_team_pairs([instance])
+
+class PairIndex:
+    """
+    The player pairs of a set of previous teams: (player_a, player_b) -> ids of the teams they shared.
+    """
+    __slots__ = ('pairs',)
+
+    def __init__(self):
+        self.pairs = {}
+
+    def add(self, team_id, player_pks):
+        for pair in player_pairs(player_pks):
+            self.add_pair(team_id, *pair)
+
+    def add_pair(self, team_id, player_a, player_b):
+        self.pairs.setdefault((player_a, player_b), []).append(team_id)
+
+    def max_overlap(self, player_pks):
+        # The most of these players that were together on one previous team; 0 when no two of them were
+        shared = {}
+        for pair in player_pairs(player_pks):
+            for team_id in self.pairs.get(pair, ()):
+                shared[team_id] = shared.get(team_id, 0) + 1
+        if not shared:
+            return 0
+        # m players on one team share m * (m - 1) / 2 pairs
+        return (1 + isqrt(1 + 8 * max(shared.values()))) // 2
+
+# One query for the pair indexes of several sessions. Returns session id -> PairIndex.
+def load_pair_indexes(session_ids):
+    indexes = {session_id: PairIndex() for session_id in session_ids}
+    if indexes:
+        for session_id, team_id, player_a, player_b in TeamPair.objects.filter(session_id__in=indexes).values_list('session_id', 'team_id', 'player_a_id', 'player_b_id'):
+            indexes[session_id].add_pair(team_id, player_a, player_b)
+    return indexes
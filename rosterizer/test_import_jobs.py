@@ -0,0 +1,139 @@
+import json
+from datetime import timedelta
+
+import pytest
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory
+from django.utils import timezone
+
+from rosterizer import import_jobs
+from rosterizer.import_jobs import ProgressReporter, fail_stale_import_jobs, run_import_job, start_import_job
+from rosterizer.models import ImportJob, Player, Team
+from .views import import_job_status
+
+@pytest.fixture(autouse=True)
+def media_root(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    return tmp_path
+
+def upload(file_path):
+    with open(file_path, 'rb') as file:
+        return SimpleUploadedFile(file_path.rsplit('/', 1)[-1], file.read())
+
+@pytest.mark.django_db
+def test_run_import_job_records_progress_and_drops_upload(session):
+    with open('rosterizer/test_data/TestRosterCSVImport.csv', 'rb') as file:
+        upload_path = default_storage.save('imports/TestRosterCSVImport.csv', File(file))
+    job = ImportJob.objects.create(session=session, kind=ImportJob.Kind.ROSTER, create_teams=True, file_name='TestRosterCSVImport.csv', upload_path=upload_path)
+
+    job = run_import_job(job.pk)
+
+    assert job.status == ImportJob.Status.SUCCEEDED
+    assert job.finished
+    assert job.processed_rows == 16
+    assert job.phase == ImportJob.Phase.WRITING
+    assert job.started_at is not None and job.finished_at is not None
+    assert Player.objects.count() == 16
+    assert Team.objects.filter(session=session).count() == 4
+    assert ImportJob.objects.get(pk=job.pk).upload_path == ''
+    assert not default_storage.exists(upload_path)
+
+@pytest.mark.django_db
+def test_run_import_job_records_failure(session):
+    job = ImportJob.objects.create(session=session, kind=ImportJob.Kind.PLAYERS, file_name='missing.html')
+
+    job = run_import_job(job.pk)
+
+    assert job.status == ImportJob.Status.FAILED
+    assert job.finished
+    assert 'missing.html is missing' in job.message
+    assert Player.objects.count() == 0
+
+@pytest.mark.django_db
+def test_start_import_job_runs_inline_without_workers(session, settings):
+    settings.ROSTERIZER_IMPORT_WORKERS = 0
+    job = ImportJob.objects.create(session=session, kind=ImportJob.Kind.PLAYERS, file_name='TestImport1.html')
+
+    start_import_job(job, upload('rosterizer/test_data/TestImport1.html'))
+
+    job.refresh_from_db()
+    assert job.status == ImportJob.Status.SUCCEEDED
+    assert job.upload_path == ''
+    assert Player.objects.count() == 8
+
+@pytest.mark.django_db
+def test_start_import_job_keeps_upload_for_workers(session, settings, django_capture_on_commit_callbacks):
+    settings.ROSTERIZER_IMPORT_WORKERS = 1
+    job = ImportJob.objects.create(session=session, kind=ImportJob.Kind.PLAYERS, file_name='TestImport1.html')
+
+    with django_capture_on_commit_callbacks() as callbacks:
+        start_import_job(job, upload('rosterizer/test_data/TestImport1.html'))
+
+    assert len(callbacks) == 1
+    upload_path = ImportJob.objects.get(pk=job.pk).upload_path
+    assert upload_path.startswith('imports/')
+    with open('rosterizer/test_data/TestImport1.html', 'rb') as file, default_storage.open(upload_path, 'rb') as stored:
+        assert stored.read() == file.read()
+
+    # the worker reads the stored file and deletes it when done
+    job = run_import_job(job.pk)
+    assert job.status == ImportJob.Status.SUCCEEDED
+    assert Player.objects.count() == 8
+    assert not default_storage.exists(upload_path)
+
+@pytest.mark.django_db
+def test_import_job_status(session):
+    job = ImportJob.objects.create(session=session, kind=ImportJob.Kind.PLAYERS, file_name='TestImport1.html')
+    response = import_job_status(RequestFactory().get(f'/import_jobs/{job.pk}/status/'), job.pk)
+    assert response.status_code == 200
+    data = json.loads(response.content)
+    assert data['status'] == 'queued'
+    assert data['finished'] is False
+
+    response = import_job_status(RequestFactory().get('/import_jobs/999/status/'), 999)
+    assert response.status_code == 404
+
+@pytest.mark.django_db
+def test_orphaned_jobs_are_marked_failed(session, settings):
+    settings.ROSTERIZER_IMPORT_JOB_TIMEOUT = 60
+    stale = timezone.now() - timedelta(minutes=5)
+    running = ImportJob.objects.create(session=session, kind=ImportJob.Kind.PLAYERS, file_name='a.html', status=ImportJob.Status.RUNNING, heartbeat_at=stale)
+    upload_path = default_storage.save('imports/b.html', ContentFile(b'<html></html>'))
+    queued = ImportJob.objects.create(session=session, kind=ImportJob.Kind.PLAYERS, file_name='b.html', upload_path=upload_path, heartbeat_at=stale)
+    live = ImportJob.objects.create(session=session, kind=ImportJob.Kind.PLAYERS, file_name='c.html', status=ImportJob.Status.RUNNING)
+
+    response = import_job_status(RequestFactory().get(f'/import_jobs/{running.pk}/status/'), running.pk)
+    data = json.loads(response.content)
+    assert data['status'] == 'failed'
+    assert data['finished'] is True
+    assert 'stopped without finishing' in data['message']
+    assert ImportJob.objects.get(pk=queued.pk).status == ImportJob.Status.FAILED
+    assert not default_storage.exists(upload_path)
+    assert ImportJob.objects.get(pk=live.pk).status == ImportJob.Status.RUNNING
+    assert fail_stale_import_jobs() == 0
+
+    # a worker that picks up a job given up on leaves it alone
+    job = run_import_job(queued.pk)
+    assert job.status == ImportJob.Status.FAILED
+    assert job.started_at is None
+
+@pytest.mark.django_db
+def test_jobs_queued_behind_a_long_import_stay_alive(session, settings, monkeypatch):
+    settings.ROSTERIZER_IMPORT_JOB_TIMEOUT = 60
+    stale = timezone.now() - timedelta(minutes=5)
+    running = ImportJob.objects.create(session=session, kind=ImportJob.Kind.PLAYERS, file_name='a.html', status=ImportJob.Status.RUNNING)
+    queued = ImportJob.objects.create(session=session, kind=ImportJob.Kind.PLAYERS, file_name='b.html', heartbeat_at=stale)
+    elsewhere = ImportJob.objects.create(session=session, kind=ImportJob.Kind.PLAYERS, file_name='c.html', heartbeat_at=stale)
+    monkeypatch.setattr(import_jobs, '_pending_jobs', {running.pk, queued.pk})
+
+    # this process still holds the queued job, so its old heartbeat does not fail it
+    assert fail_stale_import_jobs() == 1
+    assert ImportJob.objects.get(pk=queued.pk).status == ImportJob.Status.QUEUED
+    assert ImportJob.objects.get(pk=elsewhere.pk).status == ImportJob.Status.FAILED
+
+    # progress on the running job keeps the queued one alive for every other process too
+    ProgressReporter(running).flush()
+    assert ImportJob.objects.get(pk=queued.pk).heartbeat_at > stale
@@ -0,0 +1,110 @@
+import pytest
+
+from rosterizer.management.commands.import_players import ImportPlayersCommand, read_player_rows
+from rosterizer.models import Player, PlayerSession, RosterRun, Session
+from rosterizer.roster_cache import score_cache
+from rosterizer.roster_store import load_scored_roster_run, save_roster_run
+
+FILE_PATH = 'rosterizer/test_data/TestImport1.html'
+
+def test_read_player_rows():
+    with open(FILE_PATH, 'rb') as file:
+        rows = list(read_player_rows(file))
+    assert len(rows) == 8
+    assert rows[0] == {
+        'first_name': 'John', 'last_name': 'Smith', 'home_phone': '555-123-4567', 'work_phone': '555-234-5678', 'cell_phone': '555-345-6789',
+        'email': 'john.smith@example.com', 'gender': 'M', 'years_curled': 5, 'preferred_position1': 'Skip', 'preferred_position2': 'Vice',
+        'play_with': 'Jane Doe',
+    }
+    assert list(read_player_rows(FILE_PATH)) == rows
+
+@pytest.mark.django_db
+def test_import_players_updates_existing_players(django_assert_max_num_queries):
+    session = Session.objects.create(year=2024, session_number=1)
+    existing = Player.objects.create(first_name='John', last_name='Smith', email='old@example.com')
+
+    command = ImportPlayersCommand()
+    # one of them drops the session's stored roster runs, which the changed players invalidate
+    with django_assert_max_num_queries(13):
+        command.handle(player_file=FILE_PATH, session_id=session.pk)
+
+    assert Player.objects.count() == 8
+    assert Player.objects.get(pk=existing.pk).email == 'john.smith@example.com'
+    assert PlayerSession.objects.filter(session=session).count() == 8
+    assert PlayerSession.objects.get(player=existing).play_with_status == PlayerSession.PlayWithStatus.RESOLVED
+
+def test_read_player_rows_streams_large_exports(tmp_path):
+    with open(FILE_PATH, encoding='utf-8') as file:
+        export = file.read()
+    head, rest = export.split('<tbody', 1)
+    body_start, rest = rest.split('>', 1)
+    body, tail = rest.split('</tbody>', 1)
+    big_export = tmp_path / 'big.html'
+    big_export.write_text(f'{head}<tbody{body_start}>{body * 500}</tbody>{tail}<table><tr>{"<td>x</td>" * 20}</tr></table>', encoding='utf-8')
+
+    count = 0
+    for row in read_player_rows(str(big_export)):
+        count += 1
+    # rows of later tables are not members
+    assert count == 8 * 500
+
+
+@pytest.mark.django_db
+def test_reimport_applies_only_the_differences(tmp_path, django_assert_max_num_queries):
+    session = Session.objects.create(year=2024, session_number=1)
+    command = ImportPlayersCommand()
+    command.handle(player_file=FILE_PATH, session_id=session.pk)
+    assert command.summary.to_dict() == {'created': 8, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+
+    # an unchanged file writes nothing
+    with django_assert_max_num_queries(6):
+        command.handle(player_file=FILE_PATH, session_id=session.pk)
+    assert command.summary.to_dict() == {'created': 0, 'updated': 0, 'deleted': 0, 'unchanged': 8}
+    assert PlayerSession.objects.filter(session=session).count() == 8
+
+    # a corrected export with one changed row and one row left out
+    with open(FILE_PATH, encoding='utf-8') as file:
+        export = file.read()
+    first_row = export.index('<tr', export.index('<tbody'))
+    second_row = export.index('<tr', first_row + 1)
+    third_row = export.index('<tr', second_row + 1)
+    corrected = tmp_path / 'corrected.html'
+    corrected.write_text(export[:first_row] + export[first_row:second_row].replace('john.smith@example.com', 'john@example.com') + export[third_row:], encoding='utf-8')
+
+    command.handle(player_file=str(corrected), session_id=session.pk)
+    assert command.summary.to_dict() == {'created': 0, 'updated': 1, 'deleted': 1, 'unchanged': 6}
+    assert PlayerSession.objects.filter(session=session).count() == 7
+    assert Player.objects.get(first_name='John', last_name='Smith').email == 'john@example.com'
+
+@pytest.mark.django_db
+def test_reimport_drops_stored_roster_runs():
+    session = Session.objects.create(year=2024, session_number=1)
+    command = ImportPlayersCommand()
+    command.handle(player_file=FILE_PATH, session_id=session.pk)
+    ids = list(PlayerSession.objects.filter(session=session).order_by('pk').values_list('pk', flat=True))
+    run = save_roster_run(session.pk, [[dict(zip(['Skip', 'Vice', 'Second', 'Lead'], ids[:4])), dict(zip(['Skip', 'Vice', 'Second', 'Lead'], ids[4:]))]])
+    assert load_scored_roster_run(run.pk, session.pk) is not None
+    assert len(score_cache)
+
+    # an unchanged file keeps the run
+    command.handle(player_file=FILE_PATH, session_id=session.pk)
+    assert RosterRun.objects.filter(pk=run.pk).exists()
+
+    # a file without the first player removes the player session the run seats, and the run with it
+    PlayerSession.objects.filter(pk=ids[0]).update(content_hash='')
+    Player.objects.filter(playersession__pk=ids[0]).update(first_name='Gone')
+    command.handle(player_file=FILE_PATH, session_id=session.pk)
+    assert command.summary.deleted == 1
+    assert not RosterRun.objects.filter(session=session).exists()
+    assert load_scored_roster_run(run.pk, session.pk) is None
+    assert len(score_cache) == 0
+
+@pytest.mark.django_db
+def test_import_players_from_chunks():
+    session = Session.objects.create(year=2024, session_number=1)
+    with open(FILE_PATH, 'rb') as file:
+        content = file.read()
+
+    ImportPlayersCommand().handle(player_file=(content[i:i + 1000] for i in range(0, len(content), 1000)), session_id=session.pk)
+
+    assert PlayerSession.objects.filter(session=session).count() == 8
@@ -0,0 +1,121 @@
+import io
+
+import pytest
+
+from rosterizer.management.commands.import_roster import ImportRosterCsvCommand, assemble_teams, open_roster_file, read_roster_rows
+from rosterizer.models import Player, PlayerSession, Session, Team, TeamPair
+
+HEADER = ('Roster export,,,,,,,,,,,,,,,,,,,\n'
+          '#,Member Name,Home Phone,Work Phone,Cell Phone,Email,Gender,Years Curled,Preferred Position 1,Preferred Position 2,'
+          'Skip,Vice,Second,Lead,Team,Play With,Comments,Sign-Up Date,Membership Type,Session 1 Points\n')
+
+def member(number, name, skip='', vice='', second='', lead='', team=''):
+    return f'{number},"{name}",,,,,Male,1,Skip,,{skip},{vice},{second},{lead},{team},,,,,\n'
+
+@pytest.fixture
+def roster_file(tmp_path):
+    path = tmp_path / 'roster.csv'
+    path.write_text(HEADER
+                    + member(1, 'Lead, Larry', lead='1', team='1')
+                    + member(2, 'Skip, Sam', skip='1', team='1')
+                    + member(3, 'Spare, Sue', team='1')
+                    + member(4, 'Vice, Val', vice='2')
+                    + member(5, 'Second, Stan', second='1', team='1'), encoding='utf-8')
+    return path
+
+def test_read_roster_rows(roster_file):
+    with open(roster_file, encoding='utf-8') as csvfile:
+        rows = list(read_roster_rows(csvfile))
+    assert [(row['first_name'], row['position'], row['team_number']) for row in rows] == [
+        ('Larry', 'Lead', 1), ('Sam', 'Skip', 1), ('Sue', None, 1), ('Val', 'Vice', 2), ('Stan', 'Second', 1)]
+
+def test_assemble_teams_prefers_position_columns():
+    class Stub:
+        def __init__(self, pk):
+            self.pk = pk
+    rows = [{'first_name': name, 'last_name': '', 'team_number': team, 'position': position}
+            for name, team, position in [('a', 1, 'Lead'), ('b', 1, 'Lead'), ('c', 1, None), ('d', 1, 'Skip'), ('e', None, None)]]
+    players = {(name, ''): Stub(pk) for pk, name in enumerate('abcde', start=1)}
+    assert assemble_teams(rows, players) == {1: {'Skip': 4, 'Vice': 2, 'Second': 3, 'Lead': 1}}
+
+@pytest.mark.django_db
+def test_import_roster_creates_teams_in_bulk(roster_file, django_assert_max_num_queries):
+    session = Session.objects.create(year=2024, session_number=1)
+    with django_assert_max_num_queries(16):
+        ImportRosterCsvCommand().handle(roster_file=str(roster_file), session_id=session.pk, create_teams=True)
+
+    assert PlayerSession.objects.filter(session=session).count() == 5
+    team1, team2 = Team.objects.filter(session=session).order_by('team_number')
+    assert [player.first_name for player in team1.get_players()] == ['Sam', 'Sue', 'Stan', 'Larry']
+    assert team2.vice.first_name == 'Val' and team2.skip is None
+    assert TeamPair.objects.filter(team=team1).count() == 6
+
+    # importing again updates the same teams rather than adding new ones
+    ImportRosterCsvCommand().handle(roster_file=str(roster_file), session_id=session.pk, create_teams=True)
+    assert Team.objects.filter(session=session).count() == 2
+    assert Player.objects.count() == 5
+
+@pytest.mark.django_db
+def test_reimport_roster_is_a_no_op(roster_file, django_assert_max_num_queries):
+    session = Session.objects.create(year=2024, session_number=1)
+    # a duplicate left behind by an older import is cleaned up
+    ImportRosterCsvCommand().handle(roster_file=str(roster_file), session_id=session.pk, create_teams=True)
+    PlayerSession.objects.create(player=Player.objects.get(first_name='Sam'), session=session, years_curled=1, preferred_position1='Skip', preferred_position2='', play_with='')
+
+    command = ImportRosterCsvCommand()
+    command.handle(roster_file=str(roster_file), session_id=session.pk, create_teams=True)
+    assert command.summary.to_dict() == {'created': 0, 'updated': 0, 'deleted': 1, 'unchanged': 5}
+
+    with django_assert_max_num_queries(7):
+        command.handle(roster_file=str(roster_file), session_id=session.pk, create_teams=True)
+    assert command.summary.to_dict() == {'created': 0, 'updated': 0, 'deleted': 0, 'unchanged': 5}
+    assert PlayerSession.objects.filter(session=session).count() == 5
+    assert Team.objects.filter(session=session).count() == 2
+
+@pytest.mark.django_db
+def test_reimport_roster_moves_and_removes_players(tmp_path):
+    session = Session.objects.create(year=2024, session_number=1)
+    first = tmp_path / 'first.csv'
+    first.write_text(HEADER
+                     + member(1, 'Lead, Larry', lead='1', team='1')
+                     + member(2, 'Skip, Sam', skip='1', team='1')
+                     + member(3, 'Spare, Sue', team='1')
+                     + member(4, 'Vice, Val', vice='2')
+                     + member(5, 'Third, Tom', skip='3')
+                     + member(6, 'Fourth, Fay', vice='3')
+                     + member(7, 'Eighth, Ed', lead='3'), encoding='utf-8')
+    ImportRosterCsvCommand().handle(roster_file=str(first), session_id=session.pk, create_teams=True)
+
+    # Sam and Val swap teams, Fay moves from team 3 to team 2, and Sue and Tom leave the session
+    corrected = tmp_path / 'corrected.csv'
+    corrected.write_text(HEADER
+                         + member(1, 'Lead, Larry', lead='1', team='1')
+                         + member(2, 'Skip, Sam', skip='2')
+                         + member(4, 'Vice, Val', vice='1')
+                         + member(6, 'Fourth, Fay', second='2')
+                         + member(7, 'Eighth, Ed'), encoding='utf-8')
+    command = ImportRosterCsvCommand()
+    command.handle(roster_file=str(corrected), session_id=session.pk, create_teams=True)
+    assert command.summary.deleted == 2
+
+    def seats(team_number):
+        team = Team.objects.get(session=session, team_number=team_number)
+        return [player.first_name if player else None for player in (team.skip, team.vice, team.second, team.lead)]
+    assert seats(1) == [None, 'Val', None, 'Larry']
+    assert seats(2) == ['Sam', None, 'Fay', None]
+    # team 3 is not in the file: it keeps Ed and loses the players who left or moved
+    assert seats(3) == [None, None, None, 'Ed']
+    assert not TeamPair.objects.filter(team__team_number=3).exists()
+
+def test_read_roster_rows_from_uploads(roster_file):
+    content = roster_file.read_bytes()
+    with open(roster_file, encoding='utf-8') as csvfile:
+        expected = list(read_roster_rows(csvfile))
+
+    # a binary file, which is left open for its owner, and an iterator of chunks split mid-line
+    binary = io.BytesIO(content)
+    with open_roster_file(binary) as csvfile:
+        assert list(read_roster_rows(csvfile)) == expected
+    assert not binary.closed
+    with open_roster_file(content[i:i + 7] for i in range(0, len(content), 7)) as csvfile:
+        assert list(read_roster_rows(csvfile)) == expected
@@ -0,0 +1,92 @@
+import pytest
+
+from rosterizer.models import Player, PlayerSession, Session
+from .name_index import NameIndex, TrigramIndex, play_with_suggestions
+from .utilities import check_player_issues, play_with_hints, resolve_play_with
+
+@pytest.fixture
+def index():
+    return NameIndex([(1, 'John Smith'), (2, 'Jane Smith'), (3, 'Mary Anne Jones'), (4, 'john smith'), (5, 'David White')])
+
+def test_lookup_exact_then_case_insensitive(index):
+    assert index.lookup('John Smith') == [1]
+    assert index.lookup('JOHN  smith') == [1, 4]
+    assert index.find('JOHN  smith') is None
+    assert index.find('david white') == 5
+
+def test_lookup_token_prefixes(index):
+    assert index.lookup('Mary Ann') == [3]
+    assert index.lookup('M Jones') == [3]
+    assert index.lookup('Ja Sm') == [2]
+    assert sorted(index.lookup('Smith')) == [1, 2, 4]
+    # prefixes have to follow the order of the name
+    assert index.lookup('Jones Mary') == []
+    assert index.lookup('Nobody') == []
+    assert NameIndex().lookup('John') == []
+
+@pytest.mark.django_db
+def test_for_players_reads_the_club_once(django_assert_num_queries):
+    Player.objects.bulk_create([Player(first_name=f'First{i}', last_name=f'Last{i}') for i in range(50)])
+    with django_assert_num_queries(1):
+        index = NameIndex.for_players()
+    assert len(index) == 50
+    assert index.find('first7 last7') == Player.objects.get(first_name='First7').pk
+
+@pytest.mark.django_db
+def test_check_player_issues_for_a_large_club(django_assert_max_num_queries):
+    session = Session.objects.create(year=2024, session_number=1)
+    players = Player.objects.bulk_create([Player(first_name=f'First{i}', last_name=f'Last{i}') for i in range(3000)])
+    PlayerSession.objects.bulk_create([
+        PlayerSession(player=player, session=session, years_curled=1, preferred_position1='Skip', preferred_position2='',
+                      # every tenth partner is in the club but not the session, every hundredth in neither
+                      play_with='Nobody Known' if i % 100 == 99 else f'First{i + 1000 if i % 10 == 9 else (i + 1) % 300} Last{i + 1000 if i % 10 == 9 else (i + 1) % 300}')
+        for i, player in enumerate(players[:300])
+    ])
+
+    with django_assert_max_num_queries(8):
+        issues = check_player_issues(session)
+    assert len([issue for issue in issues if 'invalid play with' in issue]) == 3
+    assert len([issue for issue in issues if 'not registered in session' in issue]) == 27
+
+    # once resolved, checking again is a single read
+    with django_assert_max_num_queries(2):
+        assert check_player_issues(session) == issues
+
+def test_trigram_index_similar():
+    index = TrigramIndex([(1, 'Charlie Brown'), (2, 'Lucy Brown'), (3, 'David White'), (4, 'Alice Johnson')])
+    assert [key for key, _, _ in index.similar('Charie Brown')] == [1]
+    assert index.similar('Charie Brown', threshold=0.3)[1][0] == 2
+    assert index.similar('David white')[0][:2] == (3, 'David White')
+    assert index.similar('Nobody Here') == []
+
+@pytest.fixture
+def fuzzy_session():
+    session = Session.objects.create(year=2024, session_number=1)
+    names = [('Charlie', 'Brown'), ('Lucy', 'White'), ('David', 'Whyte'), ('Emma', 'Teal')]
+    players = Player.objects.bulk_create([Player(first_name=first, last_name=last) for first, last in names])
+    play_withs = ['Lucy White', 'Charie Brown', 'Emma Teel', 'Zed Zulu']
+    PlayerSession.objects.bulk_create([
+        PlayerSession(player=player, session=session, years_curled=1, preferred_position1='Skip', preferred_position2='', play_with=play_with)
+        for player, play_with in zip(players, play_withs)
+    ])
+    resolve_play_with(session.pk)
+    return session
+
+@pytest.mark.django_db
+def test_play_with_suggestions_are_cached_per_session(fuzzy_session, django_assert_num_queries):
+    suggestions = play_with_suggestions(fuzzy_session.pk)
+    assert sorted((requester, play_with, [name for _, name, _ in matches]) for requester, play_with, matches in suggestions.values()) == [
+        ('David Whyte', 'Emma Teel', ['Emma Teal']), ('Lucy White', 'Charie Brown', ['Charlie Brown'])]
+    with django_assert_num_queries(0):
+        assert play_with_suggestions(fuzzy_session.pk) is suggestions
+
+    # any change to the session's players drops the cached suggestions
+    PlayerSession.objects.filter(session=fuzzy_session, player__first_name='Lucy').get().save()
+    assert play_with_suggestions(fuzzy_session.pk) is not suggestions
+
+@pytest.mark.django_db
+def test_check_player_issues_suggests_partners(fuzzy_session):
+    issues = check_player_issues(fuzzy_session)
+    assert 'Player Lucy White has an invalid play with (Charie Brown), did you mean Charlie Brown?' in issues
+    assert 'Player Emma Teal has an invalid play with (Zed Zulu)' in issues
+    assert play_with_hints(fuzzy_session.pk)[0] == 'Lucy White asked to play with Charie Brown, did you mean Charlie Brown?'
@@ -0,0 +1,100 @@
+import tracemalloc
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from rosterizer.models import Session, Team
+from .roster_batch import EMPTY, BatchEncoder, evaluate_roster_batch, team_overlaps
+from .roster_engine import generate_snapshot_rosters
+from .roster_evaluation import EvaluationContext, evaluate_rosters
+from .team_generation import load_session_snapshot
+from .utilities import resolve_play_with
+
+@pytest.fixture
+def history(make_players, add_player_sessions):
+    sessions = [Session.objects.create(year=2024, session_number=number) for number in range(1, 4)]
+    current = Session.objects.create(year=2024, session_number=4)
+    players = make_players(14)
+    for s, session in enumerate(sessions):
+        order = players[s:] + players[:s]
+        for t in range(3):
+            Team.objects.create(session=session, team_number=t + 1, skip=order[4 * t], vice=order[4 * t + 1], second=order[4 * t + 2], lead=order[4 * t + 3])
+    add_player_sessions(current, positions=['Skip', 'Vice', 'Second', 'Lead', ''], second_shift=2, partner_every=3, players=players)
+    resolve_play_with(current.pk)
+    return current
+
+@pytest.mark.django_db
+def test_evaluate_roster_batch_matches_evaluate_rosters(history):
+    rosters = generate_snapshot_rosters(load_session_snapshot(history.pk), 40, seed=3)
+    # a short roster and a roster with open seats
+    rosters.append(rosters[0][:2])
+    rosters.append([{**team, 'Lead': None} for team in rosters[1]])
+
+    expected = evaluate_rosters(rosters, history.pk)
+    actual = evaluate_roster_batch(rosters, history.pk)
+    assert len(actual) == len(expected)
+    for actual_score, expected_score in zip(actual, expected):
+        assert actual_score.keys() == expected_score.keys()
+        for key, value in expected_score.items():
+            assert actual_score[key] == pytest.approx(value), key
+
+@pytest.mark.django_db
+def test_evaluate_roster_batch_matches_on_duplicate_and_partial_teams(make_players, add_player_sessions):
+    previous = Session.objects.create(year=2024, session_number=1)
+    current = Session.objects.create(year=2024, session_number=2)
+    players = make_players(8)
+    # player 0 was with 1 and 2 on one team and with 3 on another, and 4 and 5 played on the same team twice;
+    # none of these make three players who were together before
+    Team.objects.create(session=previous, team_number=1, skip=players[0], vice=players[1], second=players[2])
+    Team.objects.create(session=previous, team_number=2, skip=players[0], vice=players[3])
+    Team.objects.create(session=previous, team_number=3, skip=players[4], vice=players[5])
+    Team.objects.create(session=previous, team_number=4, skip=players[5], vice=players[4], lead=players[6])
+    ids = [player_session.pk for player_session in add_player_sessions(current, positions=[''], players=players)]
+    rosters = [
+        [{'Skip': ids[0], 'Vice': ids[1], 'Second': ids[3], 'Lead': ids[7]}, {'Skip': ids[4], 'Vice': ids[5], 'Second': ids[2], 'Lead': ids[6]}],
+        [{'Skip': ids[0], 'Vice': ids[1], 'Second': ids[2], 'Lead': ids[3]}, {'Skip': ids[4], 'Vice': ids[5], 'Second': ids[7], 'Lead': None}],
+    ]
+
+    expected = evaluate_rosters(rosters, current.pk)
+    actual = evaluate_roster_batch(rosters, current.pk)
+    assert [score['team_continuity_1'] for score in actual] == [[0.66, 0.33], [0.33, 0.66]]
+    for actual_score, expected_score in zip(actual, expected):
+        for key, value in expected_score.items():
+            assert actual_score[key] == pytest.approx(value), key
+
+@pytest.mark.django_db
+def test_batch_encoder_round_trip(history):
+    encoder = BatchEncoder(EvaluationContext(history.pk))
+    rosters = generate_snapshot_rosters(load_session_snapshot(history.pk), 3, seed=1)
+    rosters.append(rosters[0][:1])
+    seats, team_counts = encoder.encode(rosters)
+    assert seats.shape == (4, 3, 4)
+    assert seats.dtype == np.int32
+    assert (seats[3, 1:] == EMPTY).all()
+    assert encoder.decode(seats, team_counts) == rosters
+
+    with pytest.raises(ValueError):
+        encoder.encode([[{'Skip': -5, 'Vice': None, 'Second': None, 'Lead': None}]])
+
+@pytest.mark.django_db
+def test_previous_teams_has_one_slot_per_team_of_a_player(history):
+    encoder = BatchEncoder(EvaluationContext(history.pk))
+    assert encoder.previous_teams(encoder.context.pairs_for_lookback(1)).shape == (len(encoder) + 1, 1)
+
+def test_team_overlaps_memory_does_not_grow_with_team_history():
+    # 10000 rosters of 50 teams from 200 players, who played on 50 teams of four last session
+    players, teams, count = 200, 50, 10000
+    previous_teams = np.append(np.arange(players, dtype=np.int32) // 4, EMPTY)[:, None]
+    rng = np.random.default_rng(0)
+    padded = np.stack([rng.permutation(players).reshape(teams, 4) for _ in range(count)])
+    counted = np.ones(padded.shape, dtype=bool)
+
+    tracemalloc.start()
+    overlap = team_overlaps(padded, counted, previous_teams)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert overlap.shape == (count, teams)
+    assert overlap.max() <= 4
+    # a rosters x teams x 4 x previous teams gather alone would take 100 MB
+    assert peak < 50 * 1024 * 1024
@@ -0,0 +1,64 @@
+import pytest
+
+from rosterizer.models import PlayerSession, Session, Team
+from .roster_cache import LRUCache, cached_evaluate_rosters, score_cache
+from .roster_evaluation import evaluate_rosters
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.get('b', 'missing') == 'missing'
+    assert (cache.hits, cache.misses) == (3, 1)
+    assert len(cache) == 2
+
+@pytest.fixture
+def session_rosters(session_players):
+    session, player_sessions = session_players
+    positions = ['Skip', 'Vice', 'Second', 'Lead']
+    ids = [player_session.pk for player_session in player_sessions]
+    team_a = dict(zip(positions, ids[:4]))
+    team_b = dict(zip(positions, ids[4:]))
+    return session, [[team_a, team_b], [team_b, team_a], [dict(zip(positions, reversed(ids[:4]))), team_b]]
+
+@pytest.mark.django_db
+def test_cached_evaluate_rosters(session_rosters, django_assert_max_num_queries):
+    session, rosters = session_rosters
+    cache = LRUCache(10)
+    scores = cached_evaluate_rosters(rosters, session.pk, cache=cache)
+    assert scores == evaluate_rosters(rosters, session.pk)
+    assert len(cache) == 3
+
+    with django_assert_max_num_queries(0):
+        assert cached_evaluate_rosters(rosters, session.pk, cache=cache) == scores
+    scores[0]['extra'] = True
+    assert 'extra' not in cached_evaluate_rosters(rosters[:1], session.pk, cache=cache)[0]
+
+@pytest.mark.django_db
+def test_cached_scores_follow_the_callers_team_order(session_rosters):
+    session, rosters = session_rosters
+    # the first team played together last session, so its continuity differs from the second team's
+    previous = Session.objects.create(year=2023, session_number=1)
+    team_a = rosters[0][0]
+    players = [PlayerSession.objects.get(pk=team_a[position]).player for position in ['Skip', 'Vice', 'Second', 'Lead']]
+    Team.objects.create(session=previous, team_number=1, skip=players[0], vice=players[1], second=players[2], lead=players[3])
+
+    cache = LRUCache(10)
+    forward, backward = cached_evaluate_rosters(rosters[:2], session.pk, cache=cache)
+    assert forward['team_continuity_1'] == evaluate_rosters(rosters[:1], session.pk)[0]['team_continuity_1'] == [0.0, 1.0]
+    assert backward['team_continuity_1'] == [1.0, 0.0]
+
+@pytest.mark.django_db
+def test_score_cache_cleared_on_change(session_rosters):
+    session, rosters = session_rosters
+    cached_evaluate_rosters(rosters, session.pk)
+    assert len(score_cache) == 3
+
+    player_session = PlayerSession.objects.filter(session=session).first()
+    player_session.preferred_position1 = 'Lead'
+    player_session.save()
+    assert len(score_cache) == 0
@@ -0,0 +1,139 @@
+import random
+import pytest
+
+from .roster_engine import POSITIONS, WORKER_CONTEXT, CandidatePool, assign_teams, generate_snapshot_assignments, generate_snapshot_rosters, iter_snapshot_rosters, resolve_partners, roster_fingerprint, roster_seeds, unique_rosters
+
+@pytest.fixture
+def snapshot(make_snapshot):
+    return make_snapshot([
+        ('John Doe', 'Skip', 'Vice', 'Jane Smith'),
+        ('Jane Smith', 'Vice', 'Skip', 'John Doe'),
+        ('Bob Jones', 'Second', 'Lead', ''),
+        ('Alice Johnson', 'Lead', 'Second', ''),
+        ('Charlie Brown', 'Skip', '', 'Nobody Here'),
+        ('David White', 'Vice', '', ''),
+        ('Eve Black', 'Second', '', ''),
+        ('Frank Green', '', '', 'Eve Black'),
+    ])
+
+def test_resolve_partners(snapshot):
+    assert snapshot.players[0].partner == 1
+    assert snapshot.players[1].partner == 0
+    assert snapshot.players[2].partner is None
+    assert snapshot.players[4].partner is None
+    assert snapshot.players[7].partner == 6
+
+def test_resolve_partners_ignores_self(make_snapshot):
+    snapshot = make_snapshot([('John Doe', 'Skip', '', 'John Doe')])
+    assert snapshot.players[0].partner is None
+
+def test_player_for_id(snapshot):
+    assert snapshot.player_for_id(3).full_name == 'Bob Jones'
+    assert len(snapshot) == 8
+
+def test_assign_teams_places_everyone(snapshot):
+    teams, remaining = assign_teams(snapshot, use_play_with=True, rng=random.Random(1))
+    assert len(teams) == 2
+    assert remaining == []
+    assigned = sorted(team[position] for team in teams for position in POSITIONS)
+    assert assigned == [player.id for player in snapshot.players]
+
+def test_assign_teams_keeps_partners_together(snapshot):
+    for seed in range(20):
+        teams = generate_snapshot_assignments(snapshot, use_play_with=True, rng=random.Random(seed))
+        team_of = {team[position]: i for i, team in enumerate(teams) for position in POSITIONS}
+        assert team_of[1] == team_of[2]
+
+def test_assign_teams_is_reproducible(snapshot):
+    first = generate_snapshot_assignments(snapshot, rng=random.Random(42))
+    second = generate_snapshot_assignments(snapshot, rng=random.Random(42))
+    assert first == second
+
+def test_assign_teams_leaves_extra_players(snapshot, make_snapshot):
+    snapshot = make_snapshot([('Player %d' % i, 'Skip', '', '') for i in range(6)])
+    teams, remaining = assign_teams(snapshot, rng=random.Random(0))
+    assert len(teams) == 1
+    assert len(remaining) == 2
+
+def test_resolve_partners_prefers_resolved_links(make_snapshot):
+    snapshot = make_snapshot([('John Doe', 'Skip', '', 'Jane Smith'), ('Jane Smith', 'Vice', '', ''), ('Jane Smith', 'Second', '', '')])
+    # the link resolved at import time wins over name matching, and a known unresolvable request stays unlinked
+    resolve_partners(snapshot.players, {0: 3, 1: None})
+    assert snapshot.players[0].partner == 2
+    assert snapshot.players[1].partner is None
+
+def test_candidate_pool_pick_and_remove(snapshot):
+    pool = CandidatePool(snapshot.players)
+    assert len(pool) == 8
+    skips = {snapshot.players[0], snapshot.players[4]}
+    assert pool.pick('Skip', random.Random(0)) in skips
+
+    pool.remove(snapshot.players[0])
+    pool.remove(snapshot.players[4])
+    assert snapshot.players[0] not in pool
+    # with no first choice skips left, players who listed skip second are used
+    assert pool.pick('Skip', random.Random(0)) == snapshot.players[1]
+
+    pool.remove(snapshot.players[1])
+    assert pool.pick('Skip') is None
+    assert len(pool) == 5
+    assert sorted(player.index for player in pool) == [2, 3, 5, 6, 7]
+
+def test_candidate_pool_pick_any(make_snapshot):
+    snapshot = make_snapshot([('Player %d' % i, '', '', '') for i in range(3)])
+    pool = CandidatePool(snapshot.players)
+    picked = []
+    while len(pool):
+        player = pool.pick_any(random.Random(len(pool)))
+        pool.remove(player)
+        picked.append(player.index)
+    assert sorted(picked) == [0, 1, 2]
+    assert pool.pick_any() is None
+
+def test_generate_snapshot_rosters_is_reproducible(snapshot):
+    rosters = generate_snapshot_rosters(snapshot, 6, seed=7)
+    assert len(rosters) == 6
+    assert rosters == generate_snapshot_rosters(snapshot, 6, seed=7)
+    assert roster_seeds(7, 3) == roster_seeds(7, 6)[:3]
+
+def test_generate_snapshot_rosters_with_workers(snapshot):
+    assert generate_snapshot_rosters(snapshot, 8, seed=3, workers=2) == generate_snapshot_rosters(snapshot, 8, seed=3, workers=1)
+
+def test_workers_are_spawned_without_django():
+    from concurrent.futures import ProcessPoolExecutor
+    assert WORKER_CONTEXT.get_start_method() == 'spawn'
+    with ProcessPoolExecutor(max_workers=1, mp_context=WORKER_CONTEXT) as executor:
+        assert executor.submit(eval, "'django' in __import__('sys').modules").result() is False
+
+def test_snapshot_pickles(snapshot):
+    import pickle
+    restored = pickle.loads(pickle.dumps(snapshot))
+    assert [player.full_name for player in restored.players] == [player.full_name for player in snapshot.players]
+    assert restored.players[0].partner == 1
+    assert restored.index_by_id == snapshot.index_by_id
+
+def test_iter_snapshot_rosters_unbounded(snapshot):
+    from itertools import islice
+    rosters = iter_snapshot_rosters(snapshot, None, seed=5, workers=2)
+    first = list(islice(rosters, 10))
+    rosters.close()
+    assert first == generate_snapshot_rosters(snapshot, 10, seed=5)
+
+def test_roster_fingerprint_ignores_team_order():
+    team_a = {'Skip': 1, 'Vice': 2, 'Second': 3, 'Lead': None}
+    team_b = {'Skip': 5, 'Vice': 6, 'Second': 7, 'Lead': 8}
+    assert roster_fingerprint([team_a, team_b]) == roster_fingerprint([team_b, team_a])
+    assert roster_fingerprint([team_a, team_b]) != roster_fingerprint([{**team_a, 'Skip': 2, 'Vice': 1}, team_b])
+
+def test_unique_rosters():
+    team_a = {'Skip': 1, 'Vice': 2, 'Second': 3, 'Lead': 4}
+    team_b = {'Skip': 5, 'Vice': 6, 'Second': 7, 'Lead': 8}
+    rosters = [[team_a, team_b], [team_b, team_a], [team_b, {**team_a, 'Lead': None}], [team_a, team_b]]
+    assert list(unique_rosters(iter(rosters))) == [rosters[0], rosters[2]]
+    assert list(unique_rosters(iter(rosters), 1)) == [rosters[0]]
+
+    def endless():
+        while True:
+            yield [team_a, team_b]
+    assert list(unique_rosters(endless(), 5, patience=10)) == [[team_a, team_b]]
+
@@ -1,7 +1,10 @@
 import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from rosterizer.models import Player, PlayerSession, Session, Team
-from .roster_evaluation import evaluate_completeness, evaluate_incomplete_teams, evaluate_team_continuity
+from .utilities import SessionTimeline
+from .roster_evaluation import EvaluationContext, decaying_continuity_weights, evaluate_completeness, evaluate_completeness_batch, evaluate_incomplete_teams, evaluate_rosters, evaluate_team_continuity
 
 def generate_test_roster(players):
     '''Generate a test roster from the Mock PlayerSession objects'''
@@ -78,7 +81,7 @@ def mock_player_session(monkeypatch):
     monkeypatch.setattr('rosterizer.models.PlayerSession.objects.filter', mock_filter)
     monkeypatch.setattr('rosterizer.models.PlayerSession.objects.get', lambda pk: MockPlayerSession(pk, 1, MockPlayer(pk), MockTeam(pk)))
     monkeypatch.setattr('rosterizer.models.Team.objects.get', lambda pk: MockTeam(pk))
-    monkeypatch.setattr('rosterizer.roster_evaluation.get_previous_session', lambda session_id, session_lookback: 0 if session_id == 1 else None)
+    monkeypatch.setattr('rosterizer.roster_evaluation.get_session_timeline', lambda session_id=None: SessionTimeline([0, 1]))
     return players_store, MockPlayerSession, MockPlayer, MockTeam
 
 def test_evaluate_completeness_no_players(mock_player_session):
@@ -197,3 +200,55 @@ def test_evaluate_team_continuity_all_players_together(default_sessions, default
     
     roster = [{'Skip': 1, 'Vice': 2, 'Second': 4, 'Lead': 3}]
     assert evaluate_team_continuity(roster, default_sessions[1].pk) == [0]
+
+@pytest.mark.django_db
+def test_evaluate_rosters_query_count_does_not_grow_with_rosters(default_sessions, default_players):
+    Team.objects.create(pk=1, team_number=1, session=default_sessions[0],
+                        skip=default_players[0], vice=default_players[1], second=default_players[2], lead=default_players[3])
+    roster = [{'Skip': 1, 'Vice': 2, 'Second': 3, 'Lead': 4}, {'Skip': 5, 'Vice': 6, 'Second': 7, 'Lead': 8}]
+
+    with CaptureQueriesContext(connection) as one_roster:
+        single = evaluate_rosters([roster], default_sessions[1].pk)
+    with CaptureQueriesContext(connection) as many_rosters:
+        many = evaluate_rosters([roster] * 20, default_sessions[1].pk)
+
+    # the second call may even need fewer, since the session timeline is cached by then
+    assert len(many_rosters) <= len(one_roster)
+    assert many == single * 20
+    assert single[0]['team_continuity_1'] == [0, 1.0]
+
+@pytest.mark.django_db
+def test_evaluation_context_previous_teams(default_sessions, default_players):
+    Team.objects.create(pk=1, team_number=1, session=default_sessions[0],
+                        skip=default_players[0], vice=default_players[1], second=default_players[2], lead=None)
+    context = EvaluationContext(default_sessions[1].pk)
+    assert context.player_session_ids == frozenset(range(1, 9))
+    assert context.previous_session_ids == [default_sessions[0].pk, None, None]
+    assert context.previous_teams == [[frozenset({1, 2, 3})], None, None]
+
+@pytest.mark.django_db
+def test_evaluate_completeness_batch(default_sessions, default_players):
+    rosters = [
+        [{'Skip': 1, 'Vice': 2, 'Second': 3, 'Lead': 4}, {'Skip': 5, 'Vice': 6, 'Second': 7, 'Lead': 8}],
+        [{'Skip': 1, 'Vice': 2, 'Second': 3, 'Lead': None}, {'Skip': 5, 'Vice': 6, 'Second': None, 'Lead': 8}],
+        [{'Skip': 1, 'Vice': None, 'Second': None, 'Lead': None}],
+    ]
+    results = evaluate_completeness_batch(rosters, default_sessions[1].pk)
+    assert results == [(1.0, []), (0.4, [4, 7]), (0.0, [2, 3, 4, 5, 6, 7, 8])]
+    assert [score for score, _ in results] == [evaluate_completeness(roster, default_sessions[1].pk) for roster in rosters]
+
+@pytest.mark.django_db
+def test_evaluate_rosters_with_long_decaying_lookback(default_sessions, default_players, django_assert_max_num_queries):
+    Team.objects.create(pk=1, team_number=1, session=default_sessions[0],
+                        skip=default_players[0], vice=default_players[1], second=default_players[2], lead=default_players[3])
+    roster = [{'Skip': 1, 'Vice': 2, 'Second': 3, 'Lead': 4}, {'Skip': 5, 'Vice': 6, 'Second': 7, 'Lead': 8}]
+    weights = decaying_continuity_weights(12, 0.8)
+    assert weights[:2] == (1.0, 0.8)
+
+    with django_assert_max_num_queries(3):
+        score = evaluate_rosters([roster], default_sessions[1].pk, context=EvaluationContext(default_sessions[1].pk, weights=weights))[0]
+    assert score['team_continuity_1'] == [0, 1.0]
+    assert score['team_continuity_12'] == [1.0, 1.0]
+    # the team that played together last session halves the mean at full weight
+    assert score['score'] == pytest.approx(0.5)
+
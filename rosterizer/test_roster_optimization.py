@@ -0,0 +1,105 @@
+import random
+import pytest
+
+from rosterizer.models import Session, Team
+from .roster_engine import generate_snapshot_rosters
+from .roster_evaluation import evaluate_rosters
+from .roster_optimization import RosterState, ScoringModel, optimize_roster, optimize_rosters, optimize_states
+from .utilities import resolve_play_with
+
+@pytest.fixture
+def make_model(make_snapshot):
+    '''Returns a function building a scoring model from (position1, position2, play_with) tuples without touching the database'''
+    def make(rows, previous_teams=(None, None, None)):
+        return ScoringModel(make_snapshot(rows), list(previous_teams))
+    return make
+
+def test_roster_state_tracks_swaps(make_model):
+    model = make_model([('Lead', '', ''), ('Second', '', ''), ('Vice', '', ''), ('Skip', '', ''),
+                        ('Skip', '', ''), ('Vice', '', ''), ('Second', '', ''), ('Lead', '', '')],
+                       previous_teams=([frozenset({1, 2, 3}), frozenset({5, 6})], None, None))
+    roster = [{'Skip': 1, 'Vice': 2, 'Second': 3, 'Lead': 4}, {'Skip': 5, 'Vice': 6, 'Second': 7, 'Lead': 8}]
+    state = RosterState(model, roster)
+    assert state.preference_total == 4
+
+    # swapping skip and lead of the first team is an improvement and is kept
+    assert state.try_swap(0, 0, 0, 3)
+    assert state.preference_total == 6
+    assert state.score == RosterState(model, state.to_roster()).score
+
+    # trading vices splits up three players who were together last session
+    assert state.try_swap(0, 1, 1, 1)
+    assert state.continuity == [(0.66, 1.0, 1.0), (1.0, 1.0, 1.0)]
+
+    # putting a skip at vice costs position preference and is rejected
+    assert not state.try_swap(0, 0, 1, 1)
+    assert state.to_roster() == [{'Skip': 4, 'Vice': 6, 'Second': 3, 'Lead': 1}, {'Skip': 5, 'Vice': 2, 'Second': 7, 'Lead': 8}]
+    assert state.score == RosterState(model, state.to_roster()).score
+
+def test_optimize_roster_finds_preferred_positions(make_model):
+    rows = [(position, '', '') for _ in range(3) for position in ('Skip', 'Vice', 'Second', 'Lead')]
+    model = make_model(rows)
+    backwards = [{'Skip': 4 * t + 4, 'Vice': 4 * t + 3, 'Second': 4 * t + 2, 'Lead': 4 * t + 1} for t in range(3)]
+    state = optimize_roster(model, backwards, max_iterations=3000, rng=random.Random(1))
+    assert state.score == 1.0
+    for team in state.to_roster():
+        assert [model.snapshot.player_for_id(team[position]).preferred_position1 for position in team] == ['Skip', 'Vice', 'Second', 'Lead']
+
+def test_optimize_roster_keeps_partners_counted_once(make_model):
+    model = make_model([('Skip', '', 'Player 2'), ('Vice', '', 'Player 1'), ('Second', '', ''), ('Lead', '', '')],
+                       previous_teams=([frozenset({1, 2})], None, None))
+    state = RosterState(model, [{'Skip': 1, 'Vice': 2, 'Second': 3, 'Lead': 4}])
+    assert state.continuity == [(1.0, 1.0, 1.0)]
+
+@pytest.fixture
+def history(add_player_sessions, make_players):
+    previous = Session.objects.create(year=2024, session_number=1)
+    current = Session.objects.create(year=2024, session_number=2)
+    players = make_players(12)
+    for t in range(3):
+        Team.objects.create(session=previous, team_number=t + 1, skip=players[4 * t], vice=players[4 * t + 1], second=players[4 * t + 2], lead=players[4 * t + 3])
+    add_player_sessions(current, second_shift=1, partner_every=5, players=players)
+    resolve_play_with(current.pk)
+    return current
+
+@pytest.mark.django_db
+def test_scoring_model_matches_evaluate_rosters(history):
+    model = ScoringModel.load(history.pk)
+    rosters = generate_snapshot_rosters(model.snapshot, 5, seed=5)
+    for roster, roster_score in zip(rosters, evaluate_rosters(rosters, history.pk)):
+        assert RosterState(model, roster).score == pytest.approx(roster_score['score'])
+
+@pytest.mark.django_db
+def test_roster_state_details_match_evaluate_rosters(history):
+    model = ScoringModel.load(history.pk)
+    rosters = generate_snapshot_rosters(model.snapshot, 5, seed=3)
+    # drop a player so the unassigned list is not empty
+    rosters[0][0]['Lead'] = None
+    for roster, roster_score in zip(rosters, evaluate_rosters(rosters, history.pk)):
+        details = RosterState(model, roster).details()
+        assert details.keys() == roster_score.keys()
+        for key, value in roster_score.items():
+            assert details[key] == pytest.approx(value)
+
+@pytest.mark.django_db
+def test_optimize_states_keeps_details_current(history):
+    model = ScoringModel.load(history.pk)
+    states = [RosterState(model, roster) for roster in generate_snapshot_rosters(model.snapshot, 6, seed=4)]
+    optimized = optimize_states(states, top_n=2, max_iterations=500, seed=4)
+    assert len(optimized) == 2
+    for state, roster_score in zip(optimized, evaluate_rosters([state.to_roster() for state in optimized], history.pk)):
+        details = state.details()
+        assert details['score'] == pytest.approx(roster_score['score'])
+        assert details['team_continuity_1'] == pytest.approx(roster_score['team_continuity_1'])
+
+@pytest.mark.django_db
+def test_optimize_rosters(history):
+    model = ScoringModel.load(history.pk)
+    rosters = generate_snapshot_rosters(model.snapshot, 10, seed=2)
+    best_generated = max(score['score'] for score in evaluate_rosters(rosters, history.pk))
+
+    optimized = optimize_rosters(rosters, history.pk, top_n=3, max_iterations=2000, seed=2)
+    assert len(optimized) == 3
+    scores = [score['score'] for score in evaluate_rosters(optimized, history.pk)]
+    assert scores == sorted(scores, reverse=True)
+    assert scores[0] >= best_generated
@@ -0,0 +1,51 @@
+import pytest
+
+from .roster_evaluation import evaluate_rosters
+from .roster_pipeline import generate_rosters_within, generate_top_rosters, select_top_rosters
+
+def test_select_top_rosters():
+    scored = [(0.5, ['a']), (0.9, ['b']), (0.1, ['c']), (0.9, ['d']), (0.7, ['e'])]
+    assert select_top_rosters(iter(scored), 3) == [(['b'], 0.9), (['d'], 0.9), (['e'], 0.7)]
+    assert select_top_rosters(iter(scored), 10)[-1] == (['c'], 0.1)
+    assert select_top_rosters(iter([]), 3) == []
+
+def test_select_top_rosters_consumes_lazily():
+    def scored():
+        for i in range(10000):
+            yield i % 97 / 100, [i]
+    top = select_top_rosters(scored(), 2)
+    assert [score for _, score in top] == [0.96, 0.96]
+    assert [roster for roster, _ in top] == [[96], [193]]
+
+@pytest.mark.django_db
+def test_generate_top_rosters(session, add_player_sessions):
+    add_player_sessions(session, 12, positions=['Skip', 'Vice', 'Second', 'Lead', ''], second_shift=2)
+
+    top, explored = generate_top_rosters(session.pk, 50, keep=4, seed=9)
+    assert len(top) == 4
+    assert explored == 50
+    scores = [state.score for state in top]
+    assert scores == sorted(scores, reverse=True)
+    evaluated = evaluate_rosters([state.to_roster() for state in top], session.pk)
+    assert [score['score'] for score in evaluated] == pytest.approx(scores)
+
+@pytest.mark.django_db
+def test_generate_rosters_within(session_players):
+    session, _ = session_players
+
+    top, explored = generate_rosters_within(session.pk, 0.2, keep=3, seed=1)
+    assert len(top) == 3
+    assert explored > 3
+    # the first candidate is always explored, even with no time to spare
+    top, explored = generate_rosters_within(session.pk, 0, keep=3, seed=1)
+    assert len(top) == 1
+    assert explored == 1
+
+@pytest.mark.django_db
+def test_generate_top_rosters_counts_only_distinct_candidates(session, add_player_sessions):
+    # four players without preferences give far fewer than 1000 distinct rosters
+    add_player_sessions(session, 4, positions=[''])
+
+    top, explored = generate_top_rosters(session.pk, 1000, keep=5, seed=2)
+    assert explored < 1000
+    assert len(top) == min(5, explored)
@@ -0,0 +1,62 @@
+import json
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from rosterizer.models import RosterRun, Session
+from .roster_store import decode_rosters, encode_rosters, load_roster_run, load_scored_roster_run, save_roster_run
+
+def make_rosters(count, teams=20):
+    return [[{'Skip': 4 * t + 1 + r, 'Vice': 4 * t + 2, 'Second': 4 * t + 3 if t % 5 else None, 'Lead': 4 * t + 4} for t in range(teams)] for r in range(count)]
+
+def test_encode_rosters_round_trip():
+    rosters = make_rosters(100) + [[]]
+    data = encode_rosters(rosters)
+    assert decode_rosters(data) == rosters
+    # far smaller than the JSON the browser session used to carry
+    assert len(data) * 5 < len(json.dumps(rosters))
+
+@pytest.mark.django_db
+def test_load_roster_run(session):
+    rosters = make_rosters(3)
+    run = save_roster_run(session.pk, rosters, explored=50)
+    assert run.roster_count == 3
+    assert load_roster_run(run.pk, session.pk) == (rosters, 50)
+    # runs only belong to their own session
+    other = Session.objects.create(year=2024, session_number=2)
+    assert load_roster_run(run.pk, other.pk) is None
+    assert load_roster_run(None, session.pk) is None
+
+@pytest.mark.django_db
+def test_roster_runs_expire(session, settings):
+    settings.ROSTERIZER_ROSTER_RUN_TTL = 60
+    run = save_roster_run(session.pk, make_rosters(1))
+    RosterRun.objects.filter(pk=run.pk).update(last_used_at=timezone.now() - timedelta(seconds=61))
+    assert load_roster_run(run.pk, session.pk) is None
+
+    # expired runs are dropped when the next run is saved
+    save_roster_run(session.pk, make_rosters(1))
+    assert not RosterRun.objects.filter(pk=run.pk).exists()
+
+@pytest.mark.django_db
+def test_least_recently_used_runs_are_evicted(session, settings):
+    settings.ROSTERIZER_ROSTER_RUNS_KEPT = 2
+    first = save_roster_run(session.pk, make_rosters(1))
+    second = save_roster_run(session.pk, make_rosters(1))
+    RosterRun.objects.filter(pk=second.pk).update(last_used_at=timezone.now() - timedelta(seconds=10))
+    # reviewing the first run again keeps it over the second
+    load_roster_run(first.pk, session.pk)
+    third = save_roster_run(session.pk, make_rosters(1))
+    assert set(RosterRun.objects.values_list('pk', flat=True)) == {first.pk, third.pk}
+
+@pytest.mark.django_db
+def test_scores_are_stored_with_the_run(session, add_player_sessions, django_assert_max_num_queries):
+    ids = [player_session.pk for player_session in add_player_sessions(session, 4, positions=['Skip'])]
+    rosters = [[dict(zip(['Skip', 'Vice', 'Second', 'Lead'], ids))]]
+    run = save_roster_run(session.pk, rosters)
+
+    _, scores, _ = load_scored_roster_run(run.pk, session.pk)
+    assert RosterRun.objects.get(pk=run.pk).scores is not None
+    with django_assert_max_num_queries(2):
+        assert load_scored_roster_run(run.pk, session.pk) == (rosters, scores, 1)
@@ -0,0 +1,88 @@
+import random
+import time
+
+from .roster_engine import POSITIONS, generate_snapshot_assignments
+from .roster_evaluation import position_preference_value
+from .seat_assignment import MinCostFlow, assign_optimal_teams
+
+def preference_total(snapshot, teams):
+    total = 0
+    for team in teams:
+        for position in POSITIONS:
+            if team[position] is not None:
+                player = snapshot.player_for_id(team[position])
+                total += position_preference_value(player.preferred_position1, player.preferred_position2, position)
+    return total
+
+def test_min_cost_flow():
+    # two units from 0 to 3, the cheap path only fits one of them
+    flow = MinCostFlow(4)
+    cheap = flow.add_edge(0, 1, 1, 1)
+    flow.add_edge(0, 2, 2, 3)
+    flow.add_edge(1, 3, 2, 0)
+    flow.add_edge(2, 3, 2, 0)
+    assert flow.min_cost_flow(0, 3) == (3, 7)
+    assert flow.flow_on(cheap) == 1
+
+def test_assign_optimal_teams_beats_greedy(make_snapshot):
+    # greedy picks a skip from anyone who lists skip first; the optimum keeps the vice-only player at vice
+    rows = [('Skip', 'Vice', ''), ('Skip', '', ''), ('Vice', '', ''), ('Vice', 'Skip', ''),
+            ('Second', '', ''), ('Second', 'Lead', ''), ('Lead', '', ''), ('Lead', 'Second', '')]
+    snapshot = make_snapshot(rows)
+    teams, remaining = assign_optimal_teams(snapshot, rng=random.Random(0))
+    assert remaining == []
+    assert preference_total(snapshot, teams) == 8
+    for seed in range(10):
+        greedy = generate_snapshot_assignments(snapshot, rng=random.Random(seed))
+        assert preference_total(snapshot, greedy) <= 8
+
+def test_assign_optimal_teams_scarce_positions(make_snapshot):
+    rows = [('Skip', 'Vice', '')] * 4 + [('Skip', '', '')] * 2 + [('Lead', '', '')] * 2
+    snapshot = make_snapshot(rows)
+    teams, _ = assign_optimal_teams(snapshot, rng=random.Random(3))
+    # two skips at skip, two flexible players at vice, everyone else out of position
+    assert preference_total(snapshot, teams) == 2 + 1 + 2
+    assert {snapshot.player_for_id(team['Vice']).preferred_position2 for team in teams} == {'Vice'}
+
+def test_assign_optimal_teams_keeps_pairs_together(make_snapshot):
+    rows = [('Skip', '', 'Player 8'), ('Vice', '', ''), ('Second', '', ''), ('Lead', '', 'Player 5'),
+            ('Skip', '', 'Player 4'), ('Vice', '', ''), ('Second', '', ''), ('Lead', '', 'Player 1')]
+    snapshot = make_snapshot(rows)
+    for seed in range(10):
+        teams, remaining = assign_optimal_teams(snapshot, rng=random.Random(seed))
+        assert remaining == []
+        team_of = {team[position]: t for t, team in enumerate(teams) for position in POSITIONS}
+        assert team_of[1] == team_of[8]
+        assert team_of[4] == team_of[5]
+        assert preference_total(snapshot, teams) == 8
+
+def test_assign_optimal_teams_leaves_least_suited_players(make_snapshot):
+    rows = [('Skip', '', ''), ('Vice', '', ''), ('Second', '', ''), ('Lead', '', ''), ('Lead', '', ''), ('Lead', '', '')]
+    snapshot = make_snapshot(rows)
+    teams, remaining = assign_optimal_teams(snapshot, rng=random.Random(0))
+    assert len(teams) == 1
+    assert [player.preferred_position1 for player in remaining] == ['Lead', 'Lead']
+    assert preference_total(snapshot, teams) == 4
+
+def test_assign_optimal_teams_large_session(make_snapshot):
+    rng = random.Random(1)
+    choices = POSITIONS + ['']
+    rows = [(rng.choice(choices), rng.choice(choices), f'Player {i + 2}' if i % 10 == 0 else '') for i in range(400)]
+    snapshot = make_snapshot(rows)
+    start = time.perf_counter()
+    teams, remaining = assign_optimal_teams(snapshot, rng=rng)
+    assert time.perf_counter() - start < 1.0
+    assert len(teams) == 100
+    assert remaining == []
+
+def test_assign_optimal_teams_seats_pairs_greedily(make_snapshot):
+    # both pairs want Skip and Vice. The second pair has nowhere else to go, the first could take Second and Lead,
+    # so the optimum is 3, but seating the first pair first leaves 2.
+    rows = [('Skip', 'Second', 'Player 2'), ('Vice', 'Lead', 'Player 1'), ('Skip', '', 'Player 4'), ('Vice', '', 'Player 3')]
+    snapshot = make_snapshot(rows)
+    totals = {preference_total(snapshot, assign_optimal_teams(snapshot, rng=random.Random(seed))[0]) for seed in range(20)}
+    assert totals == {2, 3}
+
+    # without play with every player is a single and the flow finds the optimum every time
+    totals = {preference_total(snapshot, assign_optimal_teams(snapshot, use_play_with=False, rng=random.Random(seed))[0]) for seed in range(20)}
+    assert totals == {3}
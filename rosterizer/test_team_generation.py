@@ -1,7 +1,9 @@
 import json
 import pytest
-from .team_generation import generate_multiple_rosters, generate_team_assignments, generate_teams_for_session, hydrate_rosters, set_team_player
-from .team_generation import select_player_for_position
+from .roster_engine import roster_fingerprint
+from .team_generation import generate_multiple_rosters, generate_team_assignments, generate_teams_for_session, hydrate_rosters, load_session_snapshot
+from .roster_engine import select_player_for_position, set_team_player
+from .roster_engine import CandidatePool, SessionSnapshot
 from .models import Player, PlayerSessionDecoder, PlayerSessionEncoder, Session, PlayerSession, Team
 from django.core import serializers
 import random
@@ -72,42 +74,47 @@ def test_roster_serialization(players, player_sessions_rich, session):
     assert new_rosters == rosters
 
 def test_select_player_for_position(player_sessions_rich, player_sessions_sparse):
-    assert select_player_for_position('Skip', player_sessions_rich) in {player_sessions_rich[0], player_sessions_rich[4]}
-    assert select_player_for_position('Vice', player_sessions_rich) in {player_sessions_rich[1], player_sessions_rich[5]}
-    assert select_player_for_position('Second', player_sessions_rich) in {player_sessions_rich[2], player_sessions_rich[6]}
-    assert select_player_for_position('Lead', player_sessions_rich) in {player_sessions_rich[3], player_sessions_rich[7]}
-
-    assert select_player_for_position('Skip', player_sessions_sparse) == player_sessions_sparse[0]
-    assert select_player_for_position('Vice', player_sessions_sparse) == player_sessions_sparse[1]
-    assert select_player_for_position('Second', player_sessions_sparse) == player_sessions_sparse[2]
-    assert select_player_for_position('Lead', player_sessions_sparse) == player_sessions_sparse[3]
-
-    assert select_player_for_position('Skip', player_sessions_sparse[4:]) == player_sessions_sparse[4]
-    assert select_player_for_position('Vice', player_sessions_sparse[4:]) == player_sessions_sparse[5]
-    assert select_player_for_position('Second', player_sessions_sparse[4:]) == player_sessions_sparse[6]
-    assert select_player_for_position('Lead', player_sessions_sparse[4:]) == player_sessions_sparse[7]
-
-    assert select_player_for_position('Skip', []) == None
-    assert select_player_for_position('Vice', []) == None
-    assert select_player_for_position('Second', []) == None
-    assert select_player_for_position('Lead', []) == None
+    rich = SessionSnapshot.from_player_sessions(player_sessions_rich).players
+    sparse = SessionSnapshot.from_player_sessions(player_sessions_sparse).players
+
+    assert select_player_for_position('Skip', CandidatePool(rich)) in {rich[0], rich[4]}
+    assert select_player_for_position('Vice', CandidatePool(rich)) in {rich[1], rich[5]}
+    assert select_player_for_position('Second', CandidatePool(rich)) in {rich[2], rich[6]}
+    assert select_player_for_position('Lead', CandidatePool(rich)) in {rich[3], rich[7]}
+
+    assert select_player_for_position('Skip', CandidatePool(sparse)) == sparse[0]
+    assert select_player_for_position('Vice', CandidatePool(sparse)) == sparse[1]
+    assert select_player_for_position('Second', CandidatePool(sparse)) == sparse[2]
+    assert select_player_for_position('Lead', CandidatePool(sparse)) == sparse[3]
+
+    assert select_player_for_position('Skip', CandidatePool(sparse[4:])) == sparse[4]
+    assert select_player_for_position('Vice', CandidatePool(sparse[4:])) == sparse[5]
+    assert select_player_for_position('Second', CandidatePool(sparse[4:])) == sparse[6]
+    assert select_player_for_position('Lead', CandidatePool(sparse[4:])) == sparse[7]
+
+    assert select_player_for_position('Skip', CandidatePool()) == None
+    assert select_player_for_position('Vice', CandidatePool()) == None
+    assert select_player_for_position('Second', CandidatePool()) == None
+    assert select_player_for_position('Lead', CandidatePool()) == None
 
 def test_set_team_player(player_sessions_rich):
     team = {'Skip': None, 'Vice': None, 'Second': None, 'Lead': None}
-    player_sessions = player_sessions_rich.copy()
+    players = SessionSnapshot.from_player_sessions(player_sessions_rich).players
+    pool = CandidatePool(players)
 
-    set_team_player(team, 'Skip', player_sessions_rich[0], player_sessions)
+    set_team_player(team, 'Skip', players[0], pool)
     assert team['Skip'] == player_sessions_rich[0].pk
-    assert team['Skip'] not in player_sessions
-    set_team_player(team, 'Vice', player_sessions_rich[1], player_sessions)
+    assert players[0] not in pool
+    set_team_player(team, 'Vice', players[1], pool)
     assert team['Vice'] == player_sessions_rich[1].pk
-    assert team['Vice'] not in player_sessions
-    set_team_player(team, 'Second', player_sessions_rich[2], player_sessions)
+    assert players[1] not in pool
+    set_team_player(team, 'Second', players[2], pool)
     assert team['Second'] == player_sessions_rich[2].pk
-    assert team['Second'] not in player_sessions
-    set_team_player(team, 'Lead', player_sessions_rich[3], player_sessions)
+    assert players[2] not in pool
+    set_team_player(team, 'Lead', players[3], pool)
     assert team['Lead'] == player_sessions_rich[3].pk
-    assert team['Lead'] not in player_sessions
+    assert players[3] not in pool
+    assert len(pool) == 4
 
 @pytest.mark.django_db
 def test_generate_team_assignments(players, player_sessions_sparse, session):
@@ -159,9 +166,10 @@ def test_generate_team_assignments_with_missing_preferences(players, player_sess
     assert teams[0]['Vice'] == player_sessions_missing_preferences[1].pk
     assert teams[0]['Second'] == player_sessions_missing_preferences[2].pk
     assert teams[0]['Lead'] == player_sessions_missing_preferences[3].pk
+    # holes are filled from the candidate pool, which reorders its players as they are removed
     assert teams[1]['Skip'] == player_sessions_missing_preferences[4].pk
-    assert teams[1]['Vice'] == player_sessions_missing_preferences[6].pk
-    assert teams[1]['Second'] == player_sessions_missing_preferences[5].pk
+    assert teams[1]['Vice'] == player_sessions_missing_preferences[5].pk
+    assert teams[1]['Second'] == player_sessions_missing_preferences[6].pk
     assert teams[1]['Lead'] == player_sessions_missing_preferences[7].pk
     assert player_sessions == []
 
@@ -173,8 +181,8 @@ def test_generate_team_assignments_with_missing_preferences(players, player_sess
     assert teams[0]['Second'] == player_sessions_missing_preferences[2].pk
     assert teams[0]['Lead'] == player_sessions_missing_preferences[6].pk
     assert teams[1]['Skip'] == player_sessions_missing_preferences[4].pk
-    assert teams[1]['Vice'] == player_sessions_missing_preferences[7].pk
-    assert teams[1]['Second'] == player_sessions_missing_preferences[5].pk
+    assert teams[1]['Vice'] == player_sessions_missing_preferences[5].pk
+    assert teams[1]['Second'] == player_sessions_missing_preferences[7].pk
     assert teams[1]['Lead'] == player_sessions_missing_preferences[3].pk
     assert player_sessions == []
 
@@ -217,3 +225,80 @@ def test_hydrate_rosters(players, player_sessions_sparse, session):
     assert hydrated_rosters[1][1]['Lead'] == player_sessions_sparse[7]
 
 
+@pytest.mark.django_db
+def test_hydrate_rosters_uses_single_query(players, player_sessions_sparse, session, django_assert_num_queries):
+    for p in players: p.save()
+    session.save()
+    for ps in player_sessions_sparse: ps.save()
+
+    rosters = generate_multiple_rosters(session.pk, 20, False)
+    with django_assert_num_queries(1):
+        hydrated_rosters = hydrate_rosters(rosters)
+        # players come along with their player sessions
+        names = {team['Skip'].player.full_name for roster in hydrated_rosters for team in roster if team['Skip']}
+    assert names
+    with pytest.raises(PlayerSession.DoesNotExist):
+        hydrate_rosters([[{'Skip': 9999, 'Vice': None, 'Second': None, 'Lead': None}]])
+
+@pytest.mark.django_db
+def test_generate_multiple_rosters_uses_single_query(players, player_sessions_rich, session, django_assert_num_queries):
+    for p in players: p.save()
+    session.save()
+    for ps in player_sessions_rich: ps.save()
+
+    with django_assert_num_queries(1):
+        rosters = generate_multiple_rosters(session.pk, 5, True)
+    assert len(rosters) == 5
+
+@pytest.mark.django_db
+def test_load_session_snapshot(players, player_sessions_rich, session):
+    for p in players: p.save()
+    session.save()
+    for ps in player_sessions_rich: ps.save()
+
+    snapshot = load_session_snapshot(session.pk)
+    assert len(snapshot) == 8
+    assert snapshot.players[0].full_name == 'John Doe'
+    assert snapshot.players[0].partner == 1
+    assert snapshot.players[1].partner == 0
+    assert snapshot.players[4].partner is None  # 'David white' does not match exactly
+
+@pytest.mark.django_db
+def test_generate_multiple_rosters_workers(players, player_sessions_rich, session, settings):
+    for p in players: p.save()
+    session.save()
+    for ps in player_sessions_rich: ps.save()
+
+    settings.ROSTERIZER_GENERATION_WORKERS = 2
+    parallel = generate_multiple_rosters(session.pk, 6, True, seed=11)
+    assert parallel == generate_multiple_rosters(session.pk, 6, True, workers=1, seed=11)
+
+@pytest.mark.django_db
+def test_generate_multiple_rosters_optimal(players, player_sessions_sparse, session):
+    for p in players: p.save()
+    session.save()
+    for ps in player_sessions_sparse: ps.save()
+
+    rosters = generate_multiple_rosters(session.pk, 3, True, seed=4, assignment='optimal')
+    assert len(rosters) == 3
+    assert rosters == generate_multiple_rosters(session.pk, 3, True, seed=4, assignment='optimal')
+    for roster in rosters:
+        assert sorted(team[position] for team in roster for position in team) == [ps.pk for ps in player_sessions_sparse]
+    with pytest.raises(ValueError):
+        generate_multiple_rosters(session.pk, 1, assignment='fastest')
+
+@pytest.mark.django_db
+def test_generate_multiple_rosters_unique(players, player_sessions_rich, session):
+    for p in players: p.save()
+    session.save()
+    for ps in player_sessions_rich: ps.save()
+
+    # the preferences of this session leave room for only a couple of distinct rosters
+    rosters = generate_multiple_rosters(session.pk, 20, True, seed=3)
+    distinct = {roster_fingerprint(roster) for roster in rosters}
+    assert len(rosters) == 20 and len(distinct) < 20
+
+    unique = generate_multiple_rosters(session.pk, 20, True, seed=3, unique=True)
+    assert len(unique) == len(distinct)
+    assert {roster_fingerprint(roster) for roster in unique} == distinct
+
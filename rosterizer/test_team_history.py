@@ -0,0 +1,65 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from rosterizer.models import Team, TeamPair
+from .team_generation import apply_team_roster
+from .team_history import PairIndex, load_pair_indexes, rebuild_session_pairs
+
+def test_pair_index_max_overlap():
+    index = PairIndex()
+    index.add(1, {1, 2, 3, 4})
+    index.add(2, {5, 6, 7})
+    assert index.max_overlap({1, 2, 3, 4}) == 4
+    assert index.max_overlap({1, 2, 3, 8}) == 3
+    assert index.max_overlap({1, 5, 2, 6}) == 2
+    assert index.max_overlap({1, 5, 8, 9}) == 0
+    assert index.max_overlap(set()) == 0
+
+@pytest.fixture
+def players(make_players):
+    return make_players(8)
+
+def pairs_of_team(team):
+    return set(TeamPair.objects.filter(team=team).values_list('player_a_id', 'player_b_id'))
+
+@pytest.mark.django_db
+def test_saving_a_team_records_its_pairs(session, players):
+    team = Team.objects.create(session=session, team_number=1, skip=players[0], vice=players[1], second=players[2])
+    assert pairs_of_team(team) == {(players[0].pk, players[1].pk), (players[0].pk, players[2].pk), (players[1].pk, players[2].pk)}
+
+    team.second = None
+    team.lead = players[3]
+    team.save()
+    assert pairs_of_team(team) == {(players[0].pk, players[1].pk), (players[0].pk, players[3].pk), (players[1].pk, players[3].pk)}
+
+    team.delete()
+    assert not TeamPair.objects.exists()
+
+@pytest.mark.django_db
+def test_apply_team_roster_records_pairs(session, players, add_player_sessions):
+    player_sessions = add_player_sessions(session, positions=[''], players=players)
+    apply_team_roster(session.pk, [{'Skip': player_sessions[0].pk, 'Vice': player_sessions[1].pk, 'Second': player_sessions[2].pk, 'Lead': player_sessions[3].pk},
+                                   {'Skip': player_sessions[4].pk, 'Vice': player_sessions[5].pk, 'Second': None, 'Lead': None}])
+
+    index = load_pair_indexes([session.pk])[session.pk]
+    assert index.max_overlap({players[0].pk, players[1].pk, players[2].pk, players[3].pk}) == 4
+    assert index.max_overlap({players[3].pk, players[4].pk, players[5].pk}) == 2
+
+@pytest.mark.django_db
+def test_rebuild_session_pairs(session, players, django_assert_num_queries):
+    Team.objects.bulk_create([Team(session=session, team_number=1, skip=players[0], vice=players[1])])
+    assert not TeamPair.objects.exists()
+    rebuild_session_pairs([session.pk])
+    with django_assert_num_queries(1):
+        index = load_pair_indexes([session.pk])[session.pk]
+    assert index.pairs == {(players[0].pk, players[1].pk): [Team.objects.get().pk]}
+
+@pytest.mark.django_db
+def test_apply_team_roster_reads_player_sessions_once(session, players, add_player_sessions):
+    player_sessions = add_player_sessions(session, positions=[''], players=players)
+    teams = [{'Skip': player_sessions[4 * t].pk, 'Vice': player_sessions[4 * t + 1].pk, 'Second': player_sessions[4 * t + 2].pk, 'Lead': player_sessions[4 * t + 3].pk} for t in range(2)]
+    with CaptureQueriesContext(connection) as queries:
+        apply_team_roster(session.pk, teams)
+    assert len([query for query in queries if 'FROM "rosterizer_playersession"' in query['sql']]) == 1
+    assert [team.skip for team in Team.objects.filter(session=session).order_by('team_number')] == [players[0], players[4]]
@@ -1,7 +1,7 @@
 import pytest
 from django.test import RequestFactory
-from .utilities import get_previous_session
-from .models import Session
+from .utilities import SessionTimeline, bulk_upsert_players, check_player_issues, get_previous_session, get_session_timeline, resolve_play_with
+from .models import Player, PlayerSession, Session
 
 @pytest.mark.django_db
 def test_get_previous_session():
@@ -49,3 +49,117 @@ def test_get_previous_session():
     assert str(get_previous_session(sessions[7].pk, 3)) == str(sessions[4])
     assert str(get_previous_session(sessions[8].pk, 3)) == str(sessions[5])
     
+
+@pytest.fixture
+def play_with_session():
+    session = Session.objects.create(year=2024, session_number=1)
+    other_session = Session.objects.create(year=2024, session_number=2)
+    john = Player.objects.create(first_name='John', last_name='Doe')
+    jane = Player.objects.create(first_name='Jane', last_name='Smith')
+    bob = Player.objects.create(first_name='Bob', last_name='Jones')
+    Player.objects.create(first_name='Alice', last_name='Johnson')
+    player_sessions = [
+        PlayerSession.objects.create(player=john, session=session, years_curled=1, preferred_position1='Skip', preferred_position2='', play_with='jane  smith'),
+        PlayerSession.objects.create(player=jane, session=session, years_curled=1, preferred_position1='Vice', preferred_position2='', play_with='John Doe'),
+        PlayerSession.objects.create(player=bob, session=session, years_curled=1, preferred_position1='Fifth', preferred_position2='', play_with='Alice Johnson'),
+        PlayerSession.objects.create(player=bob, session=other_session, years_curled=1, preferred_position1='Lead', preferred_position2='', play_with='Nobody Here'),
+    ]
+    return session, player_sessions
+
+@pytest.mark.django_db
+def test_resolve_play_with(play_with_session):
+    session, player_sessions = play_with_session
+    assert resolve_play_with(session.pk) == 1
+
+    john, jane, bob, other = PlayerSession.objects.filter(pk__in=[ps.pk for ps in player_sessions]).order_by('pk')
+    assert john.play_with_session == jane
+    assert john.play_with_status == PlayerSession.PlayWithStatus.RESOLVED
+    assert jane.play_with_session == john
+    assert bob.play_with_session is None
+    assert bob.play_with_status == PlayerSession.PlayWithStatus.NOT_IN_SESSION
+    # other sessions are left alone
+    assert other.play_with_status == PlayerSession.PlayWithStatus.UNRESOLVED
+
+@pytest.mark.django_db
+def test_resolve_play_with_when_partner_joins(play_with_session):
+    session, _ = play_with_session
+    resolve_play_with(session.pk)
+    alice = Player.objects.get(first_name='Alice')
+    alice_session = PlayerSession.objects.create(player=alice, session=session, years_curled=1, preferred_position1='Lead', preferred_position2='', play_with='')
+
+    assert resolve_play_with(session.pk) == 0
+    bob = PlayerSession.objects.get(session=session, player__first_name='Bob')
+    assert bob.play_with_session == alice_session
+    assert bob.play_with_status == PlayerSession.PlayWithStatus.RESOLVED
+
+@pytest.mark.django_db
+def test_check_player_issues(play_with_session):
+    session, player_sessions = play_with_session
+    PlayerSession.objects.filter(pk=player_sessions[1].pk).update(play_with='Nobody Here')
+
+    issues = check_player_issues(session)
+    assert issues == [
+        'Player Jane Smith has an invalid play with (Nobody Here)',
+        'Player Bob Jones has an invalid preferred position 1 (Fifth)',
+        'Player Bob Jones has play with not registered in session (Alice Johnson)',
+    ]
+
+def test_session_timeline():
+    timeline = SessionTimeline([4, 2, 7, 1])
+    assert timeline.sessions_back(7) == 2
+    assert timeline.sessions_back(7, 2) == 4
+    assert timeline.sessions_back(7, 3) is None
+    assert timeline.previous_session_ids(1, 4) == [7, 2, 4, None]
+
+@pytest.mark.django_db
+def test_session_timeline_follows_session_changes(django_assert_num_queries):
+    first = Session.objects.create(year=2022, session_number=2)
+    second = Session.objects.create(year=2023, session_number=1)
+    get_session_timeline()
+    with django_assert_num_queries(0):
+        assert get_session_timeline().previous_session_ids(second.pk, 2) == [first.pk, None]
+
+    # a session that fills a gap in the history is picked up as soon as it is saved
+    between = Session.objects.create(year=2022, session_number=4)
+    assert get_session_timeline().previous_session_ids(second.pk, 2) == [between.pk, first.pk]
+    between.delete()
+    assert get_session_timeline().previous_session_ids(second.pk, 2) == [first.pk, None]
+
+@pytest.mark.django_db
+def test_bulk_upsert_players(django_assert_max_num_queries):
+    existing = Player.objects.create(first_name='John', last_name='Smith', email='old@example.com')
+    Player.objects.create(first_name='John', last_name='Doe')
+    rows = [
+        {'first_name': 'John', 'last_name': 'Smith', 'email': 'new@example.com', 'gender': 'M'},
+        {'first_name': 'Jane', 'last_name': 'Smith', 'email': 'jane@example.com', 'gender': 'F'},
+        {'first_name': 'Jane', 'last_name': 'Smith', 'email': 'jane2@example.com', 'gender': 'F'},
+    ]
+    with django_assert_max_num_queries(4):
+        players, created, updated = bulk_upsert_players(rows)
+
+    assert (created, updated) == (1, 1)
+    assert players[('John', 'Smith')].pk == existing.pk
+    assert Player.objects.get(pk=existing.pk).email == 'new@example.com'
+    assert players[('Jane', 'Smith')].email == 'jane2@example.com'
+    assert Player.objects.count() == 3
+    assert bulk_upsert_players([]) == ({}, 0, 0)
+
+
+@pytest.mark.django_db
+def test_resolve_play_with_by_token_prefix(play_with_session):
+    session, player_sessions = play_with_session
+    PlayerSession.objects.filter(pk=player_sessions[2].pk).update(play_with='J Doe')
+    resolve_play_with(session.pk)
+    bob = PlayerSession.objects.get(pk=player_sessions[2].pk)
+    assert bob.play_with_session_id == player_sessions[0].pk
+    assert bob.play_with_status == PlayerSession.PlayWithStatus.RESOLVED
+
+@pytest.mark.django_db
+def test_check_player_issues_reports_self_reference(play_with_session):
+    session, player_sessions = play_with_session
+    PlayerSession.objects.filter(pk=player_sessions[1].pk).update(play_with='Jane Smith', play_with_status='')
+
+    issues = check_player_issues(session)
+    assert 'Player Jane Smith has play with set to themselves (Jane Smith)' in issues
+    assert not any('not registered' in issue and 'Jane Smith' in issue for issue in issues if issue.startswith('Player Jane'))
+    assert PlayerSession.objects.get(pk=player_sessions[1].pk).play_with_status == PlayerSession.PlayWithStatus.SELF
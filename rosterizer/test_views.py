@@ -1,13 +1,14 @@
-import pytest
-from django.test import RequestFactory
+import json
 
-from rosterizer.models import Player, PlayerSession, Session, Team
-from .views import create_session, delete_session, import_players, import_roster
-from .forms import SessionForm
+import pytest
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.urls import reverse
 
-@pytest.fixture
-def rf():
-    return RequestFactory()
+from rosterizer.models import ImportJob, Player, PlayerSession, Session, Team
+from .views import create_session, delete_session, generate_teams, import_players, import_roster, roster_review, roster_review_data, select_roster
+from .roster_evaluation import evaluate_rosters
+from .roster_store import SESSION_KEY, load_roster_run, load_scored_roster_run, save_roster_run
+from .forms import MAX_KEEP, MAX_NUM_ROSTERS, GenerateTeamsForm, SessionForm
 
 @pytest.mark.django_db
 def test_create_session_and_delete_session(rf):
@@ -44,7 +45,8 @@ def test_import_players_with_invalid_file(rf):
     assert Player.objects.count() == 0
 
 @pytest.mark.django_db
-def test_import_players_with_valid_file(rf):
+def test_import_players_with_valid_file(rf, settings):
+    settings.ROSTERIZER_IMPORT_WORKERS = 0
     # create a session
     request = rf.post('/create_session/', {'year': '2024', 'session_number': '1'})
     response = create_session(request)
@@ -77,9 +79,12 @@ def test_import_players_with_valid_file(rf):
     assert playerSession.preferred_position1 == 'Skip'
     assert playerSession.preferred_position2 == 'Vice'
     assert playerSession.play_with == 'Jane Doe'
+    assert playerSession.play_with_session.player.full_name == 'Jane Doe'
+    assert playerSession.play_with_status == PlayerSession.PlayWithStatus.RESOLVED
 
 @pytest.mark.django_db
-def test_import_roster_with_valid_file(rf):
+def test_import_roster_with_valid_file(rf, settings):
+    settings.ROSTERIZER_IMPORT_WORKERS = 0
     # create a session
     request = rf.post('/create_session/', {'year': '2024', 'session_number': '1'})
     response = create_session(request)
@@ -93,7 +98,9 @@ def test_import_roster_with_valid_file(rf):
     request = rf.post(f'/import_roster/{session_id}/', {'roster_file': uploaded_file})
     response = import_roster(request, session_id)
     assert response.status_code == 302
-    assert response.url == '/rosterizer/sessions/'
+    job = ImportJob.objects.get()
+    assert response.url == f'/rosterizer/import_jobs/{job.pk}/'
+    assert job.status == ImportJob.Status.SUCCEEDED
     assert Player.objects.count() == 16
     assert Player.objects.first().first_name == 'John'
     assert Player.objects.first().last_name == 'Smith'
@@ -130,3 +137,181 @@ def test_import_roster_with_valid_file(rf):
 
 
 
+@pytest.mark.django_db
+def test_generate_teams_with_optimize(rf, session_players):
+    session, _ = session_players
+
+    request = rf.post(f'/sessions/{session.pk}/generate_teams/', {'num_rosters': '6', 'optimize': '1'})
+    request.session = {}
+    response = generate_teams(request, session.pk)
+    assert response.status_code == 302
+    rosters, _ = load_roster_run(request.session[SESSION_KEY], session.pk)
+    assert len(rosters) == 5
+    assert evaluate_rosters(rosters, session.pk)[0]['score'] == 1.0
+
+@pytest.mark.django_db
+def test_generate_teams_saves_the_scores_it_picked_rosters_by(rf, session_players, django_assert_max_num_queries):
+    session, _ = session_players
+
+    request = rf.post(f'/sessions/{session.pk}/generate_teams/', {'num_rosters': '6', 'keep': '3'})
+    request.session = {}
+    generate_teams(request, session.pk)
+    run_id = request.session[SESSION_KEY]
+    # the stored scores are read back as they are, without evaluating the rosters again
+    with django_assert_max_num_queries(2):
+        rosters, scores, _ = load_scored_roster_run(run_id, session.pk)
+    assert [score['score'] for score in scores] == pytest.approx([score['score'] for score in evaluate_rosters(rosters, session.pk)])
+
+@pytest.mark.django_db
+def test_generate_teams_with_time_budget(rf, session_players):
+    session, _ = session_players
+
+    request = rf.post(f'/sessions/{session.pk}/generate_teams/', {'time_budget': '0.1', 'keep': '2'})
+    request.session = {}
+    response = generate_teams(request, session.pk)
+    assert response.status_code == 302
+    rosters, explored = load_roster_run(request.session[SESSION_KEY], session.pk)
+    assert len(rosters) == 2
+    assert explored >= 2
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('data', [{'time_budget': 'nan'}, {'time_budget': 'soon'}, {'num_rosters': '0'}, {'keep': '0'}, {'keep': 'ten'}, {'assignment': 'bogus'}])
+def test_generate_teams_rejects_bad_input(rf, data):
+    session = Session.objects.create(year=2024, session_number=1)
+    request = rf.post(f'/sessions/{session.pk}/generate_teams/', data)
+    request.session = {}
+    response = generate_teams(request, session.pk)
+    assert response.status_code == 400
+    assert b'alert-danger' in response.content
+    assert SESSION_KEY not in request.session
+
+def test_generate_teams_form_clamps_to_limits(settings):
+    settings.ROSTERIZER_MAX_TIME_BUDGET = 5
+    form = GenerateTeamsForm({'num_rosters': '1000000', 'time_budget': '3600', 'keep': '500'})
+    assert form.is_valid()
+    assert form.cleaned_data == {'num_rosters': MAX_NUM_ROSTERS, 'time_budget': 5, 'keep': MAX_KEEP, 'assignment': 'random'}
+
+    form = GenerateTeamsForm({})
+    assert form.is_valid()
+    assert form.cleaned_data == {'num_rosters': 1, 'time_budget': 0, 'keep': 10, 'assignment': 'random'}
+
+@pytest.mark.django_db
+def test_roster_review_lists_unassigned_players(rf, session, add_player_sessions):
+    player_sessions = add_player_sessions(session, 5, positions=[''])
+
+    request = rf.get(f'/session/{session.pk}/roster_review/')
+    run = save_roster_run(session.pk, [[{'Skip': player_sessions[0].pk, 'Vice': player_sessions[1].pk, 'Second': player_sessions[2].pk, 'Lead': player_sessions[3].pk}]])
+    request.session = {SESSION_KEY: run.pk}
+    response = roster_review(request, session.pk)
+    assert response.status_code == 200
+
+    request = rf.get(f'/session/{session.pk}/roster_review/data/', {'draw': '1'})
+    request.session = {SESSION_KEY: run.pk}
+    data = json.loads(roster_review_data(request, session.pk).content)
+    assert data['data'][0]['unassigned'] == ['First4 Last4']
+    assert data['data'][0]['teams'] == ['First0 Last0 / First1 Last1 / First2 Last2 / First3 Last3']
+
+
+@pytest.fixture
+def review_run():
+    session = Session.objects.create(year=2024, session_number=1)
+    players = Player.objects.bulk_create([Player(first_name=f'First{i}', last_name=f'Last{i}') for i in range(80)])
+    player_sessions = PlayerSession.objects.bulk_create([
+        PlayerSession(player=player, session=session, years_curled=1, preferred_position1=['Skip', 'Vice', 'Second', 'Lead'][i % 4], preferred_position2='', play_with='')
+        for i, player in enumerate(players)
+    ])
+    ids = [player_session.pk for player_session in player_sessions]
+    # 1000 distinct rosters of 20 teams each, the later ones leaving a player out
+    rosters = [[dict(zip(['Skip', 'Vice', 'Second', 'Lead'], (ids[(4 * t + r) % 80], ids[(4 * t + r + 1) % 80], ids[(4 * t + r + 2) % 80],
+                                                             ids[(4 * t + r + 3) % 80] if t or r < 500 else None)))
+                for t in range(20)] for r in range(1000)]
+    return session, save_roster_run(session.pk, rosters)
+
+def datatables_request(rf, session, run, **params):
+    query = {'draw': '3', 'start': '0', 'length': '10', 'search[value]': '', 'columns[1][data]': 'roster', 'columns[2][data]': 'score'}
+    query.update(params)
+    request = rf.get(f'/session/{session.pk}/roster_review/data/', query)
+    request.session = {SESSION_KEY: run.pk}
+    return request
+
+@pytest.mark.django_db
+def test_roster_review_data_pages_and_sorts(rf, review_run, django_assert_max_num_queries):
+    session, run = review_run
+    data = json.loads(roster_review_data(datatables_request(rf, session, run), session.pk).content)
+    assert data['draw'] == 3
+    assert data['recordsTotal'] == data['recordsFiltered'] == 1000
+    assert [row['roster'] for row in data['data']] == list(range(1, 11))
+
+    # later pages are answered from the stored scores, hydrating only their own rows
+    with django_assert_max_num_queries(4):
+        data = json.loads(roster_review_data(datatables_request(rf, session, run, **{'start': '990', 'order[0][column]': '2', 'order[0][dir]': 'desc',
+                                                                                    'order[1][column]': '1', 'order[1][dir]': 'desc'}), session.pk).content)
+    assert len(data['data']) == 10
+    scores = [row['score'] for row in data['data']]
+    assert scores == sorted(scores, reverse=True)
+    assert len(data['data'][0]['teams']) == 20
+
+@pytest.mark.django_db
+def test_roster_review_data_filters_on_player_names(rf, review_run):
+    session, run = review_run
+    data = json.loads(roster_review_data(datatables_request(rf, session, run, **{'search[value]': 'first3 last3', 'length': '-1'}), session.pk).content)
+    # only the rosters seating First3 Last3 (and First30..First39) pass
+    assert 0 < data['recordsFiltered'] < 1000
+    assert all(any('First3' in team for team in row['teams']) for row in data['data'])
+    assert len(data['data']) == data['recordsFiltered']
+
+@pytest.mark.django_db
+def test_roster_review_data_without_a_run(rf):
+    session = Session.objects.create(year=2024, session_number=1)
+    request = rf.get(f'/session/{session.pk}/roster_review/data/', {'draw': '2'})
+    request.session = {}
+    response = roster_review_data(request, session.pk)
+    assert response.status_code == 200
+    data = json.loads(response.content)
+    assert data['draw'] == 2
+    assert data['data'] == []
+    assert 'generate them again' in data['error']
+
+@pytest.mark.django_db
+def test_roster_review_data_with_removed_players(rf, session_players):
+    session, player_sessions = session_players
+    ids = [player_session.pk for player_session in player_sessions]
+    roster = [dict(zip(['Skip', 'Vice', 'Second', 'Lead'], ids[:4])), dict(zip(['Skip', 'Vice', 'Second', 'Lead'], ids[4:]))]
+
+    # a run that went stale before it was reviewed cannot be scored and is dropped
+    stale = save_roster_run(session.pk, [roster])
+    player_sessions[0].delete()
+    request = rf.get(f'/session/{session.pk}/roster_review/data/', {'draw': '1'})
+    request.session = {SESSION_KEY: stale.pk}
+    data = json.loads(roster_review_data(request, session.pk).content)
+    assert 'error' in data
+    assert load_roster_run(stale.pk, session.pk) is None
+
+    # a run scored before a player was removed still lists its rows
+    roster[0]['Skip'] = ids[1]
+    roster[0]['Vice'] = None
+    run = save_roster_run(session.pk, [roster])
+    request.session = {SESSION_KEY: run.pk}
+    assert 'error' not in json.loads(roster_review_data(request, session.pk).content)
+    player_sessions[1].delete()
+    data = json.loads(roster_review_data(request, session.pk).content)
+    assert 'error' not in data
+    assert data['data'][0]['teams'][0] == '(removed player) /  / First2 Last2 / First3 Last3'
+
+@pytest.mark.django_db
+def test_select_roster_from_a_stale_run(rf, session_players):
+    session, player_sessions = session_players
+    ids = [player_session.pk for player_session in player_sessions]
+    run = save_roster_run(session.pk, [[dict(zip(['Skip', 'Vice', 'Second', 'Lead'], ids[:4])), dict(zip(['Skip', 'Vice', 'Second', 'Lead'], ids[4:]))]])
+    player_sessions[0].delete()
+
+    request = rf.post(f'/session/{session.pk}/select_roster/', {'selected_roster': '0'})
+    request.session = {SESSION_KEY: run.pk}
+    request._messages = FallbackStorage(request)
+    response = select_roster(request, session.pk)
+    assert response.status_code == 302
+    assert response.url == reverse('generate_teams_form', args=[session.pk])
+    assert 'have changed' in str(list(request._messages)[0])
+    assert SESSION_KEY not in request.session
+    assert load_roster_run(run.pk, session.pk) is None
+    assert not Team.objects.filter(session=session).exists()
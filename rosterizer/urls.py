@@ -10,6 +10,8 @@ urlpatterns = [
     path('players/', views.player_list, name='player_list'),
     path('clear_player_list/', views.clear_player_list, name='clear_player_list'),
     path('import_roster/<int:session_id>/', views.import_roster, name='import_roster'),
+    path('import_jobs/<int:job_id>/', views.import_job_detail, name='import_job_detail'),
+    path('import_jobs/<int:job_id>/status/', views.import_job_status, name='import_job_status'),
     path('session/<int:session_id>/teams/', views.team_list, name='team_list'),
     path('session/<int:session_id>/clear_teams/', views.clear_teams, name='clear_teams'),
     path('session/<int:session_id>/players/', views.players_in_session, name='players_in_session'),
@@ -17,5 +19,6 @@ urlpatterns = [
     path('sessions/<int:session_id>/generate_teams/', views.generate_teams, name='generate_teams'),
     path('session/<int:session_id>/generate_multiple_rosters/', views.generate_multiple_rosters, name='generate_multiple_rosters'),
     path('session/<int:session_id>/roster_review/', views.roster_review, name='roster_review'),
+    path('session/<int:session_id>/roster_review/data/', views.roster_review_data, name='roster_review_data'),
     path('session/<int:session_id>/select_roster/', views.select_roster, name='select_roster'),
 ]
@@ -1,6 +1,14 @@
+import hashlib
+import io
+import json
 import logging
+import os
 
-from .models import Player, PlayerSession, Session
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Player, PlayerSession, RosterRun, Session
+from .name_index import NameIndex, invalidate_play_with_suggestions, play_with_suggestions
 
 def parse_name(full_name):
     """
@@ -28,6 +36,61 @@ def parse_name(full_name):
     finally:
         return first_name,last_name
 
+class SessionTimeline:
+    """
+    Every session in (year, session_number) order, for constant time "n sessions back" lookups.
+
+    Use `get_session_timeline` to get the cached timeline rather than building one.
+    """
+    def __init__(self, session_ids):
+        self.session_ids = list(session_ids)
+        self.positions = {session_id: position for position, session_id in enumerate(self.session_ids)}
+
+    @classmethod
+    def load(cls):
+        return cls(Session.objects.order_by('year', 'session_number', 'pk').values_list('pk', flat=True))
+
+    def __contains__(self, session_id):
+        return session_id in self.positions
+
+    def __len__(self):
+        return len(self.session_ids)
+
+    def sessions_back(self, session_id, lookback=1):
+        """
+        Returns the id of the session `lookback` sessions before the given one, or None if the timeline
+        does not reach that far back.
+        """
+        position = self.positions[session_id] - lookback
+        return self.session_ids[position] if position >= 0 else None
+
+    def previous_session_ids(self, session_id, depth):
+        """
+        Returns the ids of the `depth` sessions before the given one, most recent first, padded with None
+        where the timeline runs out.
+        """
+        return [self.sessions_back(session_id, lookback) for lookback in range(1, depth + 1)]
+
+_session_timeline = None
+
+def get_session_timeline(session_id=None):
+    """
+    Returns the cached session timeline, loading it with a single query when needed.
+
+    The cache is dropped whenever a session is saved or deleted. Passing the session about to be looked up
+    also reloads the timeline if it does not know that session yet, e.g. one created by another process.
+    """
+    global _session_timeline
+    if _session_timeline is None or (session_id is not None and session_id not in _session_timeline):
+        _session_timeline = SessionTimeline.load()
+    return _session_timeline
+
+@receiver(post_save, sender=Session)
+@receiver(post_delete, sender=Session)
+def invalidate_session_timeline(sender=None, **kwargs):
+    global _session_timeline
+    _session_timeline = None
+
 def get_previous_session(session_id, session_lookback=1):
     """
     Retrieves the previous session object based on the given session.
@@ -37,31 +100,258 @@ def get_previous_session(session_id, session_lookback=1):
     Returns:
         Session: The previous session object, or None if no previous session exists.
     """
-    try:
-        session = Session.objects.get(pk=session_id)
-    except Session.DoesNotExist:
+    timeline = get_session_timeline(session_id)
+    if session_id not in timeline:
         raise ValueError(f'Session with id {session_id} does not exist')
-    
-    for i in range(session_lookback):
-        session = get_previous_session_internal(session)
-        if session is None:
-            break
 
-    return session
+    previous_session_id = timeline.sessions_back(session_id, session_lookback)
+    return Session.objects.get(pk=previous_session_id) if previous_session_id is not None else None
 
 def get_previous_session_internal(session):
-    previous_session = None
-    previous_sessions = Session.objects.filter(year=session.year, session_number__lt=session.session_number).order_by('session_number')
-    if previous_sessions.exists():
-        previous_session = previous_sessions.last()
-    else:
-        previous_sessions = Session.objects.filter(year=session.year-1).order_by('session_number')
-        if previous_sessions.exists():
-            previous_session = previous_sessions.last()
+    return get_previous_session(session.pk)
+
+class ChunkStream(io.RawIOBase):
+    """A read-only binary file over an iterator of byte chunks, such as `UploadedFile.chunks()`."""
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+def open_import_source(source):
+    """
+    Opens the source of an import as a binary file, so exports can be parsed straight from an upload.
+
+    Args:
+        source (str, file or iterable of bytes): A path, a binary file-like object such as an `UploadedFile`,
+            or an iterator of byte chunks.
+
+    Returns:
+        tuple: The binary file, and whether it was opened here and should be closed by the caller.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return open(source, 'rb'), True
+    if hasattr(source, 'read'):
+        return source, False
+    return io.BufferedReader(ChunkStream(source)), True
+
+# Player fields that an import row may set, besides the name
+PLAYER_IMPORT_FIELDS = ('home_phone', 'work_phone', 'cell_phone', 'email', 'gender')
+
+def bulk_upsert_players(player_rows):
+    """
+    Creates or updates the players of many import rows with a fixed number of queries.
+
+    Players are matched on (first_name, last_name) as `update_or_create` would. When a name appears in more
+    than one row the last row wins, and when the database already holds the name twice the oldest player is
+    updated. Call this inside a transaction.
+
+    Args:
+        player_rows (iterable of dict): Player field values keyed by field name, including first_name and last_name.
+
+    Returns:
+        tuple: A dict mapping (first_name, last_name) to the saved Player, the number of players created and the number updated.
+    """
+    rows_by_name = {}
+    for row in player_rows:
+        rows_by_name[(row['first_name'], row['last_name'])] = row
+    if not rows_by_name:
+        return {}, 0, 0
+
+    def load_players():
+        # one query for every name; the first and last name lists also match some mixed pairs, which are dropped here
+        players = {}
+        candidates = Player.objects.filter(first_name__in={first for first, _ in rows_by_name}, last_name__in={last for _, last in rows_by_name}).order_by('pk')
+        for player in candidates:
+            if (player.first_name, player.last_name) in rows_by_name:
+                players.setdefault((player.first_name, player.last_name), player)
+        return players
+
+    players = load_players()
+    updated = []
+    for name, player in players.items():
+        for field in PLAYER_IMPORT_FIELDS:
+            setattr(player, field, rows_by_name[name].get(field))
+        updated.append(player)
+    created = [
+        Player(first_name=first_name, last_name=last_name, **{field: row.get(field) for field in PLAYER_IMPORT_FIELDS})
+        for (first_name, last_name), row in rows_by_name.items() if (first_name, last_name) not in players
+    ]
+
+    if updated:
+        Player.objects.bulk_update(updated, PLAYER_IMPORT_FIELDS, batch_size=500)
+    if created:
+        Player.objects.bulk_create(created, batch_size=500)
+        # not every backend hands back the new primary keys, so read the players back
+        players = load_players()
+    return players, len(created), len(updated)
+
+# Player session fields that an import row sets
+PLAYER_SESSION_IMPORT_FIELDS = ('years_curled', 'preferred_position1', 'preferred_position2', 'play_with')
+
+def import_row_hash(row):
+    """
+    Hashes the content of one import row: the player and player session fields it would write.
+
+    Args:
+        row (dict): Field values of the row, as produced by the import commands.
+
+    Returns:
+        str: A 32 character hex digest that changes whenever any imported field does.
+    """
+    fields = ('first_name', 'last_name') + PLAYER_IMPORT_FIELDS + PLAYER_SESSION_IMPORT_FIELDS
+    content = json.dumps([row.get(field) for field in fields], separators=(',', ':'))
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+class ImportSummary:
+    """The player sessions an import created, updated, deleted and left alone."""
+    def __init__(self, created=0, updated=0, deleted=0, unchanged=0):
+        self.created = created
+        self.updated = updated
+        self.deleted = deleted
+        self.unchanged = unchanged
+
+    @property
+    def changed(self):
+        return bool(self.created or self.updated or self.deleted)
+
+    def to_dict(self):
+        return {'created': self.created, 'updated': self.updated, 'deleted': self.deleted, 'unchanged': self.unchanged}
+
+    def __str__(self):
+        return f'{self.created} added, {self.updated} updated, {self.deleted} removed, {self.unchanged} unchanged'
+
+def sync_session_players(session_id, player_rows):
+    """
+    Makes a session's player sessions match an import file, writing only what changed.
+
+    Each row is hashed with `import_row_hash` and compared to the hash stored on the player session of the
+    same player. Rows with a matching hash are skipped; new and changed rows upsert their player and write
+    their player session; player sessions with no row in the file, or duplicates of another, are deleted.
+    Re-importing an unchanged file therefore costs one query. When anything changed, the session's stored
+    roster runs are deleted too, since they may seat removed players and their scores are out of date.
+    Call this inside a transaction.
+
+    Args:
+        session_id (int): The session being imported.
+        player_rows (iterable of dict): Import rows, including first_name and last_name.
+
+    Returns:
+        tuple: A dict mapping (first_name, last_name) to the Player of every row, and an ImportSummary.
+    """
+    rows_by_name = {}
+    for row in player_rows:
+        rows_by_name[(row['first_name'], row['last_name'])] = row
+    hashes = {name: import_row_hash(row) for name, row in rows_by_name.items()}
+
+    existing = {}
+    removed = []
+    for player_session in PlayerSession.objects.filter(session_id=session_id).select_related('player').order_by('pk'):
+        name = (player_session.player.first_name, player_session.player.last_name)
+        if name in existing or name not in rows_by_name:
+            removed.append(player_session.pk)
         else:
-            previous_session = None
+            existing[name] = player_session
+
+    changed_names = [name for name in rows_by_name if name not in existing or existing[name].content_hash != hashes[name]]
+    players, _, _ = bulk_upsert_players(rows_by_name[name] for name in changed_names)
+    for name, player_session in existing.items():
+        players.setdefault(name, player_session.player)
+
+    created = []
+    updated = []
+    for name in changed_names:
+        player_session = existing.get(name)
+        if player_session is None:
+            player_session = PlayerSession(player=players[name], session_id=session_id)
+            created.append(player_session)
+        else:
+            updated.append(player_session)
+        for field in PLAYER_SESSION_IMPORT_FIELDS:
+            setattr(player_session, field, rows_by_name[name][field])
+        player_session.content_hash = hashes[name]
+
+    if removed:
+        PlayerSession.objects.filter(pk__in=removed).delete()
+    if updated:
+        PlayerSession.objects.bulk_update(updated, PLAYER_SESSION_IMPORT_FIELDS + ('content_hash',), batch_size=500)
+    if created:
+        PlayerSession.objects.bulk_create(created, batch_size=500)
+    if removed or created or updated:
+        RosterRun.objects.filter(session_id=session_id).delete()
+        # bulk writes send no signals, so cached roster scores and play with suggestions are dropped here
+        from .roster_cache import score_cache
+        score_cache.clear()
+        invalidate_play_with_suggestions()
+    return players, ImportSummary(len(created), len(updated), len(removed), len(rows_by_name) - len(changed_names))
+
+def resolve_play_with(session_id):
+    """
+    Links every play with request in a session to the partner's PlayerSession.
 
-    return previous_session
+    Requests are matched through a NameIndex of the session: exactly, then ignoring case, then by token
+    prefixes ('J Smith'), as long as only one player matches. Requests that cannot be linked keep a null
+    `play_with_session` and record why in `play_with_status`, so later checks are simple lookups. Call this
+    whenever players join the session, since a new player may resolve an earlier request.
+
+    Args:
+        session_id (int): The session whose player sessions should be resolved.
+
+    Returns:
+        int: The number of play with requests that could not be resolved.
+    """
+    Status = PlayerSession.PlayWithStatus
+    player_sessions = list(PlayerSession.objects.filter(session_id=session_id).select_related('player'))
+
+    session_index = NameIndex((player_session, player_session.player.full_name) for player_session in player_sessions)
+
+    club_index = None
+    changed = []
+    unresolved = 0
+    for player_session in player_sessions:
+        partner = None
+        status = Status.UNRESOLVED
+        if player_session.play_with:
+            partner = session_index.find(player_session.play_with)
+            if partner is not None and partner.pk != player_session.pk:
+                status = Status.RESOLVED
+            elif partner is not None:
+                partner = None
+                status = Status.SELF
+                unresolved += 1
+            else:
+                partner = None
+                if club_index is None:
+                    # the club is only read when a request cannot be met within the session
+                    club_index = NameIndex.for_players()
+                status = Status.NOT_IN_SESSION if club_index.lookup(player_session.play_with) else Status.UNKNOWN_PLAYER
+                unresolved += 1
+
+        partner_id = partner.pk if partner else None
+        if player_session.play_with_session_id != partner_id or player_session.play_with_status != status:
+            player_session.play_with_session_id = partner_id
+            player_session.play_with_status = status
+            changed.append(player_session)
+
+    if changed:
+        PlayerSession.objects.bulk_update(changed, ['play_with_session', 'play_with_status'])
+        # bulk updates send no signals, so cached roster scores and play with suggestions are dropped here
+        from .roster_cache import score_cache
+        score_cache.clear()
+        invalidate_play_with_suggestions()
+    return unresolved
 
 def check_player_issues(session):
     """
@@ -75,18 +365,49 @@ def check_player_issues(session):
 
     Examples:
         >>> check_player_issues(Session.objects.first())
-        ['Player John Doe is missing a phone number']
+        ['Player John Doe has an invalid play with (Jon Doe)']
     """
+    Status = PlayerSession.PlayWithStatus
+    player_sessions = PlayerSession.objects.filter(session_id=session.pk).select_related('player')
+    if player_sessions.filter(play_with_status=Status.UNRESOLVED).exclude(play_with='').exists():
+        # rows imported before play with links existed, resolve them once
+        resolve_play_with(session.pk)
+
+    suggestions = play_with_suggestions(session.pk)
     issues = []
-    player_sessions = PlayerSession.objects.filter(session_id=session.pk)
-    players = Player.objects.all()
     for player_session in player_sessions:
         if player_session.preferred_position1 and player_session.preferred_position1 not in ['Skip', 'Vice', 'Second', 'Lead']:
             issues.append(f'Player {player_session.player.full_name} has an invalid preferred position 1 ({player_session.preferred_position1})')
         if player_session.preferred_position2 and player_session.preferred_position2 not in ['Skip', 'Vice', 'Second', 'Lead']:
             issues.append(f'Player {player_session.player.full_name} has an invalid preferred position 2 ({player_session.preferred_position2})')
-        if player_session.play_with and not any(player_session.play_with in player.full_name for player in players):
-            issues.append(f'Player {player_session.player.full_name} has an invalid play with ({player_session.play_with})')
-        elif player_session.play_with and not any(player_session.play_with in ps.player.full_name for ps in player_sessions):
-            issues.append(f'Player {player_session.player.full_name} has play with not registered in session ({player_session.play_with})')
-    return issues
\ No newline at end of file
+        if player_session.play_with_status == Status.UNKNOWN_PLAYER:
+            issues.append(f'Player {player_session.player.full_name} has an invalid play with ({player_session.play_with}){did_you_mean(suggestions.get(player_session.pk))}')
+        elif player_session.play_with_status == Status.SELF:
+            issues.append(f'Player {player_session.player.full_name} has play with set to themselves ({player_session.play_with})')
+        elif player_session.play_with_status == Status.NOT_IN_SESSION:
+            issues.append(f'Player {player_session.player.full_name} has play with not registered in session ({player_session.play_with}){did_you_mean(suggestions.get(player_session.pk))}')
+    return issues
+
+def did_you_mean(suggestion):
+    # the ', did you mean ...?' hint for one entry of play_with_suggestions, or nothing
+    if not suggestion:
+        return ''
+    _, _, matches = suggestion
+    return f", did you mean {' or '.join(name for _, name, _ in matches)}?"
+
+def play_with_hints(session_id):
+    """
+    Describes the likely partners for the play with requests of a session that did not resolve.
+
+    Args:
+        session_id (int): The session to describe.
+
+    Returns:
+        list: One line per request that has a suggestion.
+
+    Examples:
+        >>> play_with_hints(session.pk)
+        ['Lucy White asked to play with Charie Brown, did you mean Charlie Brown?']
+    """
+    return [f'{requester} asked to play with {play_with}{did_you_mean((requester, play_with, matches))}'
+            for requester, play_with, matches in play_with_suggestions(session_id).values()]
@@ -1,15 +1,17 @@
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
-from django.core.files.storage import FileSystemStorage
 from django.contrib import messages
 
-from rosterizer.management.commands.import_players import ImportPlayersCommand
-from rosterizer.management.commands.import_roster import ImportRosterCsvCommand
 from rosterizer.utilities import check_player_issues
-from .forms import SessionForm, PlayerImportForm, RosterImportForm
-from .models import Player, PlayerSession, Session, Team
-from .team_generation import apply_team_roster, generate_multiple_rosters, generate_teams_for_session, hydrate_rosters
-from .roster_evaluation import evaluate_rosters
+from .forms import MAX_KEEP, MAX_NUM_ROSTERS, GenerateTeamsForm, SessionForm, PlayerImportForm, RosterImportForm, max_time_budget
+from .import_jobs import fail_stale_import_jobs, start_import_job
+from .models import ImportJob, Player, PlayerSession, Session, Team
+from .team_generation import ASSIGNMENTS, apply_team_roster, generate_multiple_rosters, generate_teams_for_session
+from .roster_optimization import optimize_states
+from .roster_pipeline import generate_rosters_within, generate_top_rosters
+from .roster_evaluation import continuity_weights
+from .roster_store import SESSION_KEY, delete_roster_run, get_roster_run, load_roster_run, load_scored_roster_run, rosters_are_current, save_roster_run
+from .roster_table import datatables_order, roster_table_page
 
 def create_session(request):
     if request.method == 'POST':
@@ -42,28 +44,30 @@ def import_players(request, session_id):
         form = PlayerImportForm(request.POST, request.FILES)
         if form.is_valid():
             html_file = request.FILES['player_file']
-            fs = FileSystemStorage()
-            filename = fs.save(html_file.name, html_file)
-            uploaded_file_path = fs.path(filename)
-
-            # if the file is a csv file, use the ImportRosterCsvCommand
-            if uploaded_file_path.endswith('.csv'):
-                import_command = ImportRosterCsvCommand()
-                import_command.handle(roster_file=uploaded_file_path, session_id=session_id, create_teams=False)
-                # messages.success(request, 'Roster imported successfully')
-                return redirect('session_list')
-            else:
-                # Invoke the import logic
-                import_command = ImportPlayersCommand()
-                import_command.handle(player_file=uploaded_file_path, session_id=session_id)
-
-                # messages.success(request, 'Players imported successfully')
-                return redirect('session_list')  # Adjust the redirect as needed
+
+            # if the file is a csv file, use the ImportRosterCsvCommand, otherwise the HTML ImportPlayersCommand
+            kind = ImportJob.Kind.ROSTER if html_file.name.endswith('.csv') else ImportJob.Kind.PLAYERS
+            job = ImportJob.objects.create(session=session, kind=kind, create_teams=False, file_name=html_file.name)
+            start_import_job(job, html_file)
+            return redirect('import_job_detail', job_id=job.pk)
     else:
         form = PlayerImportForm()
 
     return render(request, 'import_players.html', {'form': form, 'session': session})
 
+def import_job_detail(request, job_id):
+    fail_stale_import_jobs()
+    job = get_object_or_404(ImportJob, pk=job_id)
+    return render(request, 'import_job.html', {'job': job})
+
+def import_job_status(request, job_id):
+    fail_stale_import_jobs()
+    try:
+        job = ImportJob.objects.get(pk=job_id)
+        return JsonResponse(job.to_dict())
+    except ImportJob.DoesNotExist:
+        return JsonResponse({'error': 'ImportJob not found'}, status=404)
+
 def player_list(request):
     players = Player.objects.all()
     return render(request, 'player_list.html', {'players': players})
@@ -83,15 +87,9 @@ def import_roster(request, session_id):
         form = RosterImportForm(request.POST, request.FILES)
         if form.is_valid():
             roster_file = request.FILES['roster_file']
-            fs = FileSystemStorage()
-            filename = fs.save(roster_file.name, roster_file)
-            uploaded_file_path = fs.path(filename)
-
-            import_command = ImportRosterCsvCommand()
-            import_command.handle(roster_file=uploaded_file_path, session_id=session_id, create_teams=True)
-
-            # messages.success(request, 'Roster imported successfully')
-            return redirect('session_list')  # Adjust the redirect as needed
+            job = ImportJob.objects.create(session=session, kind=ImportJob.Kind.ROSTER, create_teams=True, file_name=roster_file.name)
+            start_import_job(job, roster_file)
+            return redirect('import_job_detail', job_id=job.pk)
     else:
         form = RosterImportForm()
 
@@ -102,38 +100,81 @@ def players_in_session(request, session_id):
     player_sessions = PlayerSession.objects.filter(session=session).select_related('player')
     return render(request, 'players_in_session.html', {'session': session, 'player_sessions': player_sessions})
 
-def generate_teams_form(request, session_id):
+def generate_teams_form(request, session_id, form=None):
     session = get_object_or_404(Session, pk=session_id)
     player_issues = check_player_issues(session)
 
-    return render(request, 'generate_teams.html', {'session': session, 'player_issues': player_issues})
+    context = {'session': session, 'player_issues': player_issues, 'form': form,
+               'max_num_rosters': MAX_NUM_ROSTERS, 'max_keep': MAX_KEEP, 'max_time_budget': max_time_budget(), 'assignments': ASSIGNMENTS}
+    return render(request, 'generate_teams.html', context, status=400 if form is not None and form.errors else 200)
 
 def generate_teams(request, session_id):
     if request.method == 'POST':
+        form = GenerateTeamsForm(request.POST)
+        if not form.is_valid():
+            return generate_teams_form(request, session_id, form)
         use_play_with = request.POST.get('use_play_with', 'on')
-        num_rosters = int(request.POST.get('num_rosters', 1))
-        rosters = generate_multiple_rosters(session_id, num_rosters, use_play_with)
-
-        request.session['generated_rosters'] = rosters
+        num_rosters = form.cleaned_data['num_rosters']
+        keep = form.cleaned_data['keep']
+        assignment = form.cleaned_data['assignment']
+        time_budget = form.cleaned_data['time_budget']
+        # only the best candidates are kept for review, however many are generated
+        if time_budget > 0:
+            states, explored = generate_rosters_within(session_id, time_budget, keep=keep, use_play_with=use_play_with, assignment=assignment)
+        else:
+            states, explored = generate_top_rosters(session_id, num_rosters, keep=keep, use_play_with=use_play_with, assignment=assignment)
+        if request.POST.get('optimize'):
+            states = optimize_states(states)
+
+        # the rosters stay on the server with the scores they were picked by; the browser session only remembers which run to review
+        rosters = [state.to_roster() for state in states]
+        scores = [state.details() for state in states]
+        request.session[SESSION_KEY] = save_roster_run(session_id, rosters, explored, scores=scores).pk
         return redirect('roster_review', session_id=session_id)
     else:
         return redirect('session_list')
 
 def roster_review(request, session_id):
-    rosters = request.session.get('generated_rosters', [])
-    if not rosters:
-        return redirect('session_list')  # Handle the case where rosters are not found
-    roster_scores = evaluate_rosters(rosters, session_id)
-
-    return render(request, 'roster_review.html', {'session_id': session_id, 'rosters': zip(hydrate_rosters(rosters), roster_scores)})
+    run = get_roster_run(request.session.get(SESSION_KEY), session_id)
+    if not run:
+        return redirect('session_list')  # Handle the case where rosters are not found or have expired
+    # the rows themselves are fetched a page at a time from roster_review_data
+    continuity_columns = range(1, len(continuity_weights()) + 1)
+    return render(request, 'roster_review.html', {'session_id': session_id, 'rosters_count': run.roster_count, 'explored': run.explored, 'continuity_columns': continuity_columns})
+
+# DataTables server-side endpoint for the roster review table. Problems are reported in the `error` field of
+# the response, which DataTables shows to the user, rather than as an HTTP error.
+def roster_review_data(request, session_id):
+    params = request.GET
+    try:
+        draw = int(params.get('draw', 0))
+        start = max(int(params.get('start', 0)), 0)
+        length = int(params.get('length', 10))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid paging parameters'}, status=400)
+
+    run = load_scored_roster_run(request.session.get(SESSION_KEY), session_id)
+    if not run:
+        return JsonResponse({'draw': draw, 'recordsTotal': 0, 'recordsFiltered': 0, 'data': [],
+                             'error': 'These rosters have expired or the players of the session have changed. Please generate them again.'})
+    rosters, scores, _ = run
+    filtered, rows = roster_table_page(session_id, rosters, scores, start=start, length=length, search=params.get('search[value]', ''), order=datatables_order(params))
+    return JsonResponse({'draw': draw, 'recordsTotal': len(rosters), 'recordsFiltered': filtered, 'data': rows})
 
 def select_roster(request, session_id):
     if request.method == 'POST':
         selected_roster_index = int(request.POST.get('selected_roster'))
 
-        rosters = request.session.get('generated_rosters', [])
-        if not rosters:
-            return redirect('session_list')  # Handle the case where rosters are not found
+        run = load_roster_run(request.session.get(SESSION_KEY), session_id)
+        if not run:
+            return redirect('session_list')  # Handle the case where rosters are not found or have expired
+
+        rosters, _ = run
+        # players removed from the session since the run was generated cannot be seated
+        if not rosters_are_current(rosters, session_id):
+            delete_roster_run(request.session.pop(SESSION_KEY))
+            messages.error(request, 'The players of the session have changed since these rosters were generated. Please generate them again.')
+            return redirect('generate_teams_form', session_id=session_id)
 
         selected_roster = rosters[selected_roster_index]
         apply_team_roster(session_id, selected_roster)        
@@ -131,6 +131,37 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Roster generation
+
+# Number of worker processes used to generate candidate rosters. 1 generates them in the request process.
+ROSTERIZER_GENERATION_WORKERS = 1
+
+# Number of roster scores kept in memory for the review page, least recently used first out.
+ROSTERIZER_SCORE_CACHE_SIZE = 1024
+
+# Team continuity weight for each session of lookback, most recent first. None uses the built in (1.0, 0.67, 0.33);
+# a longer fading history can be set with e.g. roster_evaluation.decaying_continuity_weights(12, 0.8).
+ROSTERIZER_CONTINUITY_WEIGHTS = None
+
+# Seconds a run of generated rosters is kept after it was last reviewed, and the most runs kept at once;
+# the least recently used runs go first.
+ROSTERIZER_ROSTER_RUN_TTL = 24 * 60 * 60
+ROSTERIZER_ROSTER_RUNS_KEPT = 100
+
+# Longest time budget, in seconds, a request may spend searching for rosters; longer requests are clamped to it.
+ROSTERIZER_MAX_TIME_BUDGET = 60
+
+# Imports
+
+# Number of background threads that run uploaded imports. 0 runs each import inside the upload request.
+ROSTERIZER_IMPORT_WORKERS = 1
+
+# Uploads wait under MEDIA_ROOT/imports until their background import has read them.
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Seconds a queued or running import may go without reporting progress before it is marked failed, e.g. after a restart.
+ROSTERIZER_IMPORT_JOB_TIMEOUT = 10 * 60
+
 # Logging configuration
 
 LOGGING = {